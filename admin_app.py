@@ -5,11 +5,12 @@ Rich Menu 管理後台 API
 from flask import Flask, render_template, jsonify, request, send_file
 from linebot.v3.messaging import (
     Configuration,
-    ApiClient,
     MessagingApi,
     MessagingApiBlob
 )
 from dotenv import load_dotenv
+from http_pool import pooled_api_client
+from profiling import install_profiling
 import os
 from richmenu.rich_menu_alias import MENU_IDS
 import io
@@ -17,6 +18,7 @@ import io
 load_dotenv()
 
 app = Flask(__name__)
+install_profiling(app)
 configuration = Configuration(
     access_token=os.getenv('LINE_CHANNEL_ACCESS_TOKEN'))
 
@@ -31,7 +33,7 @@ def index():
 def get_richmenus():
     """取得所有 Rich Menu 列表"""
     try:
-        with ApiClient(configuration) as api_client:
+        with pooled_api_client(configuration) as api_client:
             line_bot_api = MessagingApi(api_client)
             response = line_bot_api.get_rich_menu_list()
 
@@ -71,7 +73,7 @@ def get_richmenus():
 def get_richmenu(menu_id):
     """取得指定 Rich Menu 詳細資訊"""
     try:
-        with ApiClient(configuration) as api_client:
+        with pooled_api_client(configuration) as api_client:
             line_bot_api = MessagingApi(api_client)
             menu = line_bot_api.get_rich_menu(menu_id)
 
@@ -117,7 +119,7 @@ def get_richmenu_image(menu_id):
                 )
 
         # 如果本地沒有，嘗試從 LINE API 下載
-        with ApiClient(configuration) as api_client:
+        with pooled_api_client(configuration) as api_client:
             blob_api = MessagingApiBlob(api_client)
             image_data = blob_api.get_rich_menu_image(menu_id)
 
@@ -137,7 +139,7 @@ def get_richmenu_image(menu_id):
 def delete_richmenu(menu_id):
     """刪除指定 Rich Menu"""
     try:
-        with ApiClient(configuration) as api_client:
+        with pooled_api_client(configuration) as api_client:
             line_bot_api = MessagingApi(api_client)
             line_bot_api.delete_rich_menu(menu_id)
 
@@ -156,7 +158,7 @@ def delete_richmenu(menu_id):
 def get_default_richmenu():
     """取得預設 Rich Menu"""
     try:
-        with ApiClient(configuration) as api_client:
+        with pooled_api_client(configuration) as api_client:
             line_bot_api = MessagingApi(api_client)
 
             # LINE SDK v3 使用 get_default_rich_menu_id
@@ -191,7 +193,7 @@ def set_default_richmenu():
                 'error': '缺少 richMenuId'
             }), 400
 
-        with ApiClient(configuration) as api_client:
+        with pooled_api_client(configuration) as api_client:
             line_bot_api = MessagingApi(api_client)
             line_bot_api.set_default_rich_menu(menu_id)
 
@@ -210,7 +212,7 @@ def set_default_richmenu():
 def clear_default_richmenu():
     """清除預設 Rich Menu"""
     try:
-        with ApiClient(configuration) as api_client:
+        with pooled_api_client(configuration) as api_client:
             line_bot_api = MessagingApi(api_client)
             line_bot_api.delete_default_rich_menu()
 
@@ -229,7 +231,7 @@ def clear_default_richmenu():
 def get_aliases():
     """取得所有 Rich Menu Alias"""
     try:
-        with ApiClient(configuration) as api_client:
+        with pooled_api_client(configuration) as api_client:
             line_bot_api = MessagingApi(api_client)
             response = line_bot_api.get_rich_menu_alias_list()
 
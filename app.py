@@ -1,146 +1,277 @@
-from flask import Flask, request, abort
+from flask import Flask, Response, request, abort, jsonify
 from linebot.v3 import WebhookHandler
 from linebot.v3.exceptions import InvalidSignatureError
-from linebot.v3.messaging import (
-    Configuration,
-    ApiClient,
-    MessagingApi,
-    ReplyMessageRequest,
-    TextMessage,
-    FlexMessage,
-    FlexContainer
-)
+from linebot.v3.messaging import Configuration
 from linebot.v3.webhooks import (
+    LocationMessageContent,
     MessageEvent,
     TextMessageContent
 )
 from dotenv import load_dotenv
+from http_pool import pooled_api_client
 import os
 from weather_service import (
-    get_weather,
-    WeatherForecast,
-    normalize_city_name,
-    format_supported_cities_list
+    forecast_snapshot,
+    forecast_flight,
+    cwa_breaker,
+    observation_breaker,
+    township_breaker
+)
+from flex_cache import flex_render_cache
+from line_messaging import reply_raw_messages
+from line_rate_limit import outbound_limiter
+from message_handlers import (
+    RATE_LIMIT_NOTICE,
+    build_fallback_reply,
+    build_location_fallback,
+    build_location_reply,
+    build_text_reply
+)
+from rate_limiter import inbound_limiter
+from reply_scheduler import reply_scheduler
+from forecast_refresher import forecast_refresher, warm_start
+from observations import observation_refresher, observation_snapshot, start_observation_refresher
+from township_forecast import start_township_refresher, township_refresher, township_snapshot
+from event_dispatcher import (
+    EventDispatcher,
+    EventFilter,
+    dispatch_event,
+    parse_event,
+    verify_signature
 )
+from durable_queue import DurableEventQueue
+from dedupe_index import EventDedupeIndex
+from structured_logging import log_fields, setup_logging
+from metrics import (
+    WEBHOOK_EVENTS,
+    WEBHOOK_REQUESTS,
+    WEBHOOK_SKIPPED,
+    observe_stage,
+    render_metrics,
+    timed_stage
+)
+from profiling import install_profiling
 import json
 import traceback
-from datetime import datetime
 import logging
-import sys
 
 # 載入環境變數
 load_dotenv()
 
 app = Flask(__name__)
-stdout_handler = logging.StreamHandler(sys.stdout)
-stdout_handler.setLevel(logging.INFO)
-stdout_handler.setFormatter(logging.Formatter(
-    "%(asctime)s %(levelname)s [%(name)s] %(message)s"
-))
-app.logger.handlers.clear()
-app.logger.addHandler(stdout_handler)
-app.logger.setLevel(logging.INFO)
-app.logger.propagate = False
+setup_logging(app.logger)
+install_profiling(app)
+
+# 每則 webhook 的完整 request 紀錄（headers、body）的抽樣比例，0 ~ 1
+WEBHOOK_LOG_SAMPLE_RATE = float(os.getenv('WEBHOOK_LOG_SAMPLE_RATE', 1.0))
 
 # LINE Bot 設定
 configuration = Configuration(
     access_token=os.getenv('LINE_CHANNEL_ACCESS_TOKEN'))
 handler = WebhookHandler(os.getenv('LINE_CHANNEL_SECRET'))
+CHANNEL_SECRET = (os.getenv('LINE_CHANNEL_SECRET') or '').encode('utf-8')
 
+# 依 @handler.add 註冊的處理函式，只為需要的事件建立 SDK 模型
+event_filter = EventFilter.from_handler(handler)
 
-@app.route("/callback", methods=['POST'])
-def callback():
-    """LINE webhook callback endpoint"""
+# WEBHOOK_ASYNC_ACK=1：驗證簽章後立即回應 200，事件交給背景執行緒處理
+event_dispatcher = None
+if os.getenv('WEBHOOK_ASYNC_ACK', '0') == '1':
+    event_dispatcher = EventDispatcher(handler, app.logger)
 
-    # 取得 X-Line-Signature header
-    signature = request.headers.get('X-Line-Signature', '')
+# WEBHOOK_DURABLE_QUEUE=1：驗證簽章後寫入 SQLite 佇列，由 webhook_consumer.py 處理
+event_queue = None
+if os.getenv('WEBHOOK_DURABLE_QUEUE', '0') == '1':
+    event_queue = DurableEventQueue()
 
-    # 取得請求 body，LINE 驗簽要用原始 body
-    body = request.get_data(as_text=True)
+# WEBHOOK_DEDUPE=1（預設）：以 webhookEventId 略過已處理過的事件（LINE 重送），所有 worker 共用
+event_dedupe = None
+if os.getenv('WEBHOOK_DEDUPE', '1') == '1':
+    event_dedupe = EventDedupeIndex()
 
-    # Cloudflare / Proxy / Flask 看到的 IP
-    cf_connecting_ip = request.headers.get("CF-Connecting-IP")
-    x_forwarded_for = request.headers.get("X-Forwarded-For")
-    x_real_ip = request.headers.get("X-Real-IP")
-    remote_addr = request.remote_addr
+# RATE_LIMIT=1（預設）：限制每位使用者 / 每個群組的查詢頻率
+RATE_LIMIT = os.getenv('RATE_LIMIT', '1') == '1'
 
-    # 判斷最可能的真實來源 IP
-    # 如果有 Cloudflare，CF-Connecting-IP 通常就是 LINE 的來源 IP
-    client_ip = remote_addr
+# 先載入共用 / 磁碟上的快照，再背景更新全台預報，查詢時不再同步呼叫 CWA
+warm_start()
+start_township_refresher()
+start_observation_refresher()
 
-    if x_real_ip:
-        client_ip = x_real_ip.strip()
 
-    if x_forwarded_for:
-        client_ip = x_forwarded_for.split(",")[0].strip()
+def request_log_fields(client_ip: str, signature: str, body: str) -> dict:
+    """
+    整理 webhook request 要記錄的資訊
 
-    if cf_connecting_ip:
-        client_ip = cf_connecting_ip.strip()
+    Args:
+        client_ip: 判斷出的來源 IP
+        signature: X-Line-Signature
+        body: 原始 body
 
-    # 整理要記錄的資訊
-    log_data = {
-        "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    Returns:
+        欄位 dict（由 structured_logging 遮蔽敏感欄位後輸出）
+    """
+    # 直接讀 WSGI environ（dict 查詢），避免每個欄位都線性掃描一次 headers
+    req = request._get_current_object()
+    environ = req.environ
+    headers = dict(req.headers)
 
+    return {
         # 最重要：來源 IP
         "client_ip": client_ip,
-        "remote_addr": remote_addr,
-        "x_real_ip": x_real_ip,
-        "x_forwarded_for": x_forwarded_for,
-        "cf_connecting_ip": cf_connecting_ip,
+        "remote_addr": req.remote_addr,
+        "x_real_ip": environ.get("HTTP_X_REAL_IP"),
+        "x_forwarded_for": environ.get("HTTP_X_FORWARDED_FOR"),
+        "cf_connecting_ip": environ.get("HTTP_CF_CONNECTING_IP"),
 
         # Cloudflare 資訊
-        "cf_ray": request.headers.get("CF-Ray"),
-        "cf_ipcountry": request.headers.get("CF-IPCountry"),
-        "cf_visitor": request.headers.get("CF-Visitor"),
+        "cf_ray": environ.get("HTTP_CF_RAY"),
+        "cf_ipcountry": environ.get("HTTP_CF_IPCOUNTRY"),
+        "cf_visitor": environ.get("HTTP_CF_VISITOR"),
 
         # Request 基本資訊
-        "method": request.method,
-        "scheme": request.scheme,
-        "host": request.host,
-        "path": request.path,
-        "full_path": request.full_path,
-        "url": request.url,
-        "base_url": request.base_url,
-        "query_string": request.query_string.decode("utf-8", errors="replace"),
+        "method": req.method,
+        "scheme": req.scheme,
+        "host": req.host,
+        "path": req.path,
+        "full_path": req.full_path,
+        "url": req.url,
+        "base_url": req.base_url,
+        "query_string": req.query_string.decode("utf-8", errors="replace"),
 
         # Header 重點
-        "user_agent": request.headers.get("User-Agent"),
-        "content_type": request.headers.get("Content-Type"),
-        "content_length": request.headers.get("Content-Length"),
+        "user_agent": environ.get("HTTP_USER_AGENT"),
+        "content_type": environ.get("CONTENT_TYPE"),
+        "content_length": environ.get("CONTENT_LENGTH"),
         "x_line_signature_exists": bool(signature),
         "x_line_signature": signature,
 
         # Flask / WSGI 資訊
-        "access_route": list(request.access_route),
-        "server_protocol": request.environ.get("SERVER_PROTOCOL"),
-        "remote_port": request.environ.get("REMOTE_PORT"),
+        "access_route": list(req.access_route),
+        "server_protocol": environ.get("SERVER_PROTOCOL"),
+        "remote_port": environ.get("REMOTE_PORT"),
 
         # 全部 headers
-        "headers": dict(request.headers),
+        "headers": headers,
 
         # 原始 body
         "body": body
     }
 
-    app.logger.info(
-        "LINE Webhook Request Detail:\n%s",
-        json.dumps(log_data, ensure_ascii=False, indent=2)
+
+def process_webhook(body: bytes):
+    """
+    處理已驗證簽章的 webhook body
+
+    Args:
+        body: 原始 request body
+
+    Raises:
+        Exception: 同步處理事件失敗（回應 500，LINE 會重送）
+    """
+    # 沒有任何需要處理的事件類型（例如只有 RichMenuSwitchAction 的 postback）：不解析 JSON
+    if event_queue is None and not event_filter.might_match(body):
+        WEBHOOK_SKIPPED.labels('body').inc()
+        return
+
+    with observe_stage('parse'):
+        payload = json.loads(body)
+        WEBHOOK_EVENTS.observe(len(payload.get('events', [])))
+
+    if event_queue is None:
+        # 只保留有處理函式的事件，其餘不建立 SDK 模型
+        wanted = [event for event in payload.get('events', []) if event_filter.wants(event)]
+        WEBHOOK_SKIPPED.labels('event').inc(len(payload.get('events', [])) - len(wanted))
+        payload['events'] = wanted
+
+    # 重送的事件在寫入佇列 / 呼叫 CWA 與 LINE 之前就略過
+    if event_dedupe is not None:
+        with observe_stage('dedupe'):
+            payload['events'] = event_dedupe.filter_events(payload.get('events', []))
+
+    done = 0
+    try:
+        if event_queue is not None:
+            event_queue.enqueue(payload)
+        else:
+            with observe_stage('parse_events'):
+                events = [parse_event(event) for event in payload['events']]
+            destination = payload.get('destination')
+
+            if event_dispatcher is not None:
+                event_dispatcher.submit_events(events, destination)
+            else:
+                for event in events:
+                    dispatch_event(handler, event, destination)
+                    done += 1
+    except Exception:
+        # 回應 500 後 LINE 會重送：寫入佇列 / 解析失敗的全部事件與尚未處理完的事件
+        # 不能被當成重複略過
+        if event_dedupe is not None:
+            event_dedupe.forget_events(payload['events'][done:])
+        raise
+
+
+@app.route("/callback", methods=['POST'])
+@timed_stage('callback')
+def callback():
+    """LINE webhook callback endpoint"""
+
+    # 取得 X-Line-Signature header
+    signature = request.headers.get('X-Line-Signature', '')
+
+    # 取得請求 body，LINE 驗簽要用原始 bytes（只有記錄日誌時才解碼）
+    body = request.get_data()
+
+    # Cloudflare / Proxy / Flask 看到的 IP
+    cf_connecting_ip = request.headers.get("CF-Connecting-IP")
+    x_forwarded_for = request.headers.get("X-Forwarded-For")
+    x_real_ip = request.headers.get("X-Real-IP")
+    remote_addr = request.remote_addr
+
+    # 判斷最可能的真實來源 IP
+    # 如果有 Cloudflare，CF-Connecting-IP 通常就是 LINE 的來源 IP
+    client_ip = remote_addr
+
+    if x_real_ip:
+        client_ip = x_real_ip.strip()
+
+    if x_forwarded_for:
+        client_ip = x_forwarded_for.split(",")[0].strip()
+
+    if cf_connecting_ip:
+        client_ip = cf_connecting_ip.strip()
+
+    # 完整的 request 紀錄只在 INFO 啟用且抽樣命中時才組出來（簽章會被遮蔽）
+    log_fields(
+        app.logger, logging.INFO, "LINE Webhook Request Detail",
+        lambda: request_log_fields(client_ip, signature, body.decode('utf-8', errors='replace')),
+        sample_rate=WEBHOOK_LOG_SAMPLE_RATE
     )
 
     # 驗證請求來源
     try:
-        handler.handle(body, signature)
+        with observe_stage('signature'):
+            if not verify_signature(CHANNEL_SECRET, body, signature):
+                raise InvalidSignatureError('Invalid signature. signature=' + signature)
+
+        process_webhook(body)
 
     except InvalidSignatureError:
-        app.logger.warning(
-            "Invalid signature. client_ip=%s, cf_connecting_ip=%s, body=%s",
-            client_ip,
-            cf_connecting_ip,
-            body
+        WEBHOOK_REQUESTS.labels('invalid_signature').inc()
+        # 與 request 詳細紀錄相同：抽樣寫入、欄位經過遮蔽
+        log_fields(
+            app.logger, logging.WARNING, "Invalid signature",
+            lambda: {
+                "client_ip": client_ip,
+                "cf_connecting_ip": cf_connecting_ip,
+                "body": body.decode('utf-8', errors='replace'),
+            },
+            sample_rate=WEBHOOK_LOG_SAMPLE_RATE
         )
         abort(400)
 
     except Exception as ex:
+        WEBHOOK_REQUESTS.labels('error').inc()
         app.logger.error(
             "Webhook exception. client_ip=%s, error=%s, traceback=%s",
             client_ip,
@@ -149,6 +280,7 @@ def callback():
         )
         abort(500)
 
+    WEBHOOK_REQUESTS.labels('ok').inc()
     app.logger.info(
         "LINE Webhook OK. client_ip=%s, cf_connecting_ip=%s, cf_ray=%s",
         client_ip,
@@ -159,81 +291,73 @@ def callback():
     return 'OK'
 
 
+def respond(event, build, fallback):
+    """
+    依查詢頻率限制回覆訊息事件
+
+    Args:
+        event: MessageEvent
+        build: 產生回覆訊息列表的函式
+        fallback: 期限內來不及完成時先回覆的訊息列表的函式
+    """
+    # 超過頻率時只回覆一次固定的提示，不查詢天氣
+    decision = inbound_limiter.check(event) if RATE_LIMIT else 'allow'
+    if decision != 'allow':
+        if decision == 'notify':
+            with pooled_api_client(configuration) as api_client:
+                reply_raw_messages(api_client, event.reply_token, [RATE_LIMIT_NOTICE])
+        return
+
+    # 訊息已預先序列化，直接送出，不再經過 SDK 模型驗證；
+    # 期限內來不及準備時先回覆快取的卡片，最新結果稍後推播
+    with pooled_api_client(configuration) as api_client:
+        reply_scheduler.respond(api_client, event, build, fallback)
+
+
 @handler.add(MessageEvent, message=TextMessageContent)
 def handle_message(event):
     """處理文字訊息 - 天氣查詢 (地區切換已由 RichMenuSwitchAction 處理)"""
-    user_message = event.message.text.strip()
-    user_id = event.source.user_id
-
-    # 檢查是否以「天氣」開頭
-    if not user_message.startswith("天氣"):
-        cities_list = format_supported_cities_list()
-        help_text = f"請輸入「天氣 城市名稱」\n\n{cities_list}"
-        with ApiClient(configuration) as api_client:
-            line_bot_api = MessagingApi(api_client)
-            line_bot_api.reply_message_with_http_info(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[TextMessage(text=help_text)]
-                )
-            )
-        return
+    text = event.message.text
+    respond(event, lambda: build_text_reply(text), lambda: build_fallback_reply(text))
 
-    # 提取城市名稱（移除「天氣」和空格）
-    city_input = user_message[2:].strip()
-
-    if not city_input:
-        cities_list = format_supported_cities_list()
-        help_text = f"請輸入城市名稱\n\n{cities_list}"
-        with ApiClient(configuration) as api_client:
-            line_bot_api = MessagingApi(api_client)
-            line_bot_api.reply_message_with_http_info(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[TextMessage(text=help_text)]
-                )
-            )
-        return
 
-    # 正規化城市名稱
-    city_name = normalize_city_name(city_input)
-
-    # 使用 WeatherForecast 類別取得天氣資訊
-    forecast = WeatherForecast(location=city_name)
-    forecast.fetch()
-
-    # 嘗試使用 Flex Message
-    flex_data = forecast.get_flex_message()
-
-    with ApiClient(configuration) as api_client:
-        line_bot_api = MessagingApi(api_client)
-
-        if flex_data:
-            # 使用漂亮的 Flex Message 回覆
-            flex_msg = FlexMessage(
-                alt_text=flex_data["altText"],
-                contents=FlexContainer.from_dict(flex_data["contents"])
-            )
-            line_bot_api.reply_message_with_http_info(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[flex_msg]
-                )
-            )
-        else:
-            # 降級使用純文字回覆
-            line_bot_api.reply_message_with_http_info(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[TextMessage(text=forecast.result)]
-                )
-            )
+@handler.add(MessageEvent, message=LocationMessageContent)
+def handle_location(event):
+    """處理位置訊息 - 回覆最近的鄉鎮（或縣市）天氣"""
+    lat, lon = event.message.latitude, event.message.longitude
+    respond(event, lambda: build_location_reply(lat, lon), lambda: build_location_fallback(lat, lon))
+
+
+@app.route("/metrics", methods=['GET'])
+def metrics():
+    """Prometheus 指標（gunicorn 多 worker 時彙總全部 worker）"""
+    data, content_type = render_metrics()
+    return Response(data, content_type=content_type)
 
 
 @app.route("/health", methods=['GET'])
 def health():
-    """健康檢查 endpoint"""
-    return 'OK', 200
+    """健康檢查 endpoint（含預報快照、斷路器與更新器狀態）"""
+    return jsonify({
+        'status': 'OK',
+        'forecast_snapshot': forecast_snapshot.status(),
+        'cwa_breaker': cwa_breaker.status(),
+        'cwa_township_breaker': township_breaker.status(),
+        'cwa_observation_breaker': observation_breaker.status(),
+        'forecast_singleflight': forecast_flight.stats(),
+        'flex_render_cache': flex_render_cache.stats(),
+        'webhook_dispatcher': event_dispatcher.stats() if event_dispatcher else None,
+        'webhook_queue': event_queue.stats() if event_queue else None,
+        'webhook_dedupe': event_dedupe.stats() if event_dedupe else None,
+        'reply_scheduler': reply_scheduler.stats(),
+        'rate_limiter': inbound_limiter.stats() if RATE_LIMIT else None,
+        'line_outbound_limiter': outbound_limiter.stats(),
+        'forecast_refresher': forecast_refresher.status(),
+        'township_forecast': township_snapshot.status(),
+        'township_refresher': township_refresher.status(),
+        'observations': observation_snapshot.status(),
+        'observation_refresher': observation_refresher.status()
+    }), 200
 
 
 if __name__ == "__main__":
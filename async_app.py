@@ -0,0 +1,304 @@
+"""
+asyncio 版 LINE webhook 入口（與 app.py 共用 message_handlers 的回覆邏輯）
+
+LINE 回覆與 CWA 輪詢都走 aiohttp，單一行程可同時處理大量等待網路 I/O 的 webhook。
+
+執行方式：
+    gunicorn async_app:app --bind 0.0.0.0:5000 --worker-class aiohttp.GunicornWebWorker
+    python async_app.py
+"""
+import asyncio
+import json
+import logging
+import os
+
+import aiohttp
+from aiohttp import web
+from dotenv import load_dotenv
+from linebot.v3.exceptions import InvalidSignatureError
+from linebot.v3.messaging import AsyncApiClient, Configuration
+from linebot.v3.webhooks import LocationMessageContent, MessageEvent, TextMessageContent
+
+from flex_cache import flex_render_cache
+from forecast_refresher import attach_shared_store, forecast_refresher
+from dedupe_index import EventDedupeIndex
+from event_dispatcher import EventFilter, parse_event, verify_signature
+from line_messaging import reply_raw_messages_async
+from message_handlers import (
+    RATE_LIMIT_NOTICE,
+    build_fallback_reply,
+    build_location_fallback,
+    build_location_reply,
+    build_text_reply
+)
+from rate_limiter import inbound_limiter
+from metrics import (
+    WEBHOOK_EVENTS,
+    WEBHOOK_REQUESTS,
+    WEBHOOK_SKIPPED,
+    observe_stage,
+    render_metrics
+)
+from observations import observation_refresher, observation_snapshot, observations_enabled
+from reply_scheduler import reply_scheduler
+from singleflight import AsyncSingleFlight
+from township_forecast import township_enabled, township_refresher, township_snapshot
+from snapshot_persistence import enable_snapshot_persistence
+from structured_logging import log_fields, setup_logging
+from weather_service import (
+    CWA_API_KEY,
+    FORECAST_DATASET,
+    cwa_breaker,
+    forecast_snapshot,
+    observation_breaker,
+    township_breaker
+)
+
+# 載入環境變數
+load_dotenv()
+
+logger = logging.getLogger('async_app')
+setup_logging(logger)
+
+# 簽章錯誤時記錄 request body 的抽樣比例，0 ~ 1（與 app.py 相同）
+WEBHOOK_LOG_SAMPLE_RATE = float(os.getenv('WEBHOOK_LOG_SAMPLE_RATE', 1.0))
+
+# LINE API 同時開啟的連線上限（aiohttp TCPConnector limit）
+LINE_ASYNC_POOL_MAXSIZE = int(os.getenv('LINE_ASYNC_POOL_MAXSIZE', 100))
+
+# LINE Bot 設定
+configuration = Configuration(
+    access_token=os.getenv('LINE_CHANNEL_ACCESS_TOKEN'))
+configuration.connection_pool_maxsize = LINE_ASYNC_POOL_MAXSIZE
+CHANNEL_SECRET = (os.getenv('LINE_CHANNEL_SECRET') or '').encode('utf-8')
+
+# dispatch 只處理文字與位置訊息，其餘事件不建立 SDK 模型
+event_filter = EventFilter({('message', 'text'), ('message', 'location')})
+
+# 冷啟動時多則訊息同時等待快照，只向 CWA 請求一次
+async_forecast_flight = AsyncSingleFlight('forecast')
+
+# WEBHOOK_DEDUPE=1（預設）：以 webhookEventId 略過已處理過的事件（LINE 重送），所有 worker 共用
+event_dedupe = None
+if os.getenv('WEBHOOK_DEDUPE', '1') == '1':
+    event_dedupe = EventDedupeIndex()
+
+# RATE_LIMIT=1（預設）：限制每位使用者 / 每個群組的查詢頻率
+RATE_LIMIT = os.getenv('RATE_LIMIT', '1') == '1'
+
+LINE_API_CLIENT = web.AppKey('line_api_client', AsyncApiClient)
+CWA_SESSION = web.AppKey('cwa_session', aiohttp.ClientSession)
+
+
+async def ensure_snapshot(session: aiohttp.ClientSession):
+    """
+    快照完全沒有資料時等待一次 CWA 更新（背景更新器啟動前的冷啟動）
+
+    Args:
+        session: CWA 用的 aiohttp ClientSession
+    """
+    if forecast_snapshot.shared_store is not None:
+        forecast_snapshot.sync_from_store()
+    if forecast_snapshot.locations or not CWA_API_KEY:
+        return
+
+    await async_forecast_flight.do(
+        (FORECAST_DATASET, '*'), forecast_refresher.run_once_async, session)
+
+
+async def respond(app: web.Application, event: MessageEvent, build_reply, fallback):
+    """
+    依查詢頻率限制回覆訊息事件
+
+    Args:
+        app: aiohttp 應用程式
+        event: MessageEvent
+        build_reply: 產生回覆訊息列表的函式（快照就緒後執行）
+        fallback: 期限內來不及完成時先回覆的訊息列表的函式
+    """
+    # 超過頻率時只回覆一次固定的提示，不查詢天氣
+    decision = inbound_limiter.check(event) if RATE_LIMIT else 'allow'
+    if decision != 'allow':
+        if decision == 'notify':
+            await reply_raw_messages_async(app[LINE_API_CLIENT], event.reply_token, [RATE_LIMIT_NOTICE])
+        return
+
+    async def build():
+        await ensure_snapshot(app[CWA_SESSION])
+        # 沒有背景更新器（FORECAST_REFRESHER=0）時快照過期會同步呼叫 CWA：在執行緒中組裝，不阻塞 event loop
+        return await asyncio.get_running_loop().run_in_executor(None, build_reply)
+
+    # 冷啟動等待 CWA 超過期限時先回覆快取的卡片，最新結果稍後推播
+    await reply_scheduler.respond_async(app[LINE_API_CLIENT], event, build, fallback)
+
+
+async def handle_message(app: web.Application, event: MessageEvent):
+    """處理文字訊息 - 天氣查詢 (地區切換已由 RichMenuSwitchAction 處理)"""
+    text = event.message.text
+    await respond(app, event, lambda: build_text_reply(text), lambda: build_fallback_reply(text))
+
+
+async def handle_location(app: web.Application, event: MessageEvent):
+    """處理位置訊息 - 回覆最近的鄉鎮（或縣市）天氣"""
+    lat, lon = event.message.latitude, event.message.longitude
+    await respond(app, event, lambda: build_location_reply(lat, lon),
+                  lambda: build_location_fallback(lat, lon))
+
+
+async def dispatch(app: web.Application, event):
+    """依事件類型分派（對應 app.py 以 handler.add 註冊的處理函式）"""
+    if isinstance(event, MessageEvent) and isinstance(event.message, TextMessageContent):
+        with observe_stage('handle'):
+            await handle_message(app, event)
+    elif isinstance(event, MessageEvent) and isinstance(event.message, LocationMessageContent):
+        with observe_stage('handle'):
+            await handle_location(app, event)
+
+
+async def callback(request: web.Request) -> web.Response:
+    """LINE webhook callback endpoint"""
+    signature = request.headers.get('X-Line-Signature', '')
+    body = await request.read()
+
+    client_ip = (request.headers.get('CF-Connecting-IP')
+                 or request.headers.get('X-Forwarded-For', '').split(',')[0].strip()
+                 or request.remote)
+
+    # 驗證請求來源
+    try:
+        with observe_stage('signature'):
+            if not verify_signature(CHANNEL_SECRET, body, signature):
+                raise InvalidSignatureError('Invalid signature. signature=' + signature)
+    except InvalidSignatureError:
+        WEBHOOK_REQUESTS.labels('invalid_signature').inc()
+        log_fields(
+            logger, logging.WARNING, "Invalid signature",
+            lambda: {"client_ip": client_ip, "body": body.decode('utf-8', errors='replace')},
+            sample_rate=WEBHOOK_LOG_SAMPLE_RATE
+        )
+        raise web.HTTPBadRequest()
+
+    # 沒有文字訊息（例如只有 RichMenuSwitchAction 的 postback）：不解析 JSON
+    if not event_filter.might_match(body):
+        WEBHOOK_SKIPPED.labels('body').inc()
+        WEBHOOK_REQUESTS.labels('ok').inc()
+        return web.Response(text='OK')
+
+    with observe_stage('parse'):
+        payload = json.loads(body)
+    WEBHOOK_EVENTS.observe(len(payload['events']))
+
+    # 只保留有處理函式的事件，其餘不建立 SDK 模型
+    wanted = [event for event in payload['events'] if event_filter.wants(event)]
+    WEBHOOK_SKIPPED.labels('event').inc(len(payload['events']) - len(wanted))
+    payload['events'] = wanted
+
+    # 重送的事件在呼叫 CWA 與 LINE 之前就略過
+    if event_dedupe is not None:
+        with observe_stage('dedupe'):
+            payload['events'] = event_dedupe.filter_events(payload['events'])
+    try:
+        with observe_stage('parse_events'):
+            events = [parse_event(event) for event in payload['events']]
+    except Exception:
+        # 回應 500 後 LINE 會重送，這些事件不能被當成重複略過
+        if event_dedupe is not None:
+            event_dedupe.forget_events(payload['events'])
+        raise
+
+    # 同一個 webhook 的事件同時處理，單一事件失敗不影響其他事件
+    results = await asyncio.gather(
+        *(dispatch(request.app, event) for event in events),
+        return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            WEBHOOK_REQUESTS.labels('error').inc()
+            logger.error(
+                "Webhook exception. client_ip=%s, error=%s", client_ip, result,
+                exc_info=result
+            )
+
+    WEBHOOK_REQUESTS.labels('ok').inc()
+    logger.info("LINE Webhook OK. client_ip=%s, events=%d", client_ip, len(events))
+    return web.Response(text='OK')
+
+
+async def health(request: web.Request) -> web.Response:
+    """健康檢查 endpoint（含預報快照、斷路器與更新器狀態）"""
+    return web.json_response({
+        'status': 'OK',
+        'forecast_snapshot': forecast_snapshot.status(),
+        'cwa_breaker': cwa_breaker.status(),
+        'cwa_township_breaker': township_breaker.status(),
+        'cwa_observation_breaker': observation_breaker.status(),
+        'forecast_singleflight': async_forecast_flight.stats(),
+        'flex_render_cache': flex_render_cache.stats(),
+        'webhook_dedupe': event_dedupe.stats() if event_dedupe else None,
+        'reply_scheduler': reply_scheduler.stats(),
+        'rate_limiter': inbound_limiter.stats() if RATE_LIMIT else None,
+        'forecast_refresher': forecast_refresher.status(),
+        'township_forecast': township_snapshot.status(),
+        'township_refresher': township_refresher.status(),
+        'observations': observation_snapshot.status(),
+        'observation_refresher': observation_refresher.status()
+    })
+
+
+async def metrics(request: web.Request) -> web.Response:
+    """Prometheus 指標"""
+    data, content_type = render_metrics()
+    return web.Response(body=data, headers={'Content-Type': content_type})
+
+
+async def on_startup(app: web.Application):
+    """
+    在 worker 的 event loop 內建立連線池並啟動背景更新
+
+    順序與 app.py 的 warm_start 相同：共用快照檔 -> 磁碟上的快照 -> 向 CWA 更新，
+    差別在於更新改由 event loop 上的 task 執行，而非背景執行緒。
+    """
+    app[LINE_API_CLIENT] = AsyncApiClient(configuration)
+    app[CWA_SESSION] = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=4))
+
+    attach_shared_store()
+    enable_snapshot_persistence()
+    if os.getenv('FORECAST_REFRESHER', '1') != '0' and CWA_API_KEY:
+        forecast_refresher.start_async(app[CWA_SESSION])
+    if township_enabled():
+        township_refresher.start_async(app[CWA_SESSION])
+    if observations_enabled():
+        observation_refresher.start_async(app[CWA_SESSION])
+
+
+async def on_cleanup(app: web.Application):
+    """停止背景更新並關閉連線池"""
+    for refresher in (forecast_refresher, township_refresher, observation_refresher):
+        task = refresher._task
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        refresher.snapshot.background_refresh = False
+
+    await app[LINE_API_CLIENT].close()
+    await app[CWA_SESSION].close()
+
+
+def create_app() -> web.Application:
+    """建立 aiohttp 應用程式"""
+    app = web.Application()
+    app.router.add_post('/callback', callback)
+    app.router.add_get('/health', health)
+    app.router.add_get('/metrics', metrics)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+app = create_app()
+
+
+if __name__ == "__main__":
+    port = int(os.getenv('PORT', 5000))
+    web.run_app(app, host='0.0.0.0', port=port)
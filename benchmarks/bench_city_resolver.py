@@ -0,0 +1,67 @@
+"""
+縣市名稱解析效能（每次查詢的微秒數）
+
+    python benchmarks/bench_city_resolver.py
+
+- legacy：舊版 normalize_city_name（台 → 臺，再以 list 線性搜尋加上市 / 縣的名稱）
+- resolver：CityResolver（別名雜湊表 + 編輯距離索引）
+  fuzzy (cold) 每次查詢前清掉模糊比對的快取，量測編輯距離索引本身的成本
+"""
+import timeit
+
+import cwa_fixtures  # noqa: F401  （設定 sys.path）
+
+from city_resolver import CityResolver
+from weather_service import SUPPORTED_CITIES
+
+INPUTS = {
+    'canonical': ['臺北市', '高雄市', '新竹縣', '連江縣'],
+    'short name': ['台北', '高雄', '新竹', '花蓮'],
+    'alias': ['北市', 'Kaohsiung', 'gaoxiong', '竹北', '臺北縣', 'Hsinchu County'],
+    'fuzzy': ['高熊市', 'Kaohsuing', 'tianan', '竹北市', '澎胡縣'],
+    'miss': ['火星', '臺灣', 'Tokyo'],
+}
+
+
+def legacy_normalize(city_input: str) -> str:
+    """舊版 normalize_city_name"""
+    normalized = city_input.replace('台', '臺')
+    if not (normalized.endswith('市') or normalized.endswith('縣')):
+        if f"{normalized}市" in SUPPORTED_CITIES:
+            return f"{normalized}市"
+        elif f"{normalized}縣" in SUPPORTED_CITIES:
+            return f"{normalized}縣"
+    return normalized
+
+
+def per_call(fn, inputs: list, number: int) -> float:
+    """每次查詢的微秒數（5 次取最快）"""
+    seconds = min(timeit.repeat(lambda: [fn(text) for text in inputs], number=number, repeat=5))
+    return seconds / number / len(inputs) * 1e6
+
+
+def main():
+    started = timeit.default_timer()
+    resolver = CityResolver(SUPPORTED_CITIES)
+    build_ms = (timeit.default_timer() - started) * 1000
+    variants = len(resolver.latin_fuzzy.variants) + len(resolver.cjk_fuzzy.variants)
+    print(f"index: {len(resolver.index)} names, {variants} deletion variants, "
+          f"built in {build_ms:.1f} ms")
+
+    def cold(text):
+        resolver._fuzzy.cache_clear()
+        return resolver.resolve(text)
+
+    print(f"{'inputs':<14} {'legacy µs':>10} {'resolver µs':>12} {'resolved':>9}")
+    for name, inputs in INPUTS.items():
+        legacy_us = per_call(legacy_normalize, inputs, 20000)
+        resolver_us = per_call(resolver.resolve, inputs, 20000)
+        resolved = sum(resolver.resolve(text) is not None for text in inputs)
+        print(f"{name:<14} {legacy_us:>10.2f} {resolver_us:>12.2f} {resolved:>5}/{len(inputs)}")
+        if name in ('fuzzy', 'miss'):
+            cold_us = per_call(cold, inputs, 500)
+            print(f"{name + ' (cold)':<14} {'':>10} {cold_us:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
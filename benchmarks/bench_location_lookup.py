@@ -0,0 +1,63 @@
+"""
+位置訊息的查詢成本：經緯度 -> 最近的鄉鎮
+
+    python benchmarks/bench_location_lookup.py
+
+- grid：geo_index.GridIndex（TownshipIndex.nearest）
+- scan：逐一計算 368 個鄉鎮代表點的距離（對照組）
+- reply：build_location_reply 全程（查詢 + 取出已組好的 Flex Message）
+查詢點為各鄉鎮代表點附近 ±0.15 度的隨機位置，另含海上 / 國外等超出範圍的位置。
+"""
+import math
+import random
+import timeit
+
+from cwa_fixtures import make_township_payload
+
+from geo_index import KM_PER_DEGREE, LOCATION_MAX_DISTANCE_KM
+from message_handlers import build_location_reply
+from township_forecast import TownshipIndex, township_snapshot
+
+
+def scan_nearest(index: TownshipIndex, lat: float, lon: float):
+    """對照組：走訪全部代表點"""
+    scale = math.cos(math.radians(lat))
+    best, best_d2 = None, math.inf
+    for row, (la, lo) in enumerate(zip(index.latitudes, index.longitudes)):
+        dy, dx = la - lat, (lo - lon) * scale
+        d2 = dy * dy + dx * dx
+        if d2 < best_d2:
+            best, best_d2 = row, d2
+    if math.sqrt(best_d2) * KM_PER_DEGREE > LOCATION_MAX_DISTANCE_KM:
+        return None
+    return best
+
+
+def main():
+    data = make_township_payload()
+    index = TownshipIndex(data)
+    township_snapshot.load(data)
+
+    rng = random.Random(0)
+    points = []
+    for _ in range(1000):
+        row = rng.randrange(len(index))
+        points.append((index.latitudes[row] + rng.uniform(-0.15, 0.15),
+                       index.longitudes[row] + rng.uniform(-0.15, 0.15)))
+    # 超出範圍：臺灣海峽中央、太平洋、東京
+    points += [(24.0, 119.9), (23.0, 123.5), (35.68, 139.69)] * 10
+
+    assert all(index.nearest(lat, lon) == scan_nearest(index, lat, lon) for lat, lon in points)
+    print(f"{len(index)} townships in {len(index.grid.buckets)} cells of {index.grid.cell}°, "
+          f"{len(points)} query points")
+
+    for name, lookup in (('grid', index.nearest),
+                         ('scan', lambda lat, lon: scan_nearest(index, lat, lon)),
+                         ('reply', build_location_reply)):
+        seconds = min(timeit.repeat(
+            lambda: [lookup(lat, lon) for lat, lon in points], number=5, repeat=5))
+        print(f"{name:<6} {seconds / 5 / len(points) * 1e6:>8.1f} µs per location")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+"""
+/callback 每個 request 的日誌成本比較
+
+    python benchmarks/bench_logging.py [--requests 5000]
+
+- legacy：組出完整 log_data，json.dumps(indent=2) 後同步寫入 stdout handler
+- queued：log_fields + NonBlockingQueueHandler，request 執行緒只放進佇列
+- sampled：同上但 WEBHOOK_LOG_SAMPLE_RATE=0.1
+- disabled：logger 等級高於 INFO，完全不建立紀錄
+
+輸出寫到暫存檔（不是 /dev/null），包含實際的 I/O 成本。
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime
+
+import cwa_fixtures  # noqa: F401  （設定 sys.path）
+
+# 只量測日誌：不啟動預報更新器、不讀寫快照檔；佇列放得下全部紀錄
+os.environ.setdefault('FORECAST_REFRESHER', '0')
+os.environ.setdefault('FORECAST_SHARED_STORE', '0')
+os.environ.setdefault('FORECAST_PERSIST', '0')
+os.environ.setdefault('LOG_QUEUE_SIZE', '1000000')
+os.environ.setdefault('LINE_CHANNEL_SECRET', 'bench-secret')
+
+from flask import Flask, request  # noqa: E402
+
+import structured_logging  # noqa: E402
+from app import request_log_fields  # noqa: E402
+from structured_logging import log_fields, setup_logging  # noqa: E402
+
+BODY = json.dumps({
+    'destination': 'U' + '0' * 32,
+    'events': [{
+        'type': 'message', 'mode': 'active', 'timestamp': 1700000000000,
+        'source': {'type': 'user', 'userId': 'U' + '1' * 32},
+        'webhookEventId': '01H' + '0' * 23,
+        'deliveryContext': {'isRedelivery': False},
+        'replyToken': 'r' * 32,
+        'message': {'id': '1', 'type': 'text', 'quoteToken': 'q' * 40, 'text': '天氣 高雄'},
+    }],
+}, ensure_ascii=False)
+
+HEADERS = {
+    'X-Line-Signature': 's' * 44,
+    'Content-Type': 'application/json; charset=utf-8',
+    'User-Agent': 'LineBotWebhook/2.0',
+    'CF-Connecting-IP': '203.0.113.10',
+    'CF-Ray': '8c0f0f0f0f0f0f0f-NRT',
+    'CF-IPCountry': 'JP',
+    'CF-Visitor': '{"scheme":"https"}',
+    'X-Forwarded-For': '203.0.113.10, 172.68.0.1',
+    'X-Real-IP': '172.68.0.1',
+    'X-Forwarded-Proto': 'https',
+    'Accept-Encoding': 'gzip',
+}
+
+
+def legacy_log(logger, signature, body):
+    """舊版 callback 的日誌寫法（原樣保留）"""
+    cf_connecting_ip = request.headers.get("CF-Connecting-IP")
+    x_forwarded_for = request.headers.get("X-Forwarded-For")
+    x_real_ip = request.headers.get("X-Real-IP")
+    remote_addr = request.remote_addr
+    client_ip = cf_connecting_ip or remote_addr
+
+    log_data = {
+        "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "client_ip": client_ip,
+        "remote_addr": remote_addr,
+        "x_real_ip": x_real_ip,
+        "x_forwarded_for": x_forwarded_for,
+        "cf_connecting_ip": cf_connecting_ip,
+        "cf_ray": request.headers.get("CF-Ray"),
+        "cf_ipcountry": request.headers.get("CF-IPCountry"),
+        "cf_visitor": request.headers.get("CF-Visitor"),
+        "method": request.method,
+        "scheme": request.scheme,
+        "host": request.host,
+        "path": request.path,
+        "full_path": request.full_path,
+        "url": request.url,
+        "base_url": request.base_url,
+        "query_string": request.query_string.decode("utf-8", errors="replace"),
+        "user_agent": request.headers.get("User-Agent"),
+        "content_type": request.headers.get("Content-Type"),
+        "content_length": request.headers.get("Content-Length"),
+        "x_line_signature_exists": bool(signature),
+        "x_line_signature": signature,
+        "access_route": list(request.access_route),
+        "server_protocol": request.environ.get("SERVER_PROTOCOL"),
+        "remote_port": request.environ.get("REMOTE_PORT"),
+        "headers": dict(request.headers),
+        "body": body
+    }
+
+    logger.info(
+        "LINE Webhook Request Detail:\n%s",
+        json.dumps(log_data, ensure_ascii=False, indent=2)
+    )
+
+
+def structured_log(logger, signature, body, sample_rate):
+    """新版 callback 的日誌寫法"""
+    log_fields(
+        logger, logging.INFO, "LINE Webhook Request Detail",
+        lambda: request_log_fields(request.headers.get('CF-Connecting-IP'), signature, body),
+        sample_rate=sample_rate
+    )
+
+
+def measure(name, logger, fn, requests, flush=None):
+    """
+    在 request context 內重複呼叫 fn
+
+    Returns:
+        (request 執行緒每次的微秒數, 含背景輸出完成的每次微秒數)
+    """
+    app = Flask(name)
+    with app.test_request_context(
+            '/callback', method='POST', data=BODY, headers=HEADERS,
+            environ_base={'REMOTE_ADDR': '172.68.0.1'}):
+        signature = request.headers.get('X-Line-Signature', '')
+        body = request.get_data(as_text=True)
+        started = time.perf_counter()
+        for _ in range(requests):
+            fn(logger, signature, body)
+        caller = time.perf_counter() - started
+        if flush:
+            flush()
+        total = time.perf_counter() - started
+    return caller / requests * 1e6, total / requests * 1e6
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        results = []
+
+        # 舊版：StreamHandler + 文字格式，同步寫入
+        legacy_file = open(os.path.join(tmp, 'legacy.log'), 'w')
+        legacy_logger = logging.getLogger('bench.legacy')
+        handler = logging.StreamHandler(legacy_file)
+        handler.setFormatter(logging.Formatter(structured_logging.TEXT_FORMAT))
+        legacy_logger.addHandler(handler)
+        legacy_logger.setLevel(logging.INFO)
+        legacy_logger.propagate = False
+        results.append(('legacy (indent=2, sync)', *measure(
+            'legacy', legacy_logger, legacy_log, args.requests, legacy_file.flush),
+            os.path.getsize(legacy_file.name)))
+
+        for name, sample_rate, level in (('queued (json, async)', 1.0, logging.INFO),
+                                         ('sampled 10%', 0.1, logging.INFO),
+                                         ('disabled (WARNING)', 1.0, logging.WARNING)):
+            log_file = open(os.path.join(tmp, f'{sample_rate}-{level}.log'), 'w')
+            logger = logging.getLogger(f'bench.{name}')
+            queue_handler = setup_logging(logger, stream=log_file)
+            logger.setLevel(level)
+            listener = structured_logging._listeners[-1]
+
+            def flush():
+                listener.stop()
+                log_file.flush()
+
+            def fn(logger, signature, body, sample_rate=sample_rate):
+                structured_log(logger, signature, body, sample_rate)
+
+            results.append((name, *measure(name, logger, fn, args.requests, flush),
+                            os.path.getsize(log_file.name)))
+            if queue_handler.dropped:
+                print(f"{name}: dropped {queue_handler.dropped} records (queue full)")
+
+    print(f"requests={args.requests}")
+    print(f"{'mode':<26} {'request µs':>12} {'incl. write µs':>15} {'bytes/req':>10}")
+    for name, caller, total, size in results:
+        print(f"{name:<26} {caller:>12.1f} {total:>15.1f} {size / args.requests:>10.0f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='/callback 日誌成本比較')
+    parser.add_argument('--requests', type=int, default=5000)
+    main(parser.parse_args())
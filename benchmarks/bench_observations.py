@@ -0,0 +1,56 @@
+"""
+即時觀測（O-A0001-001）的更新與查詢成本
+
+    python benchmarks/bench_observations.py
+
+- parse：整份回應以 64 KB 分段交給 PayloadStream，建立欄式索引（每 10 分鐘一次）
+- nearest：經緯度 -> 最近的測站（geo_index.GridIndex）
+- reply：「現在 地名」的 build_observation_reply 全程（查詢 + 取出已組好的 Flex Message）
+"""
+import random
+import time
+import timeit
+
+from cwa_fixtures import make_observation_bytes
+
+from cwa_stream import STREAM_CHUNK_SIZE
+from geo_index import COUNTY_SEATS
+from message_handlers import build_observation_reply
+from observations import observation_snapshot
+
+
+def main():
+    body = make_observation_bytes()
+
+    seconds = []
+    for _ in range(5):
+        started = time.perf_counter()
+        stream = observation_snapshot.open_stream()
+        for offset in range(0, len(body), STREAM_CHUNK_SIZE):
+            stream.feed(body[offset:offset + STREAM_CHUNK_SIZE])
+        stream.close()
+        seconds.append(time.perf_counter() - started)
+    observation_snapshot.load_stream(stream)
+    index = observation_snapshot.locations
+
+    print(f"payload {len(body) / 1e6:.2f} MB, {len(index)} stations "
+          f"({len(index.grid)} with temperature), columns {index.nbytes() / 1e3:.1f} KB")
+    print(f"parse   {min(seconds) * 1000:>8.1f} ms per refresh")
+
+    rng = random.Random(0)
+    seats = list(COUNTY_SEATS.values())
+    points = []
+    for _ in range(1000):
+        lat, lon = rng.choice(seats)
+        points.append((lat + rng.uniform(-0.2, 0.2), lon + rng.uniform(-0.2, 0.2)))
+
+    places = [name[:2] for name in COUNTY_SEATS] * 10
+    for name, run, count in (
+            ('nearest', lambda: [observation_snapshot.nearest(lat, lon) for lat, lon in points], len(points)),
+            ('reply', lambda: [build_observation_reply(place) for place in places], len(places))):
+        best = min(timeit.repeat(run, number=5, repeat=5))
+        print(f"{name:<7} {best / 5 / count * 1e6:>8.1f} µs per query")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+F-C0032-001 全台 22 縣市解析效能比較
+
+    python benchmarks/bench_parse.py
+
+比較舊版（每次查詢建立 element_map、逐時段 strptime、產生 dict）
+與 parse_forecast_payload（單次走訪、查表時段名稱、NamedTuple 紀錄）。
+"""
+import timeit
+import tracemalloc
+from datetime import datetime
+
+from cwa_fixtures import make_forecast_payload
+
+from weather_service import parse_forecast_payload
+
+
+def legacy_parse(data: dict) -> dict:
+    """舊版 WeatherForecast.fetch 的解析方式（套用到全部縣市）"""
+    result = {}
+    for location_data in data['records']['location']:
+        element_map = {el['elementName']: el['time']
+                       for el in location_data['weatherElement']}
+        weather_data = []
+        for i in range(3):
+            start = element_map['Wx'][i]['startTime']
+            end = element_map['Wx'][i]['endTime']
+            hour = datetime.strptime(start, "%Y-%m-%d %H:%M:%S").hour
+            if 5 <= hour < 12:
+                period = "🌅 早上"
+            elif 12 <= hour < 18:
+                period = "☀️ 白天"
+            elif 18 <= hour < 24:
+                period = "🌃 晚上"
+            else:
+                period = "🌙 凌晨"
+            emoji_map = {"🌅 早上": "🌅", "☀️ 白天": "☀️",
+                         "🌃 晚上": "🌃", "🌙 凌晨": "🌙"}
+            period_text = period.replace(emoji_map.get(period, ""), "").strip()
+            if i == 2 and "早上" in period_text:
+                period_text = "明天" + period_text
+            weather_data.append({
+                "period": period_text,
+                "emoji": emoji_map.get(period, "🌤️"),
+                "time": f"{start[5:16]} - {end[5:16]}",
+                "weather": element_map['Wx'][i]['parameter']['parameterName'],
+                "comfort": element_map['CI'][i]['parameter']['parameterName'],
+                "minTemp": element_map['MinT'][i]['parameter']['parameterName'],
+                "maxTemp": element_map['MaxT'][i]['parameter']['parameterName'],
+                "rain": element_map['PoP'][i]['parameter']['parameterName'],
+            })
+        result[location_data['locationName']] = weather_data
+    return result
+
+
+def measure(name: str, fn, data: dict, number: int = 2000):
+    seconds = min(timeit.repeat(lambda: fn(data), number=number, repeat=5))
+
+    # retained：解析結果保留下來的記憶體；peak：解析過程的最高用量
+    tracemalloc.start()
+    kept = fn(data)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+
+    print(f"{name:<24} {seconds / number * 1e6:9.1f} µs/次  "
+          f"peak {peak / 1024:7.1f} KiB  retained {retained / 1024:7.1f} KiB")
+
+
+if __name__ == '__main__':
+    payload = make_forecast_payload()
+    print("📊 F-C0032-001 全台 22 縣市解析")
+    print("=" * 72)
+    measure("legacy (dict + strptime)", legacy_parse, payload)
+    measure("parse_forecast_payload", parse_forecast_payload, payload)
@@ -0,0 +1,133 @@
+"""
+串流解析（cwa_stream.PayloadStream）與整份 json.loads 的比較
+
+    python benchmarks/bench_stream_parse.py
+    python benchmarks/bench_stream_parse.py --payload F-D0047-093.json   # 使用錄下的 CWA 回應
+
+- 回應存成檔案後以 64 KB 分段讀出，模擬 HTTP 回應的 iter_content
+- json.loads：讀完整份回應 -> json.loads -> 建立索引（原本的做法）
+- stream：每讀一段就交給 PayloadStream，目標元素收齊後直接寫入索引
+- 每種做法在獨立的子行程執行，peak RSS 為 import 完成後高峰 RSS（VmHWM）的增量
+"""
+import argparse
+import gc
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from cwa_fixtures import make_forecast_bytes, make_township_bytes
+
+from cwa_stream import STREAM_CHUNK_SIZE, PayloadStream
+from township_forecast import TownshipIndex
+from weather_service import CityForecastCollector, parse_forecast_payload
+
+DATASETS = {
+    'F-D0047-093': (('records', 'Locations', '*', 'Location', '*'), TownshipIndex, TownshipIndex),
+    'F-C0032-001': (('records', 'location', '*'), CityForecastCollector, parse_forecast_payload),
+}
+
+
+def detect_dataset(path: str) -> str:
+    """依回應內容判斷資料集（鄉鎮預報有 records.Locations）"""
+    with open(path, 'rb') as f:
+        head = f.read(STREAM_CHUNK_SIZE)
+    return 'F-D0047-093' if b'"Locations"' in head else 'F-C0032-001'
+
+
+def parse_with_json(path: str, dataset: str):
+    _, _, build = DATASETS[dataset]
+    with open(path, 'rb') as f:
+        content = f.read()
+    return build(json.loads(content))
+
+
+def parse_with_stream(path: str, dataset: str):
+    target, builder, _ = DATASETS[dataset]
+    stream = PayloadStream(target, builder)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(STREAM_CHUNK_SIZE), b''):
+            stream.feed(chunk)
+    return stream.close()
+
+
+MODES = {'json.loads': parse_with_json, 'stream': parse_with_stream}
+
+
+def max_rss() -> int:
+    """
+    目前行程的 peak RSS（bytes）
+
+    Linux 的 ru_maxrss 會沿用 fork 前父行程的高峰（父行程剛產生過測試資料），
+    改讀 exec 後重新計算的 VmHWM。
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def child(mode: str, path: str, dataset: str):
+    """子行程：量測一種做法的 peak RSS 增量與解析時間，輸出一行 JSON"""
+    parse = MODES[mode]
+    gc.collect()
+    baseline = max_rss()
+    result = parse(path, dataset)
+    peak = max_rss() - baseline
+    del result
+
+    seconds = []
+    for _ in range(5):
+        started = time.perf_counter()
+        parse(path, dataset)
+        seconds.append(time.perf_counter() - started)
+    print(json.dumps({'peak_rss': peak, 'seconds': min(seconds)}))
+
+
+def measure(mode: str, path: str, dataset: str) -> dict:
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', mode, path, dataset],
+        check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--payload', help='錄下的 CWA 回應（F-D0047-093 或 F-C0032-001 的 JSON）')
+    parser.add_argument('--child', nargs=3, metavar=('MODE', 'PATH', 'DATASET'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(*args.child)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.payload:
+            payloads = [(detect_dataset(args.payload), args.payload)]
+        else:
+            payloads = []
+            for dataset, body in (('F-D0047-093', make_township_bytes()),
+                                  ('F-C0032-001', make_forecast_bytes())):
+                path = os.path.join(tmp, f'{dataset}.json')
+                with open(path, 'wb') as f:
+                    f.write(body)
+                payloads.append((dataset, path))
+
+        print(f"{'dataset':<13} {'payload MB':>10} {'mode':<11} {'peak RSS MB':>11} {'parse ms':>9}")
+        for dataset, path in payloads:
+            size = os.path.getsize(path) / 1e6
+            for mode in MODES:
+                result = measure(mode, path, dataset)
+                print(f"{dataset:<13} {size:>10.2f} {mode:<11} "
+                      f"{result['peak_rss'] / 1e6:>11.1f} {result['seconds'] * 1000:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+鄉鎮預報（F-D0047-093，368 個鄉鎮市區）的更新成本與查詢成本
+
+    python benchmarks/bench_township_index.py
+
+- payload：只帶 ElementName 的回應與完整回應的大小
+- refresh：json.loads + 建立 TownshipIndex 的時間與記憶體高峰
+- retained：更新後常駐的記憶體（欄式索引 vs 保留解析後的 JSON vs 每個時段一個 NamedTuple）
+- lookup：名稱查詢 + 取出單一鄉鎮預報的時間
+"""
+import gc
+import json
+import time
+import timeit
+import tracemalloc
+
+from cwa_fixtures import make_township_bytes
+
+from township_forecast import TownshipIndex, TownshipSlot
+
+
+def records_index(data: dict) -> dict:
+    """對照組：{(縣市, 鄉鎮): [TownshipSlot, ...]}"""
+    index = TownshipIndex(data)
+    return {(index.counties[row], index.townships[row]): list(index.get(row).slots)
+            for row in range(len(index))}
+
+
+def retained(build) -> tuple:
+    """(常駐位元組, 建立過程的高峰位元組)"""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current, peak
+
+
+def main():
+    body = make_township_bytes()
+    full_body = make_township_bytes(all_elements=True)
+    print(f"payload: {len(body) / 1e6:.1f} MB with ElementName, "
+          f"{len(full_body) / 1e6:.1f} MB without")
+
+    started = time.perf_counter()
+    data = json.loads(body)
+    loads_ms = (time.perf_counter() - started) * 1000
+    build_ms = min(timeit.repeat(lambda: TownshipIndex(data), number=1, repeat=5)) * 1000
+    index = TownshipIndex(data)
+    print(f"refresh: json.loads {loads_ms:.0f} ms + index {build_ms:.0f} ms "
+          f"({len(index)} townships x {index.periods} periods)")
+
+    def refresh():
+        return TownshipIndex(json.loads(body))
+
+    _, peak = retained(refresh)
+    print(f"refresh peak memory: {peak / 1e6:.1f} MB")
+
+    print(f"{'retained':<22} {'MB':>8}")
+    for name, build in (('parsed JSON', lambda: json.loads(body)),
+                        ('NamedTuple records', lambda: records_index(data)),
+                        ('columnar index', lambda: TownshipIndex(data))):
+        current, _ = retained(build)
+        print(f"{name:<22} {current / 1e6:>8.2f}")
+    print(f"columnar nbytes (columns + axes + texts): {index.nbytes() / 1e3:.1f} KB")
+
+    names = ['鳳山', '高雄市鳳山區', '板橋區', '臺南東區', '竹北']
+    seconds = min(timeit.repeat(
+        lambda: [index.get(index.lookup(name)[0]) for name in names], number=2000, repeat=5))
+    print(f"lookup + get: {seconds / 2000 / len(names) * 1e6:.1f} µs "
+          f"({len(index.get(0).slots)} {TownshipSlot.__name__}s per township)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+webhook 事件分派前的處理成本比較（每秒事件數）
+
+    python benchmarks/bench_webhook_fastpath.py [--bodies 20000]
+
+- legacy：body 解碼成字串 → SignatureValidator.validate → json.loads → 每個事件都建立 SDK 模型
+- fastpath：原始 bytes 驗簽 → 掃描 body 是否含需要的事件 type → 只為有處理函式的事件建立模型
+
+兩者都以 dispatch_event 分派到與 app.py 相同註冊方式的處理函式（函式本身不做事），
+只量測 /callback 在呼叫 CWA / LINE 之前的成本。
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+import cwa_fixtures  # noqa: F401  （設定 sys.path）
+
+from linebot.v3 import WebhookHandler
+from linebot.v3.webhooks import MessageEvent, TextMessageContent
+
+from event_dispatcher import EventFilter, dispatch_event, parse_event, verify_signature
+
+SECRET = 'bench-secret'
+REGIONS = ('north', 'central', 'south', 'east', 'islands')
+
+
+def base_event(kind: str, i: int) -> dict:
+    return {
+        'type': kind, 'mode': 'active', 'timestamp': 1700000000000 + i,
+        'source': {'type': 'user', 'userId': f'U{i % 500:032d}'},
+        'webhookEventId': f'01BENCH{i:019d}',
+        'deliveryContext': {'isRedelivery': False},
+    }
+
+
+def make_event(kind: str, i: int) -> dict:
+    """建立單一事件（與 LINE 送來的結構相同）"""
+    event = base_event('message' if kind in ('text', 'sticker') else kind, i)
+    if kind != 'unfollow':
+        event['replyToken'] = f'reply-token-{i}'
+    if kind == 'text':
+        event['message'] = {'id': str(i), 'type': 'text', 'quoteToken': 'q' * 40, 'text': '天氣 高雄'}
+    elif kind == 'sticker':
+        event['message'] = {'id': str(i), 'type': 'sticker', 'quoteToken': 'q' * 40,
+                            'packageId': '446', 'stickerId': '1988',
+                            'stickerResourceType': 'STATIC', 'keywords': ['happy']}
+    elif kind == 'postback':
+        # RichMenuSwitchAction 切換地區
+        region = REGIONS[i % len(REGIONS)]
+        event['postback'] = {'data': f'richmenu-changed-to-{region}',
+                             'params': {'newRichMenuAliasId': region, 'status': 'SUCCESS'}}
+    elif kind == 'follow':
+        event['follow'] = {'isUnblocked': False}
+    return event
+
+
+# 各情境每個 body 內的事件
+SCENARIOS = {
+    'richmenu postback only': ['postback'],
+    'mixed (8 events)': ['postback', 'postback', 'postback', 'follow',
+                         'unfollow', 'sticker', 'text', 'postback'],
+    'text only': ['text'],
+}
+
+
+def make_bodies(kinds: list, count: int) -> list:
+    bodies = []
+    for n in range(count):
+        events = [make_event(kind, n * len(kinds) + j) for j, kind in enumerate(kinds)]
+        body = json.dumps({'destination': 'Ubench', 'events': events},
+                          ensure_ascii=False).encode('utf-8')
+        signature = base64.b64encode(
+            hmac.new(SECRET.encode(), body, hashlib.sha256).digest()).decode()
+        bodies.append((body, signature))
+    return bodies
+
+
+def make_handler() -> WebhookHandler:
+    handler = WebhookHandler(SECRET)
+
+    @handler.add(MessageEvent, message=TextMessageContent)
+    def handle_message(event):
+        pass
+
+    return handler
+
+
+def legacy(handler, body: bytes, signature: str):
+    """舊版 callback：解碼、字串驗簽、全部事件建立模型"""
+    text = body.decode('utf-8')
+    if not handler.parser.signature_validator.validate(text, signature):
+        raise ValueError('invalid signature')
+    payload = json.loads(text)
+    events = [parse_event(event) for event in payload['events']]
+    for event in events:
+        dispatch_event(handler, event, payload.get('destination'))
+
+
+def fastpath(handler, event_filter, secret: bytes, body: bytes, signature: str):
+    """新版 callback：bytes 驗簽、預先掃描、只建立需要的模型"""
+    if not verify_signature(secret, body, signature):
+        raise ValueError('invalid signature')
+    if not event_filter.might_match(body):
+        return
+    payload = json.loads(body)
+    events = [parse_event(event) for event in payload['events'] if event_filter.wants(event)]
+    for event in events:
+        dispatch_event(handler, event, payload.get('destination'))
+
+
+def measure(fns: list, bodies: list) -> list:
+    """回傳各函式每個 body 的平均秒數（交錯執行 5 次，各取最快的一次）"""
+    best = [None] * len(fns)
+    for _ in range(5):
+        for i, fn in enumerate(fns):
+            started = time.perf_counter()
+            for body, signature in bodies:
+                fn(body, signature)
+            elapsed = time.perf_counter() - started
+            best[i] = elapsed if best[i] is None else min(best[i], elapsed)
+    return [seconds / len(bodies) for seconds in best]
+
+
+def main(args):
+    handler = make_handler()
+    event_filter = EventFilter.from_handler(handler)
+    secret = SECRET.encode()
+
+    print(f"bodies={args.bodies}")
+    print(f"{'scenario':<26} {'legacy ev/s':>12} {'fastpath ev/s':>14} {'speedup':>8}")
+    for name, kinds in SCENARIOS.items():
+        bodies = make_bodies(kinds, args.bodies)
+        legacy_seconds, fast_seconds = measure(
+            [lambda b, s: legacy(handler, b, s),
+             lambda b, s: fastpath(handler, event_filter, secret, b, s)], bodies)
+        events = len(kinds)
+        print(f"{name:<26} {events / legacy_seconds:>12,.0f} {events / fast_seconds:>14,.0f} "
+              f"{legacy_seconds / fast_seconds:>7.1f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='webhook 分派前的處理成本比較')
+    parser.add_argument('--bodies', type=int, default=20000)
+    main(parser.parse_args())
@@ -0,0 +1,215 @@
+"""
+Flask (app:app, gunicorn sync workers) 與 asyncio (async_app:app) 的 webhook 吞吐量比較
+
+    python benchmarks/bench_webhook_throughput.py [--requests 2000] [--concurrency 200]
+
+啟動一個模擬 LINE / CWA 的本機伺服器（LINE reply 固定延遲，模擬網路 I/O），
+分別以 gunicorn 啟動兩種入口，送出帶正確簽章的 webhook，比較 req/s 與延遲百分位數。
+不需要真的 LINE channel 或 CWA 授權碼。
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+
+from cwa_fixtures import make_forecast_bytes
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHANNEL_SECRET = 'bench-secret'
+
+SERVERS = {
+    'app:app (gunicorn sync x2)': [
+        'gunicorn', 'app:app', '--workers', '2', '--timeout', '120'],
+    'async_app:app (aiohttp x1)': [
+        'gunicorn', 'async_app:app', '--workers', '1',
+        '--worker-class', 'aiohttp.GunicornWebWorker'],
+}
+
+
+def free_port() -> int:
+    """取得一個未使用的本機 port"""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+async def start_upstream(port: int, line_latency: float) -> web.AppRunner:
+    """
+    模擬 LINE Messaging API 與 CWA 的伺服器
+
+    Args:
+        port: 監聽的 port
+        line_latency: 每次 reply 的延遲秒數
+
+    Returns:
+        已啟動的 AppRunner
+    """
+    forecast = make_forecast_bytes()
+
+    async def reply(request):
+        await request.read()
+        await asyncio.sleep(line_latency)
+        return web.json_response({'sentMessages': [{'id': '1', 'quoteToken': 'q'}]})
+
+    async def cwa(request):
+        return web.Response(body=forecast, content_type='application/json')
+
+    upstream = web.Application()
+    upstream.router.add_post('/v2/bot/message/reply', reply)
+    upstream.router.add_get('/F-C0032-001', cwa)
+    runner = web.AppRunner(upstream, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    return runner
+
+
+def make_webhook(i: int) -> tuple:
+    """
+    建立一則帶簽章的文字訊息 webhook
+
+    Returns:
+        (body bytes, X-Line-Signature)
+    """
+    body = json.dumps({
+        'destination': 'Ubench',
+        'events': [{
+            'type': 'message', 'mode': 'active', 'timestamp': int(time.time() * 1000),
+            'source': {'type': 'user', 'userId': f'U{i % 500:032d}'},
+            'webhookEventId': f'01BENCH{i:019d}',
+            'deliveryContext': {'isRedelivery': False},
+            'replyToken': f'reply-token-{i}',
+            'message': {'id': str(i), 'type': 'text', 'quoteToken': 'q', 'text': '天氣 高雄'},
+        }],
+    }, ensure_ascii=False).encode('utf-8')
+    signature = base64.b64encode(
+        hmac.new(CHANNEL_SECRET.encode(), body, hashlib.sha256).digest()).decode()
+    return body, signature
+
+
+async def wait_ready(url: str, timeout: float = 30):
+    """等待伺服器的 /health 回應 200"""
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(url + '/health') as r:
+                    if r.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f'{url} did not become ready')
+
+
+async def load(url: str, total: int, concurrency: int) -> dict:
+    """
+    以固定併發數送出 webhook
+
+    Returns:
+        {'rps', 'p50_ms', 'p99_ms', 'errors'}
+    """
+    webhooks = [make_webhook(i) for i in range(total)]
+    latencies = []
+    errors = 0
+    next_index = 0
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async def worker():
+            nonlocal next_index, errors
+            while next_index < total:
+                body, signature = webhooks[next_index]
+                next_index += 1
+                started = time.perf_counter()
+                try:
+                    async with session.post(
+                        url + '/callback', data=body,
+                        headers={'X-Line-Signature': signature,
+                                 'Content-Type': 'application/json'}
+                    ) as r:
+                        await r.read()
+                        if r.status != 200:
+                            errors += 1
+                except aiohttp.ClientError:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'rps': total / elapsed,
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p99_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        'errors': errors,
+    }
+
+
+async def main(args):
+    upstream_port = free_port()
+    upstream = await start_upstream(upstream_port, args.line_latency)
+    upstream_url = f'http://127.0.0.1:{upstream_port}'
+
+    print(f"requests={args.requests} concurrency={args.concurrency} "
+          f"line_latency={args.line_latency * 1000:.0f}ms")
+    print(f"{'server':<30} {'req/s':>10} {'p50 ms':>10} {'p99 ms':>10} {'errors':>8}")
+
+    try:
+        for name, command in SERVERS.items():
+            port = free_port()
+            with tempfile.TemporaryDirectory() as tmp:
+                env = dict(
+                    os.environ,
+                    LINE_CHANNEL_SECRET=CHANNEL_SECRET,
+                    LINE_CHANNEL_ACCESS_TOKEN='bench-token',
+                    LINE_API_HOST=upstream_url,
+                    CWA_API_BASE=upstream_url,
+                    CWA_API_KEY='bench-key',
+                    FORECAST_SHARED_PATH=os.path.join(tmp, 'forecast.bin'),
+                    FORECAST_PERSIST='0',
+                    # 暖身與正式量測使用相同的 webhookEventId，不能被當成重送略過
+                    WEBHOOK_DEDUPE='0',
+                    # 量測吞吐量，不限制每位使用者的查詢頻率
+                    RATE_LIMIT='0',
+                )
+                server = subprocess.Popen(
+                    command + ['--bind', f'127.0.0.1:{port}', '--log-level', 'warning'],
+                    cwd=REPO_DIR, env=env,
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+                )
+                try:
+                    url = f'http://127.0.0.1:{port}'
+                    await wait_ready(url)
+                    # 暖身：建立連線池、載入預報快照與 Flex 快取
+                    await load(url, min(200, args.requests), 10)
+                    result = await load(url, args.requests, args.concurrency)
+                finally:
+                    server.terminate()
+                    server.wait()
+
+            print(f"{name:<30} {result['rps']:>10.0f} {result['p50_ms']:>10.1f} "
+                  f"{result['p99_ms']:>10.1f} {result['errors']:>8}")
+    finally:
+        await upstream.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--line-latency', type=float, default=0.05,
+                        help='模擬 LINE reply API 的延遲秒數')
+    sys.exit(asyncio.run(main(parser.parse_args())))
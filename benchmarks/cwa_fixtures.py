@@ -0,0 +1,235 @@
+"""
+產生與中央氣象署 F-C0032-001 回應結構相同的測試資料（不需要 API 金鑰）
+"""
+import json
+import os
+import random
+import sys
+from datetime import datetime, timedelta, timezone
+
+# 讓 benchmarks/ 底下的腳本可以直接 import 專案模組
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from geo_index import COUNTY_SEATS  # noqa: E402
+from weather_service import SUPPORTED_CITIES  # noqa: E402
+
+FORECAST_ELEMENTS = ('Wx', 'PoP', 'MinT', 'CI', 'MaxT')
+WEATHER_TEXTS = ('晴時多雲', '多雲時陰', '陰短暫雨', '多雲午後短暫雷陣雨')
+COMFORT_TEXTS = ('舒適', '舒適至悶熱', '稍有寒意至舒適', '悶熱')
+
+
+def make_forecast_payload(seed: int = 0, periods: int = 3) -> dict:
+    """
+    建立全台 22 縣市的 F-C0032-001 回應
+
+    Args:
+        seed: 亂數種子（固定則輸出固定）
+        periods: 每個元素的時段數
+
+    Returns:
+        與 CWA 相同結構的 dict
+    """
+    rng = random.Random(seed)
+    starts = ['2026-10-18 18:00:00', '2026-10-19 06:00:00',
+              '2026-10-19 18:00:00', '2026-10-20 06:00:00']
+    ends = starts[1:] + ['2026-10-20 18:00:00']
+
+    locations = []
+    for city in SUPPORTED_CITIES:
+        elements = []
+        for name in FORECAST_ELEMENTS:
+            slots = []
+            for i in range(periods):
+                if name == 'Wx':
+                    parameter = {'parameterName': rng.choice(WEATHER_TEXTS),
+                                 'parameterValue': str(rng.randint(1, 20))}
+                elif name == 'PoP':
+                    parameter = {'parameterName': str(rng.choice((0, 10, 20, 30, 60, 90))),
+                                 'parameterUnit': '百分比'}
+                elif name == 'CI':
+                    parameter = {'parameterName': rng.choice(COMFORT_TEXTS)}
+                else:
+                    parameter = {'parameterName': str(rng.randint(16, 33)),
+                                 'parameterUnit': 'C'}
+                slots.append({'startTime': starts[i % 4], 'endTime': ends[i % 4],
+                              'parameter': parameter})
+            elements.append({'elementName': name, 'time': slots})
+        locations.append({'locationName': city, 'weatherElement': elements})
+
+    return {
+        'success': 'true',
+        'result': {'resource_id': 'F-C0032-001', 'fields': []},
+        'records': {'datasetDescription': '三十六小時天氣預報', 'location': locations},
+    }
+
+
+def make_forecast_bytes(seed: int = 0) -> bytes:
+    """與 make_forecast_payload 相同，但回傳 HTTP 回應的原始 bytes"""
+    return json.dumps(make_forecast_payload(seed), ensure_ascii=False).encode('utf-8')
+
+
+# 各縣市的鄉鎮市區數（合計 368），前幾個用真實名稱，其餘以編號產生
+TOWNSHIP_COUNTS = {
+    '臺北市': 12, '新北市': 29, '桃園市': 13, '臺中市': 29, '臺南市': 37, '高雄市': 38,
+    '基隆市': 7, '新竹市': 3, '新竹縣': 13, '苗栗縣': 18, '彰化縣': 26, '南投縣': 13,
+    '雲林縣': 20, '嘉義市': 2, '嘉義縣': 18, '屏東縣': 33, '宜蘭縣': 12, '花蓮縣': 13,
+    '臺東縣': 16, '澎湖縣': 6, '金門縣': 6, '連江縣': 4,
+}
+TOWNSHIP_NAMES = {
+    '臺北市': ['中正區', '信義區', '大安區'], '新北市': ['板橋區', '中和區', '三重區'],
+    '高雄市': ['鳳山區', '苓雅區', '左營區'], '基隆市': ['中正區', '信義區'],
+    '新竹市': ['東區', '北區', '香山區'], '新竹縣': ['竹北市', '竹東鎮'],
+    '苗栗縣': ['苗栗市', '頭份市'], '嘉義市': ['東區', '西區'], '臺南市': ['東區', '中西區'],
+}
+WEATHER_CODES = (('晴', '01'), ('多雲', '04'), ('陰', '07'), ('多雲短暫陣雨', '08'),
+                 ('多雲午後短暫雷陣雨', '22'))
+# 未指定 ElementName 時回應還包含的因子
+EXTRA_TOWNSHIP_ELEMENTS = (('露點溫度', 'DewPoint'), ('相對濕度', 'RelativeHumidity'),
+                           ('體感溫度', 'ApparentTemperature'), ('風速', 'WindSpeed'),
+                           ('風向', 'WindDirection'))
+
+
+def make_township_payload(seed: int = 0, hours: int = 72, all_elements: bool = False) -> dict:
+    """
+    建立與 F-D0047-093（22 個縣市的 F-D0047 資料集）相同結構的回應
+
+    Args:
+        seed: 亂數種子
+        hours: 預報涵蓋的小時數（天氣現象、降雨機率每 3 小時一筆，溫度、舒適度每小時一筆）
+        all_elements: True 時包含所有因子（未指定 ElementName 的回應）
+
+    Returns:
+        與 CWA 相同結構的 dict
+    """
+    rng = random.Random(seed)
+    first = datetime(2026, 10, 18, 18, tzinfo=timezone(timedelta(hours=8)))
+
+    def iso(offset_hours):
+        return (first + timedelta(hours=offset_hours)).isoformat()
+
+    groups = []
+    for county, count in TOWNSHIP_COUNTS.items():
+        names = TOWNSHIP_NAMES.get(county, [])
+        names = names + [f"第{n}區" for n in range(len(names) + 1, count + 1)]
+        seat = COUNTY_SEATS[county]
+        locations = []
+        for n, township in enumerate(names):
+            three_hourly = range(0, hours, 3)
+            elements = [
+                {'ElementName': '天氣現象', 'Time': [
+                    {'StartTime': iso(h), 'EndTime': iso(h + 3),
+                     'ElementValue': [dict(zip(('Weather', 'WeatherCode'), rng.choice(WEATHER_CODES)))]}
+                    for h in three_hourly]},
+                {'ElementName': '3小時降雨機率', 'Time': [
+                    {'StartTime': iso(h), 'EndTime': iso(h + 3),
+                     'ElementValue': [{'ProbabilityOfPrecipitation': str(rng.choice((0, 10, 20, 40, 70)))}]}
+                    for h in three_hourly]},
+                {'ElementName': '溫度', 'Time': [
+                    {'DataTime': iso(h), 'ElementValue': [{'Temperature': str(rng.randint(16, 33))}]}
+                    for h in range(hours)]},
+                {'ElementName': '舒適度指數', 'Time': [
+                    {'DataTime': iso(h), 'ElementValue': [
+                        {'ComfortIndex': str(rng.randint(15, 30)),
+                         'ComfortIndexDescription': rng.choice(COMFORT_TEXTS)}]}
+                    for h in range(hours)]},
+            ]
+            if all_elements:
+                for name, key in EXTRA_TOWNSHIP_ELEMENTS:
+                    elements.append({'ElementName': name, 'Time': [
+                        {'DataTime': iso(h), 'ElementValue': [{key: str(rng.randint(1, 99))}]}
+                        for h in range(hours)]})
+            locations.append({
+                'LocationName': township,
+                'Geocode': f"{64000000 + len(groups) * 1000 + n}",
+                # 鄉鎮代表點散布在縣市政府所在地附近
+                'Latitude': f"{seat[0] + (rng.random() - 0.5) * 0.4:.6f}",
+                'Longitude': f"{seat[1] + (rng.random() - 0.5) * 0.4:.6f}",
+                'WeatherElement': elements,
+            })
+        groups.append({'DatasetDescription': '臺灣各鄉鎮市區未來3天天氣預報',
+                       'LocationsName': county, 'Dataid': 'D0047', 'Location': locations})
+
+    return {
+        'success': 'true',
+        'result': {'resource_id': 'F-D0047-093', 'fields': []},
+        'records': {'Locations': groups},
+    }
+
+
+def make_township_bytes(seed: int = 0, all_elements: bool = False) -> bytes:
+    """與 make_township_payload 相同，但回傳 HTTP 回應的原始 bytes"""
+    return json.dumps(make_township_payload(seed, all_elements=all_elements),
+                      ensure_ascii=False).encode('utf-8')
+
+
+def make_observation_payload(seed: int = 0, stations: int = 700) -> dict:
+    """
+    建立與 O-A0001-001（自動氣象站即時觀測）相同結構的回應
+
+    Args:
+        seed: 亂數種子
+        stations: 測站數（約 1 成模擬儀器故障，氣溫為 -99）
+
+    Returns:
+        與 CWA 相同結構的 dict
+    """
+    rng = random.Random(seed)
+    counties = list(TOWNSHIP_COUNTS)
+    weights = list(TOWNSHIP_COUNTS.values())
+    observed = '2026-10-18T14:10:00+08:00'
+
+    records = []
+    for n in range(stations):
+        county = rng.choices(counties, weights)[0]
+        seat = COUNTY_SEATS[county]
+        broken = rng.random() < 0.1
+        temperature = -99 if broken else round(rng.uniform(18, 32), 1)
+        records.append({
+            'StationName': f"{county[:2]}{n}",
+            'StationId': f"C0{n:04d}",
+            'ObsTime': {'DateTime': observed},
+            'GeoInfo': {
+                'Coordinates': [
+                    {'CoordinateName': 'TWD67', 'CoordinateFormat': 'decimal degrees',
+                     'StationLatitude': round(seat[0] + (rng.random() - 0.5) * 0.5, 4),
+                     'StationLongitude': round(seat[1] + (rng.random() - 0.5) * 0.5, 4)},
+                    {'CoordinateName': 'WGS84', 'CoordinateFormat': 'decimal degrees',
+                     'StationLatitude': round(seat[0] + (rng.random() - 0.5) * 0.5, 4),
+                     'StationLongitude': round(seat[1] + (rng.random() - 0.5) * 0.5, 4)},
+                ],
+                'StationAltitude': str(rng.randint(5, 2500)),
+                'CountyName': county,
+                'TownName': f"第{rng.randint(1, 10)}區",
+                'CountyCode': '', 'TownCode': '',
+            },
+            'WeatherElement': {
+                'Weather': '-99',
+                'Now': {'Precipitation': rng.choice((0.0, 0.0, 0.5, 3.5))},
+                'WindDirection': rng.randint(0, 359),
+                'WindSpeed': round(rng.uniform(0, 8), 1),
+                'AirTemperature': temperature,
+                'RelativeHumidity': rng.randint(50, 98),
+                'AirPressure': round(rng.uniform(990, 1020), 1),
+                'GustInfo': {'PeakGustSpeed': -99,
+                             'Occurred_at': {'WindDirection': -99, 'DateTime': observed}},
+                'DailyExtreme': {
+                    'DailyHigh': {'TemperatureInfo': {
+                        'AirTemperature': -99 if broken else round(temperature + rng.uniform(0, 3), 1),
+                        'Occurred_at': {'DateTime': observed}}},
+                    'DailyLow': {'TemperatureInfo': {
+                        'AirTemperature': -99 if broken else round(temperature - rng.uniform(0, 6), 1),
+                        'Occurred_at': {'DateTime': observed}}},
+                },
+            },
+        })
+
+    return {
+        'success': 'true',
+        'result': {'resource_id': 'O-A0001-001', 'fields': []},
+        'records': {'Station': records},
+    }
+
+
+def make_observation_bytes(seed: int = 0) -> bytes:
+    """與 make_observation_payload 相同，但回傳 HTTP 回應的原始 bytes"""
+    return json.dumps(make_observation_payload(seed), ensure_ascii=False).encode('utf-8')
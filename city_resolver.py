@@ -0,0 +1,279 @@
+"""
+縣市名稱解析
+使用者輸入的縣市名稱在 import 時就建好索引：
+- 別名雜湊表：簡稱（北市、竹縣）、英文 / 拼音（Kaohsiung、gaoxiong）、
+  改制前的縣名（臺北縣、高雄縣）與縣治所在地（竹北、斗六），O(1) 查表
+- 編輯距離索引（symmetric deletion）：找打錯一兩個字的名稱（高熊市 → 高雄市、Kaohsuing → 高雄市）
+"""
+import functools
+import re
+import unicodedata
+from typing import NamedTuple
+
+# 各縣市的別名（「臺/台」差異、去掉市 / 縣後綴與英文加上 city / county 會自動產生）
+CITY_ALIASES = {
+    '臺北市': ['北市', 'taipei', 'taibei'],
+    '新北市': ['新北', '臺北縣', '北縣', '板橋', 'newtaipei', 'xinbei', 'taipeicounty'],
+    '桃園市': ['桃市', '桃園縣', '桃縣', 'taoyuan'],
+    '臺中市': ['中市', '臺中縣', '中縣', 'taichung', 'taizhong'],
+    '臺南市': ['南市', '臺南縣', '南縣', 'tainan'],
+    '高雄市': ['高市', '高雄縣', '高縣', '鳳山', 'kaohsiung', 'gaoxiong'],
+    '基隆市': ['基市', 'keelung', 'jilong', 'chilung'],
+    '新竹市': ['竹市', 'hsinchu', 'xinzhu'],
+    '新竹縣': ['竹縣', '竹北', 'hsinchucounty', 'xinzhucounty', 'zhubei', 'jhubei', 'chupei'],
+    '苗栗縣': ['苗縣', '苗市', 'miaoli'],
+    '彰化縣': ['彰縣', '彰市', 'changhua', 'zhanghua'],
+    '南投縣': ['投縣', '投市', 'nantou'],
+    '雲林縣': ['雲縣', '斗六', 'yunlin', 'douliu', 'touliu'],
+    '嘉義市': ['嘉市', 'chiayi', 'jiayi'],
+    '嘉義縣': ['嘉縣', '太保', 'chiayicounty', 'jiayicounty', 'taibao'],
+    '屏東縣': ['屏縣', '屏市', 'pingtung', 'pingdong'],
+    '宜蘭縣': ['宜縣', '宜市', 'yilan', 'ilan'],
+    '花蓮縣': ['花縣', '花市', 'hualien', 'hualian'],
+    '臺東縣': ['東縣', '東市', 'taitung', 'taidong'],
+    '澎湖縣': ['澎縣', '馬公', 'penghu', 'magong', 'makung', 'pescadores'],
+    '金門縣': ['金縣', '金城', 'kinmen', 'jinmen', 'quemoy'],
+    '連江縣': ['連縣', '馬祖', '南竿', 'lienchiang', 'lianjiang', 'matsu', 'mazu', 'nangan'],
+}
+
+# 去掉後綴的名稱（「新竹」「嘉義」）市優先於縣，與原本 normalize_city_name 的規則相同
+_SUFFIX_ORDER = ('市', '縣')
+
+# 英文輸入中可以忽略的空白與標點
+_LATIN_NOISE = re.compile(r"[\s\-'’.,]+")
+
+
+def normalize_key(text: str) -> str:
+    """
+    查表前的正規化：全形轉半形、英文轉小寫、台 → 臺、去掉空白與標點
+
+    Args:
+        text: 使用者輸入
+
+    Returns:
+        索引用的 key
+    """
+    text = unicodedata.normalize('NFKC', text).strip().lower().replace('台', '臺')
+    return _LATIN_NOISE.sub('', text)
+
+
+def compile_pattern(word: str) -> tuple:
+    """
+    預先算好 word 中每個字元出現位置的 bitmask（給 pattern_distance 用）
+
+    Returns:
+        (字元 -> bitmask, 全部位元, 最高位元, 長度)
+    """
+    positions = {}
+    for i, ch in enumerate(word):
+        positions[ch] = positions.get(ch, 0) | (1 << i)
+    return positions, (1 << len(word)) - 1, 1 << max(len(word) - 1, 0), len(word)
+
+
+def pattern_distance(pattern: tuple, text: str) -> int:
+    """
+    compile_pattern 的 word 與 text 的編輯距離
+
+    以 Hyyrö 的 bit-parallel 演算法計算，text 的每個字元只做幾次整數位元運算。
+    """
+    positions, mask, high, score = pattern
+    if not score:
+        return len(text)
+    vp, vn, d0, previous_eq = mask, 0, 0, 0
+    for ch in text:
+        eq = positions.get(ch, 0)
+        transposed = (((~d0) & eq) << 1) & previous_eq
+        d0 = ((((eq & vp) + vp) ^ vp) | eq | vn | transposed) & mask
+        hp = (vn | ~(d0 | vp)) & mask
+        hn = vp & d0
+        if hp & high:
+            score += 1
+        elif hn & high:
+            score -= 1
+        hp = ((hp << 1) | 1) & mask
+        hn = (hn << 1) & mask
+        vp = (hn | ~(d0 | hp)) & mask
+        vn = hp & d0
+        previous_eq = eq
+    return score
+
+
+def edit_distance(a: str, b: str) -> int:
+    """
+    編輯距離（optimal string alignment：插入、刪除、替換與相鄰兩字互換各算 1）
+
+    互換（tianan → tainan）是英文輸入最常見的打錯方式。
+    """
+    return pattern_distance(compile_pattern(a), b)
+
+
+def common_prefix(a: str, b: str) -> int:
+    """共同前綴的長度"""
+    length = 0
+    for ca, cb in zip(a, b):
+        if ca != cb:
+            break
+        length += 1
+    return length
+
+
+class DeletionIndex:
+    """
+    編輯距離索引（symmetric deletion）：預先記錄每個名稱刪掉最多 depth 個字後的所有字串
+
+    距離 k 以內的兩個字串，各刪掉最多 k 個字後一定有相同的結果（替換、互換刪掉同一處，
+    插入刪掉多出的字），查詢時只要產生輸入的刪除變化查表，再以 pattern_distance 確認距離。
+    名稱都很短、彼此距離集中在 2～3，BK-tree 的三角不等式幾乎剪不掉子樹，這裡查表即可。
+
+    Args:
+        words: 名稱
+        depth: 最多刪除幾個字（= 可查詢的最大距離）
+    """
+
+    def __init__(self, words=(), depth: int = 1):
+        self.depth = depth
+        self.patterns = {}
+        self.variants = {}
+        for word in words:
+            self.add(word)
+
+    @staticmethod
+    def deletions(word: str, depth: int) -> set:
+        """word 刪掉 0～depth 個字的所有字串"""
+        found = {word}
+        level = {word}
+        for _ in range(depth):
+            level = {w[:i] + w[i + 1:] for w in level for i in range(len(w))}
+            found |= level
+        return found
+
+    def add(self, word: str):
+        """加入一個名稱"""
+        if word in self.patterns:
+            return
+        self.patterns[word] = compile_pattern(word)
+        for variant in self.deletions(word, self.depth):
+            self.variants.setdefault(variant, []).append(word)
+
+    def search(self, word: str, max_distance: int) -> list:
+        """
+        找出距離在 max_distance 以內的名稱
+
+        Returns:
+            [(distance, word)]，依距離排序
+        """
+        max_distance = min(max_distance, self.depth)
+        candidates = set()
+        for variant in self.deletions(word, max_distance):
+            candidates.update(self.variants.get(variant, ()))
+        found = []
+        for candidate in candidates:
+            distance = pattern_distance(self.patterns[candidate], word)
+            if distance <= max_distance:
+                found.append((distance, candidate))
+        found.sort()
+        return found
+
+
+class CityMatch(NamedTuple):
+    """解析結果：縣市全名與比對方式（exact / alias / fuzzy）"""
+    city: str
+    method: str
+
+
+# 別名的優先順序：數字小的優先（模糊比對距離相同時用來決定）
+_RANK_CANONICAL = 0
+_RANK_BASE = 1
+_RANK_ALIAS = 2
+
+
+class CityResolver:
+    """
+    縣市名稱解析器（import 時建立，之後只讀）
+
+    Args:
+        cities: 支援的縣市全名
+        aliases: {縣市全名: [別名]}
+    """
+
+    def __init__(self, cities, aliases: dict = CITY_ALIASES):
+        self.cities = tuple(cities)
+        # key -> (縣市全名, 優先順序)
+        self.index = {}
+        for city in self.cities:
+            self._add(city, city, _RANK_CANONICAL)
+        for suffix in _SUFFIX_ORDER:
+            for city in self.cities:
+                if city.endswith(suffix):
+                    self._add(city[:-1], city, _RANK_BASE)
+        for city in self.cities:
+            latin_suffix = 'city' if city.endswith('市') else 'county'
+            for alias in aliases.get(city, ()):
+                self._add(alias, city, _RANK_ALIAS)
+                if alias.isascii() and not alias.endswith(('city', 'county')):
+                    self._add(alias + latin_suffix, city, _RANK_ALIAS)
+        # 英文與中文分開建立（不同文字之間不可能在容忍距離內）
+        self.latin_fuzzy = DeletionIndex((key for key in self.index if key.isascii()), depth=2)
+        self.cjk_fuzzy = DeletionIndex((key for key in self.index if not key.isascii()), depth=1)
+
+    def _add(self, name: str, city: str, rank: int):
+        # 先加入的優先（例如「新竹」對應新竹市而不是新竹縣）
+        self.index.setdefault(normalize_key(name), (city, rank))
+
+    def is_county_name(self, text: str) -> bool:
+        """text 是否為縣市全名或去掉市 / 縣的名稱（不含簡稱、英文等別名）"""
+        entry = self.index.get(normalize_key(text))
+        return entry is not None and entry[1] < _RANK_ALIAS
+
+    @staticmethod
+    def max_distance(key: str) -> int:
+        """
+        可容忍的編輯距離：中文三字以上 1 字；英文 4 字母以上 1 個、8 字母以上 2 個
+
+        中文兩字的輸入改一字就是另一個地名（中壢 → 中市、南部 → 南投、東區 → 東縣），不做模糊比對
+        """
+        if key.isascii():
+            if len(key) >= 8:
+                return 2
+            return 1 if len(key) >= 4 else 0
+        return 1 if len(key) >= 3 else 0
+
+    def resolve(self, text: str):
+        """
+        解析使用者輸入的縣市名稱
+
+        Args:
+            text: 例如「台北」「北市」「Kaohsiung」「高熊市」
+
+        Returns:
+            CityMatch，找不到或有多個同樣接近的縣市時為 None
+        """
+        # 多數輸入（點選 Rich Menu 送出的全名）不需正規化就能查到
+        entry = self.index.get(text)
+        key = text
+        if entry is None:
+            key = normalize_key(text)
+            entry = self.index.get(key)
+        if entry is not None:
+            city, rank = entry
+            return CityMatch(city, 'exact' if rank == _RANK_CANONICAL else 'alias')
+        city = self._fuzzy(key)
+        return CityMatch(city, 'fuzzy') if city else None
+
+    @functools.lru_cache(maxsize=4096)
+    def _fuzzy(self, key: str):
+        limit = self.max_distance(key)
+        if limit == 0:
+            return None
+        fuzzy = self.latin_fuzzy if key.isascii() else self.cjk_fuzzy
+        matches = fuzzy.search(key, limit)
+        if not matches:
+            return None
+        # 距離最近 → 共同前綴較長（竹北市 → 竹北，而不是北市）→ 優先順序較高
+        best = matches[0][0]
+        ranked = [(-common_prefix(key, word), self.index[word][1], self.index[word][0])
+                  for distance, word in matches if distance == best]
+        top = min(ranked)[:2]
+        cities = {city for prefix, rank, city in ranked if (prefix, rank) == top}
+        # 「臺灣市」與臺北市 / 臺中市 / 臺南市都只差一字：不猜
+        return cities.pop() if len(cities) == 1 else None
@@ -0,0 +1,277 @@
+"""
+CWA 大型回應的串流解析
+邊下載邊解析：只走訪外層的物件 / 陣列結構，目標路徑上的每個元素（例如一個 location）
+收齊後才以 json 的 C 解碼器轉成 Python 物件、交給呼叫端轉成內部紀錄後丟棄，
+記憶體高峰與單一元素成正比，不必先把整份回應（數 MB 的 bytes 與數十 MB 的 dict）留在記憶體。
+"""
+import codecs
+import hashlib
+import json
+import re
+import time
+
+from metrics import STAGE_SECONDS
+
+# 每次從 HTTP 回應讀取的 bytes
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_NON_WHITESPACE = re.compile(r'[^ \t\n\r]')
+_NUMBER_CHARS = frozenset('0123456789.eE+-')
+
+# 緩衝區內的資料還不足以解出下一個值
+_NEED_MORE = object()
+
+
+class JSONPathParser:
+    """
+    增量 JSON 解析器：依路徑取出陣列元素，其餘內容只在經過時解碼
+
+    路徑以物件的 key 與 '*'（陣列的每個元素）組成，例如 ('records', 'location', '*')。
+    每個元素附帶 context：外層物件中出現在它之前的純量欄位（例如 LocationsName）。
+
+    Args:
+        path: 目標元素的路徑
+    """
+
+    def __init__(self, path: tuple):
+        self.path = tuple(path)
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        self._wait = 0          # 上次解不出值時未消耗的長度 x 2，資料累積到這裡再重試
+        self._stack = []        # [是否為物件, 深度, 狀態, 純量欄位, 目前的 key]
+        self._done = False
+        self._closed = False
+
+    def feed(self, data: bytes) -> list:
+        """
+        加入下一段回應內容
+
+        Args:
+            data: HTTP 回應的一段 bytes（可在 UTF-8 字元中間切開）
+
+        Returns:
+            這段資料中完成的 (context, 元素) 列表
+        """
+        self._buf = self._buf[self._pos:] + self._utf8.decode(data)
+        self._pos = 0
+        items = []
+        if len(self._buf) >= self._wait:
+            self._parse(items)
+        return items
+
+    def close(self) -> list:
+        """
+        回應結束
+
+        Returns:
+            最後完成的 (context, 元素) 列表
+
+        Raises:
+            ValueError: JSON 不完整或格式錯誤
+        """
+        self._buf = self._buf[self._pos:] + self._utf8.decode(b'', final=True)
+        self._pos = 0
+        self._closed = True
+        items = []
+        self._parse(items)
+        if not self._done:
+            raise ValueError("truncated JSON payload")
+        return items
+
+    def _peek(self) -> str:
+        match = _NON_WHITESPACE.search(self._buf, self._pos)
+        if match is None:
+            self._pos = len(self._buf)
+            return ''
+        self._pos = match.start()
+        return self._buf[self._pos]
+
+    def _decode(self):
+        """解出目前位置的完整值；資料還沒收齊時回傳 _NEED_MORE"""
+        try:
+            value, end = self._json.raw_decode(self._buf, self._pos)
+        except json.JSONDecodeError as e:
+            if self._closed:
+                raise ValueError(f"invalid JSON payload: {e}") from None
+            value, end = _NEED_MORE, None
+        # 數字可能在緩衝區結尾被切開（"6" 後面還有 ".5e3"），後面必須已經出現分隔字元
+        if not self._closed and end is not None and (
+                end == len(self._buf) or self._buf[end] in _NUMBER_CHARS):
+            value = _NEED_MORE
+        if value is _NEED_MORE:
+            # 大於一段的元素不要每收到一段就從頭重解一次
+            self._wait = 2 * (len(self._buf) - self._pos)
+            return _NEED_MORE
+        self._wait = 0
+        self._pos = end
+        return value
+
+    def _context(self) -> dict:
+        context = {}
+        for frame in self._stack:
+            context.update(frame[3])
+        return context
+
+    def _value(self, depth: int, items: list) -> bool:
+        """
+        處理深度 depth 的一個值：目標元素輸出、路徑上的容器往下走、其餘解碼後略過
+
+        Returns:
+            是否已消耗（False 表示需要更多資料）
+        """
+        char = self._buf[self._pos]
+        if depth == len(self.path):
+            value = self._decode()
+            if value is _NEED_MORE:
+                return False
+            items.append((self._context(), value))
+            return True
+
+        wanted = '[' if self.path[depth] == '*' else '{'
+        if char == wanted:
+            self._pos += 1
+            self._stack.append([char == '{', depth, 'first', {}, None])
+            return True
+
+        # 形狀與路徑不符（例如 null）：整個值略過
+        return self._skip(self._stack[-1] if self._stack else None)
+
+    def _parse(self, items: list):
+        while not self._done:
+            char = self._peek()
+            if not char:
+                return
+
+            if not self._stack:
+                if not self._value(0, items):
+                    return
+                if not self._stack:
+                    self._done = True
+                continue
+
+            frame = self._stack[-1]
+            is_object, depth, state = frame[0], frame[1], frame[2]
+
+            if state in ('first', 'next') and char in '}]':
+                self._pos += 1
+                self._stack.pop()
+                if not self._stack:
+                    self._done = True
+                continue
+
+            if state == 'next':
+                if char != ',':
+                    raise ValueError(f"invalid JSON payload: unexpected {char!r}")
+                self._pos += 1
+                frame[2] = 'key' if is_object else 'value'
+                continue
+
+            if is_object and state in ('first', 'key'):
+                key = self._decode()
+                if key is _NEED_MORE:
+                    return
+                frame[4] = key
+                frame[2] = 'colon'
+                continue
+
+            if state == 'colon':
+                if char != ':':
+                    raise ValueError(f"invalid JSON payload: unexpected {char!r}")
+                self._pos += 1
+                frame[2] = 'value'
+                continue
+
+            # 物件的值或陣列的元素：只有路徑上的 key 往下走
+            on_path = not is_object or self.path[depth] == frame[4]
+            frame[2] = 'next'
+            if on_path:
+                consumed = self._value(depth + 1, items)
+            else:
+                consumed = self._skip(frame)
+            if not consumed:
+                frame[2] = 'value'
+                return
+
+        if self._peek():
+            raise ValueError("invalid JSON payload: extra data")
+
+    def _skip(self, frame) -> bool:
+        """解碼並略過一個值；物件中的純量欄位保留為 context"""
+        value = self._decode()
+        if value is _NEED_MORE:
+            return False
+        if frame is not None and frame[0] and not isinstance(value, (dict, list)):
+            frame[3][frame[4]] = value
+        return True
+
+
+class PayloadStream:
+    """
+    邊下載邊解析一份 CWA 回應，同時計算 SHA-256（判斷內容是否變更）與大小
+
+    Args:
+        path: 目標元素的路徑（見 JSONPathParser）
+        builder: 無參數函式，回傳具有 add(context, item) 與 finish() 的物件；
+                 每個元素交給 add，finish 的回傳值為解析結果
+        max_bytes: 回應大小上限，None 表示不限制
+        stage: 解析時間記錄到 line_weather_stage_seconds 的 stage 名稱
+    """
+
+    def __init__(self, path: tuple, builder, max_bytes: int = None, stage: str = None):
+        self.path = tuple(path)
+        self.builder = builder
+        self.max_bytes = max_bytes
+        self.stage = stage
+        self.reset()
+
+    def reset(self):
+        """重新開始（重試時捨棄上一次收到一半的內容）"""
+        self._parser = JSONPathParser(self.path)
+        self._target = self.builder()
+        self._hash = hashlib.sha256()
+        self.size = 0
+        self.parse_seconds = 0.0
+        self.result = None
+
+    def feed(self, chunk: bytes):
+        """
+        加入下一段回應內容
+
+        Raises:
+            ValueError: 超過 max_bytes 或 JSON 格式錯誤
+        """
+        self.size += len(chunk)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            raise ValueError(f"payload too large: more than {self.max_bytes} bytes")
+        self._hash.update(chunk)
+
+        started = time.perf_counter()
+        for context, item in self._parser.feed(chunk):
+            self._target.add(context, item)
+        self.parse_seconds += time.perf_counter() - started
+
+    def close(self):
+        """
+        回應結束，取得解析結果
+
+        Returns:
+            builder 物件 finish() 的回傳值
+
+        Raises:
+            ValueError: JSON 不完整或格式錯誤
+        """
+        started = time.perf_counter()
+        for context, item in self._parser.close():
+            self._target.add(context, item)
+        self.result = self._target.finish()
+        self.parse_seconds += time.perf_counter() - started
+
+        if self.stage:
+            STAGE_SECONDS.labels(self.stage).observe(self.parse_seconds)
+        return self.result
+
+    def hexdigest(self) -> str:
+        """已收到內容的 SHA-256（與 hashlib.sha256(response.content) 相同）"""
+        return self._hash.hexdigest()
@@ -0,0 +1,270 @@
+"""
+Webhook 事件去重索引
+以 webhookEventId 記錄最近處理過的事件，同一台機器的所有 worker 共用（mmap + flock），
+LINE 重送（deliveryContext.isRedelivery）的事件在呼叫 CWA / 回覆之前就被略過。
+
+檔案格式（little-endian）：
+    header : magic(4s) 版本(H) 保留(H) 槽位數(I)
+    slots  : 每槽 key(Q) expires_at(d)；key 為 64-bit hash，0 代表空槽
+
+固定大小的開放定址雜湊表：插入時在探測範圍內重用空槽或已過期的槽，
+都沒有時覆蓋最早到期的槽，因此記憶體用量固定、不需要另外清理。
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import WEBHOOK_DUPLICATES
+
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sHHI')
+SLOT = struct.Struct('<Qd')
+
+# 同一個 key 最多探測幾個槽
+PROBE_LIMIT = 16
+
+
+def default_index_path(name: str = 'line_weather_dedupe.bin') -> str:
+    """預設放在 /dev/shm（tmpfs），沒有時放系統暫存目錄"""
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base, name)
+
+
+WEBHOOK_DEDUPE_PATH = os.getenv('WEBHOOK_DEDUPE_PATH') or default_index_path()
+
+# 槽位數（每槽 16 bytes，預設 64K 槽 = 1 MiB）
+WEBHOOK_DEDUPE_CAPACITY = int(os.getenv('WEBHOOK_DEDUPE_CAPACITY', 65536))
+
+# 記住事件幾秒（LINE 的重送在數分鐘內發生）
+WEBHOOK_DEDUPE_TTL = float(os.getenv('WEBHOOK_DEDUPE_TTL', 3600))
+
+
+def key_hash(key: str) -> int:
+    """字串 key 的 64-bit hash（不會是 0，0 保留給空槽）"""
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') or 1
+
+
+class SlotTable:
+    """
+    mmap 上固定大小的「key hash -> 到期時間」表
+
+    path 為 None 時使用匿名記憶體，只在本行程內有效（fork 後各自重建）；
+    指定檔案時同一台機器的所有行程共用，以 flock 互斥。
+
+    Args:
+        path: 表格檔路徑，None 表示不共用
+        capacity: 槽位數（檔案已存在時以檔案為準）
+        magic: 檔案標頭的 4 bytes 識別碼
+    """
+
+    def __init__(self, path, capacity: int, magic: bytes):
+        self.path = path
+        self.capacity = capacity
+        self.magic = magic
+        self.evicted = 0
+
+        self._fd = None
+        self._map = None
+        self._pid = None
+        # flock 以開啟的檔案為單位，同一行程的執行緒之間另外需要一把鎖
+        self._lock = threading.Lock()
+        self._open()
+
+    def _open(self):
+        """開啟（必要時建立）表格；fork 之後重新開啟，避免共用父行程的 flock"""
+        if self._map is not None:
+            self._map.close()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+        self._pid = os.getpid()
+        size = HEADER.size + SLOT.size * self.capacity
+        if self.path is None:
+            self._map = mmap.mmap(-1, size, flags=mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS)
+            return
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            header = os.pread(fd, HEADER.size, 0)
+            if len(header) == HEADER.size:
+                magic, version, _, capacity = HEADER.unpack(header)
+                if magic == self.magic and version == FORMAT_VERSION:
+                    self.capacity = capacity
+                    size = HEADER.size + SLOT.size * capacity
+                    header = None
+            if header is not None:
+                # 新檔或格式不符：重新初始化
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+                os.pwrite(fd, HEADER.pack(self.magic, FORMAT_VERSION, 0, self.capacity), 0)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+        self._fd = fd
+        self._map = mmap.mmap(fd, size)
+
+    @contextmanager
+    def locked(self):
+        """取得表格的獨占存取（本行程執行緒 + 跨行程 flock）"""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._open()
+            if self._fd is None:
+                yield
+                return
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _offset(self, index: int) -> int:
+        return HEADER.size + SLOT.size * index
+
+    def lookup(self, key: int, now: float) -> tuple:
+        """
+        在探測範圍內找 key（呼叫前須持有 locked()）
+
+        Args:
+            key: 64-bit key hash
+            now: 目前時間，到期時間不晚於此的槽視為空槽
+
+        Returns:
+            (槽位, 到期時間)：找到未到期的 key 時到期時間為其值，
+            否則槽位為可寫入的位置、到期時間為 None
+        """
+        start = key % self.capacity
+        free = None
+        oldest, oldest_expires = None, None
+        for probe in range(PROBE_LIMIT):
+            index = (start + probe) % self.capacity
+            slot_key, expires_at = SLOT.unpack_from(self._map, self._offset(index))
+            if slot_key == key and expires_at > now:
+                return index, expires_at
+            if free is None and (slot_key == 0 or expires_at <= now):
+                free = index
+            if oldest_expires is None or expires_at < oldest_expires:
+                oldest, oldest_expires = index, expires_at
+
+        if free is None:
+            # 探測範圍內都是有效紀錄：覆蓋最早到期的那一筆
+            free = oldest
+            self.evicted += 1
+        return free, None
+
+    def write(self, index: int, key: int, expires_at: float):
+        """寫入一個槽（呼叫前須持有 locked()）"""
+        SLOT.pack_into(self._map, self._offset(index), key, expires_at)
+
+    def clear(self, key: int):
+        """移除 key（呼叫前須持有 locked()）"""
+        start = key % self.capacity
+        for probe in range(PROBE_LIMIT):
+            offset = self._offset((start + probe) % self.capacity)
+            if SLOT.unpack_from(self._map, offset)[0] == key:
+                SLOT.pack_into(self._map, offset, 0, 0.0)
+                return
+
+
+class EventDedupeIndex(SlotTable):
+    """
+    跨 worker 共用、有上限且會依 TTL 淘汰的去重索引
+
+    Args:
+        path: 索引檔路徑
+        capacity: 槽位數（檔案已存在時以檔案為準）
+        ttl: 記住事件的秒數
+    """
+
+    def __init__(self, path: str = WEBHOOK_DEDUPE_PATH,
+                 capacity: int = WEBHOOK_DEDUPE_CAPACITY, ttl: float = WEBHOOK_DEDUPE_TTL):
+        self.ttl = ttl
+
+        # 本行程的統計（跨 worker 的總數見 /metrics）
+        self.checked = 0
+        self.duplicates = 0
+        super().__init__(path, capacity, b'LWDD')
+
+    def seen(self, event_id: str, redelivery: bool = False) -> bool:
+        """
+        檢查事件是否處理過；沒有的話記錄下來
+
+        Args:
+            event_id: webhookEventId
+            redelivery: deliveryContext.isRedelivery（只用於統計）
+
+        Returns:
+            True 表示重複（應略過），False 表示第一次看到（已記錄）
+        """
+        key = key_hash(event_id)
+        now = time.time()
+
+        with self.locked():
+            self.checked += 1
+            index, expires_at = self.lookup(key, now)
+            if expires_at is not None:
+                self.duplicates += 1
+                WEBHOOK_DUPLICATES.labels('true' if redelivery else 'false').inc()
+                return True
+            self.write(index, key, now + self.ttl)
+            return False
+
+    def forget(self, event_id: str):
+        """
+        移除事件紀錄（處理失敗、希望 LINE 重送時能再處理一次）
+
+        Args:
+            event_id: webhookEventId
+        """
+        with self.locked():
+            self.clear(key_hash(event_id))
+
+    def forget_events(self, events: list):
+        """
+        移除一批事件的紀錄（filter_events 之後寫入佇列或處理失敗時呼叫）
+
+        Args:
+            events: webhook body 中的事件 dict 列表
+        """
+        for event in events:
+            if event.get('webhookEventId'):
+                self.forget(event['webhookEventId'])
+
+    def filter_events(self, events: list) -> list:
+        """
+        過濾掉處理過的事件（沒有 webhookEventId 的事件一律保留）
+
+        Args:
+            events: webhook body 中的事件 dict 列表
+
+        Returns:
+            尚未處理過的事件
+        """
+        fresh = []
+        for event in events:
+            event_id = event.get('webhookEventId')
+            redelivery = bool((event.get('deliveryContext') or {}).get('isRedelivery'))
+            if event_id and self.seen(event_id, redelivery):
+                continue
+            fresh.append(event)
+        return fresh
+
+    def stats(self) -> dict:
+        """索引統計，供 /health 顯示"""
+        return {
+            'path': self.path,
+            'capacity': self.capacity,
+            'ttl_seconds': self.ttl,
+            'checked': self.checked,
+            'duplicates': self.duplicates,
+            'evicted': self.evicted,
+        }
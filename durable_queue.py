@@ -0,0 +1,245 @@
+"""
+Webhook 事件的耐久佇列（SQLite WAL）
+/callback 驗證簽章後寫入，由 webhook_consumer.py 這個獨立行程取出處理。
+worker 重啟或 LINE 大量重送時事件不會遺失，同一個 webhookEventId 只會處理一次。
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# 佇列檔位置（與預報快照同樣放在 data/，docker-compose 會掛載出來）
+WEBHOOK_QUEUE_PATH = os.getenv(
+    'WEBHOOK_QUEUE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'webhook_events.db')
+)
+
+# 已處理事件保留幾秒（用來判斷重送的事件是否已處理過）
+WEBHOOK_QUEUE_RETENTION = int(os.getenv('WEBHOOK_QUEUE_RETENTION', 86400))
+
+# 取出後多久沒有 ack 就視為 consumer 已中斷，重新交給其他 consumer
+WEBHOOK_QUEUE_LEASE = float(os.getenv('WEBHOOK_QUEUE_LEASE', 60))
+
+# 處理失敗幾次後不再重試（狀態改為 dead）
+WEBHOOK_QUEUE_MAX_ATTEMPTS = int(os.getenv('WEBHOOK_QUEUE_MAX_ATTEMPTS', 5))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS webhook_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    event_id TEXT NOT NULL UNIQUE,
+    destination TEXT,
+    event TEXT NOT NULL,
+    received_at REAL NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_until REAL NOT NULL DEFAULT 0,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS webhook_events_ready
+    ON webhook_events (status, lease_until, id);
+"""
+
+
+class QueuedEvent:
+    """從佇列取出的一筆事件"""
+
+    __slots__ = ('id', 'event_id', 'destination', 'event', 'received_at', 'attempts')
+
+    def __init__(self, id, event_id, destination, event, received_at, attempts):
+        self.id = id
+        self.event_id = event_id
+        self.destination = destination
+        self.event = event              # 事件的原始 JSON 文字
+        self.received_at = received_at
+        self.attempts = attempts
+
+
+def event_key(event: dict) -> str:
+    """
+    事件的去重 key
+
+    Args:
+        event: webhook body 中的單一事件
+
+    Returns:
+        webhookEventId，沒有時以事件內容的 SHA-256 代替
+    """
+    event_id = event.get('webhookEventId')
+    if event_id:
+        return event_id
+    raw = json.dumps(event, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return 'sha256:' + hashlib.sha256(raw).hexdigest()
+
+
+class DurableEventQueue:
+    """
+    SQLite WAL 模式的事件佇列（可多行程同時讀寫）
+
+    - enqueue：同一個 webhook body 的事件在一個交易內寫入，webhookEventId 重複時略過
+    - claim：以租約取出一批事件，consumer 中斷時租約到期會重新被取出（at-least-once）
+    - ack / fail：處理成功標記為 done；失敗退避後重試，超過次數標記為 dead
+
+    Args:
+        path: SQLite 檔案路徑
+    """
+
+    def __init__(self, path: str = WEBHOOK_QUEUE_PATH):
+        self.path = path
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connect().executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        """每個執行緒（與 fork 之後的子行程）各自使用一條連線"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # WAL 下 NORMAL 只在斷電時可能遺失最後幾筆交易，行程中斷不會遺失
+        conn.execute('PRAGMA synchronous=' + os.getenv('WEBHOOK_QUEUE_SYNCHRONOUS', 'NORMAL'))
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """
+        明確的交易（連線為 autocommit，`with conn:` 不會開始交易）
+
+        Yields:
+            sqlite3.Connection；區塊內的寫入一起 COMMIT，發生例外時 ROLLBACK
+        """
+        conn = self._connect()
+        # IMMEDIATE：開始時就取得寫入鎖，避免多個行程同時升級鎖而 SQLITE_BUSY
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def enqueue(self, body) -> int:
+        """
+        寫入一個 webhook body 的全部事件（呼叫前須已驗證簽章）
+
+        Args:
+            body: webhook request body（原始文字，或已 json.loads 的 dict）
+
+        Returns:
+            新寫入的事件數（重複的 webhookEventId 不計）
+        """
+        payload = body if isinstance(body, dict) else json.loads(body)
+        destination = payload.get('destination')
+        now = time.time()
+        rows = [
+            (event_key(event), destination,
+             json.dumps(event, ensure_ascii=False, separators=(',', ':')), now)
+            for event in payload.get('events', [])
+        ]
+        if not rows:
+            return 0
+
+        with self._transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                'INSERT OR IGNORE INTO webhook_events '
+                '(event_id, destination, event, received_at) VALUES (?, ?, ?, ?)',
+                rows
+            )
+            return conn.total_changes - before
+
+    def claim(self, limit: int, lease: float = WEBHOOK_QUEUE_LEASE) -> list:
+        """
+        取出最多 limit 筆待處理事件並加上租約
+
+        Args:
+            limit: 最多取出幾筆
+            lease: 租約秒數
+
+        Returns:
+            QueuedEvent 列表（依寫入順序）
+        """
+        now = time.time()
+        rows = self._connect().execute(
+            'UPDATE webhook_events SET lease_until = ?, attempts = attempts + 1 '
+            'WHERE id IN ('
+            '  SELECT id FROM webhook_events '
+            '  WHERE status = \'pending\' AND lease_until <= ? ORDER BY id LIMIT ?'
+            ') RETURNING id, event_id, destination, event, received_at, attempts',
+            (now + lease, now, limit)
+        ).fetchall()
+        return sorted((QueuedEvent(*row) for row in rows), key=lambda e: e.id)
+
+    def ack(self, ids: list):
+        """
+        標記事件已處理完成
+
+        Args:
+            ids: QueuedEvent.id 列表
+        """
+        if not ids:
+            return
+        with self._transaction() as conn:
+            conn.executemany(
+                'UPDATE webhook_events SET status = \'done\', last_error = NULL WHERE id = ?',
+                [(i,) for i in ids]
+            )
+
+    def fail(self, item: QueuedEvent, error: str, retry_in: float,
+             max_attempts: int = WEBHOOK_QUEUE_MAX_ATTEMPTS):
+        """
+        記錄處理失敗：未超過次數時 retry_in 秒後重試，否則標記為 dead
+
+        Args:
+            item: 失敗的事件
+            error: 失敗原因
+            retry_in: 幾秒後重試
+            max_attempts: 最多嘗試次數
+        """
+        status = 'dead' if item.attempts >= max_attempts else 'pending'
+        with self._transaction() as conn:
+            conn.execute(
+                'UPDATE webhook_events SET status = ?, lease_until = ?, last_error = ? '
+                'WHERE id = ?',
+                (status, time.time() + retry_in, error, item.id)
+            )
+
+    def prune(self, retention: float = WEBHOOK_QUEUE_RETENTION) -> int:
+        """
+        刪除超過保留時間的已完成 / dead 事件
+
+        Returns:
+            刪除的筆數
+        """
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                'DELETE FROM webhook_events '
+                'WHERE status IN (\'done\', \'dead\') AND received_at < ?',
+                (time.time() - retention,)
+            )
+        return cursor.rowcount
+
+    def stats(self) -> dict:
+        """佇列統計，供 /health 顯示"""
+        conn = self._connect()
+        counts = dict(conn.execute(
+            'SELECT status, COUNT(*) FROM webhook_events GROUP BY status').fetchall())
+        oldest = conn.execute(
+            'SELECT MIN(received_at) FROM webhook_events WHERE status = \'pending\''
+        ).fetchone()[0]
+        return {
+            'path': self.path,
+            'pending': counts.get('pending', 0),
+            'done': counts.get('done', 0),
+            'dead': counts.get('dead', 0),
+            'oldest_pending_seconds': None if oldest is None else round(time.time() - oldest, 1),
+        }
@@ -0,0 +1,379 @@
+"""
+Webhook 事件背景處理
+/callback 驗證簽章後把事件放進有上限的佇列立即回應 200，
+由背景 worker 執行緒處理，同一個 body 的多個事件可同時處理
+"""
+import atexit
+import base64
+import hashlib
+import hmac
+import os
+import queue
+import threading
+import time
+
+import linebot
+from linebot.v3.webhook import UnknownEvent
+from linebot.v3.webhooks import Event, MessageContent, MessageEvent
+
+from metrics import STAGE_SECONDS, observe_stage
+
+# 背景處理事件的執行緒數
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 8))
+
+# 佇列上限，滿了之後改為在 request 中直接處理（背壓）
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 256))
+
+# 佇列已滿時最多等待幾秒
+WEBHOOK_ENQUEUE_TIMEOUT = float(os.getenv('WEBHOOK_ENQUEUE_TIMEOUT', 0.5))
+
+# 關閉時最多等待幾秒把佇列處理完
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv('WEBHOOK_DRAIN_TIMEOUT', 20))
+
+_STOP = object()
+
+# 已確認內部屬性（見 _sdk_internal）結構相同的 line-bot-sdk 主版本
+SUPPORTED_SDK_MAJOR_VERSIONS = (3,)
+_SDK_MAJOR_VERSION = int(linebot.__version__.split('.')[0])
+_MISSING = object()
+
+
+def _sdk_internal(obj, name: str):
+    """
+    讀取 line-bot-sdk 的內部屬性（本模組對 SDK 內部結構的依賴都集中在這裡）
+
+    Args:
+        obj: SDK 的物件或類別
+        name: 屬性名稱
+
+    Raises:
+        RuntimeError: SDK 主版本未經確認，或該屬性已不存在
+    """
+    value = getattr(obj, name, _MISSING)
+    if _SDK_MAJOR_VERSION not in SUPPORTED_SDK_MAJOR_VERSIONS or value is _MISSING:
+        raise RuntimeError(
+            f"line-bot-sdk {linebot.__version__} is not supported by event_dispatcher "
+            f"({type(obj).__name__}.{name})")
+    return value
+
+
+def registered_handlers(handler) -> tuple:
+    """
+    取得 WebhookHandler 以 @handler.add / @handler.default 註冊的處理函式
+
+    Args:
+        handler: linebot.v3.WebhookHandler
+
+    Returns:
+        ({key: 處理函式}, 預設處理函式或 None)，key 為「事件類別」或「事件類別_訊息類別」
+    """
+    return _sdk_internal(handler, '_handlers'), _sdk_internal(handler, '_default')
+
+
+def parse_event(event: dict):
+    """
+    將單一事件的 dict 轉為 SDK 的事件物件（與 WebhookParser.parse 相同）
+
+    Args:
+        event: webhook body 中的單一事件
+
+    Returns:
+        linebot.v3.webhooks.Event，不認得的類型回傳 UnknownEvent
+    """
+    try:
+        return Event.from_dict(event)
+    except ValueError:
+        return UnknownEvent.new_from_json_dict(event)
+
+
+def verify_signature(channel_secret: bytes, body: bytes, signature: str) -> bool:
+    """
+    直接以原始 bytes 驗證 X-Line-Signature（不先把 body 解碼成字串）
+
+    Args:
+        channel_secret: Channel secret（bytes）
+        body: 原始 request body
+        signature: X-Line-Signature
+
+    Returns:
+        簽章是否正確
+    """
+    digest = hmac.new(channel_secret, body, hashlib.sha256).digest()
+    return hmac.compare_digest(base64.b64encode(digest), signature.encode('utf-8'))
+
+
+# SDK 類別名稱 -> webhook JSON 的 type（例如 MessageEvent -> message）
+_EVENT_TYPES = {name: value for value, name in
+                _sdk_internal(Event, '_Event__discriminator_value_class_map').items()}
+_MESSAGE_TYPES = {name: value for value, name in
+                  _sdk_internal(MessageContent, '_MessageContent__discriminator_value_class_map').items()}
+
+
+class EventFilter:
+    """
+    只挑出有處理函式的事件，其餘事件不建立 SDK 模型
+
+    follow / unfollow / postback（RichMenuSwitchAction）/ 貼圖等沒有處理函式的事件，
+    在 JSON 解析後只看 type 欄位就略過；若 body 中根本沒有需要的 type，
+    連 JSON 都不必解析。
+
+    Args:
+        types: {(事件 type, 訊息 type 或 None)}，None 表示該事件的所有訊息類型
+        handler: linebot.v3.WebhookHandler，由已註冊的處理函式推算 types
+    """
+
+    def __init__(self, types=None, handler=None):
+        self.handler = handler
+        self._types = frozenset(types or ())
+        self._handler_count = None
+        self._needles = ()
+        self._accept_all = False
+        if handler is None:
+            self._build(self._types)
+
+    @classmethod
+    def from_handler(cls, handler) -> 'EventFilter':
+        """依 WebhookHandler 註冊的處理函式建立（之後新增的處理函式也會反映）"""
+        return cls(handler=handler)
+
+    def _build(self, types):
+        self._types = frozenset(types)
+        # 預先掃描 body 用的字串：需要的事件 type（JSON 字串含引號）
+        self._needles = tuple({('"%s"' % t).encode('utf-8') for t, _ in self._types})
+
+    def _sync(self):
+        handlers, default = registered_handlers(self.handler)
+        if self._handler_count == len(handlers):
+            return
+        self._handler_count = len(handlers)
+        # 有預設處理函式時所有事件都要處理
+        self._accept_all = default is not None
+        types = set()
+        for key in handlers:
+            event_name, _, message_name = key.partition('_')
+            event_type = _EVENT_TYPES.get(event_name)
+            if event_type is None:
+                # 不認得的類別（例如 UnknownEvent）：保守起見全部處理
+                self._accept_all = True
+                continue
+            types.add((event_type, _MESSAGE_TYPES.get(message_name) if message_name else None))
+        self._build(types)
+
+    def might_match(self, body: bytes) -> bool:
+        """
+        在解析 JSON 之前快速判斷 body 是否可能含有需要處理的事件
+
+        Args:
+            body: 原始 request body
+
+        Returns:
+            False 表示確定沒有（可以跳過 JSON 解析）
+        """
+        if self.handler is not None:
+            self._sync()
+        if self._accept_all or b'\\u' in body:
+            # 有 \u 跳脫字元時字串比對不可靠，交給完整解析
+            return True
+        return any(needle in body for needle in self._needles)
+
+    def wants(self, event: dict) -> bool:
+        """
+        是否需要處理這個事件（只看 type 欄位，不建立模型）
+
+        Args:
+            event: webhook body 中的單一事件 dict
+        """
+        if self.handler is not None:
+            self._sync()
+        if self._accept_all:
+            return True
+        event_type = event.get('type')
+        if (event_type, None) in self._types:
+            return True
+        if event_type == 'message':
+            return (event_type, (event.get('message') or {}).get('type')) in self._types
+        return False
+
+
+def dispatch_event(handler, event, destination):
+    """
+    依 WebhookHandler 的註冊規則找出處理函式並執行
+    （與 WebhookHandler.handle 的單一事件邏輯相同）
+
+    Args:
+        handler: linebot.v3.WebhookHandler
+        event: SDK 的事件物件
+        destination: webhook body 的 destination
+    """
+    handlers, default = registered_handlers(handler)
+    func = None
+    if isinstance(event, MessageEvent):
+        key = f"{type(event).__name__}_{type(event.message).__name__}"
+        func = handlers.get(key)
+    if func is None:
+        func = handlers.get(type(event).__name__)
+    if func is None:
+        func = default
+    if func is None:
+        return
+
+    with observe_stage('handle'):
+        if func.__code__.co_argcount >= 2:
+            func(event, destination)
+        else:
+            func(event)
+
+
+class EventDispatcher:
+    """
+    以 WebhookHandler 註冊的處理函式在背景執行緒處理事件
+
+    Args:
+        handler: linebot.v3.WebhookHandler（沿用 @handler.add 註冊的函式）
+        logger: 記錄處理失敗用的 logger
+    """
+
+    def __init__(self, handler, logger, workers: int = WEBHOOK_WORKERS,
+                 queue_size: int = WEBHOOK_QUEUE_SIZE):
+        self.handler = handler
+        self.logger = logger
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+
+        # 統計
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.inline = 0           # 佇列已滿、改在 request 中處理的事件數
+        self.max_depth = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()  # 統計由多個 worker 執行緒與 request 同時更新
+        self._draining = False
+
+    def start(self):
+        """啟動 worker 執行緒（fork 之後的子行程會重新啟動）"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._draining = False
+            self._threads = [
+                threading.Thread(target=self._worker, name=f'webhook-worker-{i}',
+                                 daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+            atexit.register(self.drain)
+
+    def submit_events(self, events: list, destination: str) -> int:
+        """
+        把已驗證簽章、已解析的事件放進佇列
+
+        Args:
+            events: SDK 的事件物件列表
+            destination: webhook body 的 destination
+
+        Returns:
+            放進佇列的事件數
+        """
+        self.start()
+
+        queued = 0
+        for event in events:
+            item = (event, destination, time.monotonic())
+            try:
+                if self._draining:
+                    raise queue.Full
+                self.queue.put(item, timeout=WEBHOOK_ENQUEUE_TIMEOUT)
+            except queue.Full:
+                # 背壓：佇列塞滿時由目前的 request 自己處理，回應自然變慢
+                with self._stats_lock:
+                    self.inline += 1
+                self._process(*item)
+                continue
+
+            queued += 1
+            depth = self.queue.qsize()
+            with self._stats_lock:
+                self.enqueued += 1
+                self.max_depth = max(self.max_depth, depth)
+        return queued
+
+    def dispatch(self, event, destination):
+        """依 WebhookHandler 的註冊規則找出處理函式並執行"""
+        dispatch_event(self.handler, event, destination)
+
+    def _process(self, event, destination, enqueued_at):
+        wait = time.monotonic() - enqueued_at
+        STAGE_SECONDS.labels('queue_wait').observe(wait)
+        with self._stats_lock:
+            self.wait_seconds_total += wait
+            self.wait_seconds_max = max(self.wait_seconds_max, wait)
+        try:
+            self.dispatch(event, destination)
+        except Exception:
+            with self._stats_lock:
+                self.failed += 1
+            self.logger.exception(
+                "Webhook event failed. type=%s", getattr(event, 'type', None))
+        else:
+            with self._stats_lock:
+                self.processed += 1
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is _STOP:
+                    return
+                self._process(*item)
+            finally:
+                self.queue.task_done()
+
+    def drain(self, timeout: float = WEBHOOK_DRAIN_TIMEOUT) -> bool:
+        """
+        停止接收並等待佇列中的事件處理完（SIGTERM / 行程結束時呼叫）
+
+        Returns:
+            是否在時限內處理完
+        """
+        if self._pid != os.getpid() or self._draining:
+            return True
+        self._draining = True
+
+        deadline = time.monotonic() + timeout
+        for _ in self._threads:
+            try:
+                self.queue.put(_STOP, timeout=max(0, deadline - time.monotonic()))
+            except queue.Full:
+                break
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+
+        remaining = self.queue.qsize()
+        if remaining:
+            self.logger.warning("Webhook drain timed out, %d events dropped", remaining)
+        return remaining == 0
+
+    def stats(self) -> dict:
+        """佇列統計，供 /health 顯示"""
+        with self._stats_lock:
+            handled = self.processed + self.failed
+            return {
+                'workers': self.workers,
+                'queue_depth': self.queue.qsize(),
+                'queue_max_depth': self.max_depth,
+                'queue_capacity': self.queue.maxsize,
+                'enqueued': self.enqueued,
+                'processed': self.processed,
+                'failed': self.failed,
+                'inline': self.inline,
+                'wait_avg_ms': round(self.wait_seconds_total / handled * 1000, 2) if handled else None,
+                'wait_max_ms': round(self.wait_seconds_max * 1000, 2),
+            }
@@ -0,0 +1,120 @@
+"""
+預先產生的天氣 Flex Message 快取
+每個城市在每一版預報只組裝、驗證、序列化一次，回覆時直接送出 JSON bytes
+"""
+import json
+import threading
+
+from linebot.v3.messaging import FlexMessage
+
+from metrics import CACHE_REQUESTS, observe_stage
+from weather_service import (
+    SUPPORTED_CITIES,
+    WeatherForecast,
+    forecast_snapshot,
+    format_data_age
+)
+
+
+class FlexRenderCache:
+    """
+    以 (城市, 快照版本, 資料年齡提示) 為 key 的 Flex JSON 快取
+
+    快照版本變更（新的預報發布）時整個快取自動清空。
+    """
+
+    def __init__(self, snapshot=forecast_snapshot):
+        self.snapshot = snapshot
+        self.hits = 0
+        self.misses = 0
+        self._version = None
+        self._entries = {}
+        self._latest = {}   # 城市 -> 最近一次產生的 JSON（不隨換版清除，供逾時時先回覆）
+        self._lock = threading.Lock()
+
+    def get(self, city_name: str):
+        """
+        取得城市的 Flex Message JSON bytes
+
+        Args:
+            city_name: 正規化後的縣市名稱
+
+        Returns:
+            Flex Message 的 JSON bytes；不支援的城市或無法取得資料時回傳 None
+        """
+        if city_name not in SUPPORTED_CITIES:
+            return None
+
+        # 查詢前先讓快照同步（可能因此換版）
+        if self.snapshot.get(city_name) is None:
+            return None
+
+        note = None
+        if self.snapshot.is_stale():
+            note = format_data_age(self.snapshot.age())
+
+        with self._lock:
+            if self._version != self.snapshot.version:
+                self._entries = {}
+                self._version = self.snapshot.version
+            key = (city_name, note)
+            payload = self._entries.get(key)
+
+        if payload is not None:
+            self.hits += 1
+            CACHE_REQUESTS.labels('flex_render', 'hit').inc()
+            return payload
+
+        self.misses += 1
+        CACHE_REQUESTS.labels('flex_render', 'miss').inc()
+        payload = self._render(city_name)
+        if payload is not None:
+            with self._lock:
+                if self._version == self.snapshot.version:
+                    self._entries[key] = payload
+                self._latest[city_name] = payload
+        return payload
+
+    def peek(self, city_name: str):
+        """
+        不觸發任何更新，取得城市最近一次產生的 Flex JSON（可能是舊版預報）
+
+        Args:
+            city_name: 正規化後的縣市名稱
+
+        Returns:
+            Flex Message 的 JSON bytes，從未產生過時回傳 None
+        """
+        return self._latest.get(city_name)
+
+    def _render(self, city_name: str):
+        forecast = WeatherForecast(location=city_name)
+        forecast.fetch()
+        flex_data = forecast.get_flex_message()
+        if not flex_data:
+            return None
+
+        # 每版只驗證一次，確保快取內容是合法的 Flex Message
+        try:
+            with observe_stage('flex_validate'):
+                FlexMessage.from_dict(flex_data)
+        except Exception as e:
+            print(f"Invalid flex message for {city_name}: {e}")
+            return None
+
+        return json.dumps(
+            flex_data, ensure_ascii=False, separators=(',', ':')
+        ).encode('utf-8')
+
+    def stats(self) -> dict:
+        """快取統計，供 /health 顯示"""
+        return {
+            'version': self._version,
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+# 全域快取
+flex_render_cache = FlexRenderCache()
@@ -0,0 +1,399 @@
+"""
+全台預報背景更新器
+依中央氣象署 F-C0032-001 的發布時間排程輪詢，只在資料真的變更時替換快照
+"""
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from shared_forecast_store import LeaderLock, SharedForecastStore
+from snapshot_persistence import enable_snapshot_persistence
+from weather_service import (
+    CWA_API_KEY,
+    CityForecast,
+    fetch_forecast_payload,
+    fetch_forecast_payload_async,
+    forecast_snapshot
+)
+
+# 臺灣時間 (UTC+8)，不依賴系統時區設定
+TAIPEI_TZ = timezone(timedelta(hours=8))
+
+# F-C0032-001 每日發布時間（臺灣時間整點）
+ISSUANCE_HOURS = (5, 11, 17, 23)
+
+# 發布後等待幾秒再輪詢（CWA 上架需要一點時間）
+REFRESH_POLL_DELAY = int(os.getenv('FORECAST_REFRESH_POLL_DELAY', 180))
+
+# 發布後資料尚未變更時，每隔幾秒重試一次
+REFRESH_RETRY_INTERVAL = int(os.getenv('FORECAST_REFRESH_RETRY_INTERVAL', 300))
+
+# 發布後最多持續重試幾秒，超過就等下一次發布
+REFRESH_RETRY_WINDOW = int(os.getenv('FORECAST_REFRESH_RETRY_WINDOW', 3600))
+
+# 非 leader 的 worker 每隔幾秒嘗試接手更新（leader 結束時）
+LEADER_RETRY_INTERVAL = int(os.getenv('FORECAST_LEADER_RETRY_INTERVAL', 30))
+
+
+def last_issuance(now: datetime) -> datetime:
+    """
+    取得 now 之前（含）最近一次的預報發布時間
+
+    Args:
+        now: 帶時區的目前時間
+
+    Returns:
+        臺灣時間的發布時間
+    """
+    local = now.astimezone(TAIPEI_TZ)
+    for hour in sorted(ISSUANCE_HOURS, reverse=True):
+        issued = local.replace(hour=hour, minute=0, second=0, microsecond=0)
+        if issued <= local:
+            return issued
+    # 今天第一次發布之前 -> 昨天最後一次發布
+    yesterday = local - timedelta(days=1)
+    return yesterday.replace(
+        hour=max(ISSUANCE_HOURS), minute=0, second=0, microsecond=0)
+
+
+def next_issuance(now: datetime) -> datetime:
+    """
+    取得 now 之後最近一次的預報發布時間
+
+    Args:
+        now: 帶時區的目前時間
+
+    Returns:
+        臺灣時間的發布時間
+    """
+    local = now.astimezone(TAIPEI_TZ)
+    for hour in sorted(ISSUANCE_HOURS):
+        issued = local.replace(hour=hour, minute=0, second=0, microsecond=0)
+        if issued > local:
+            return issued
+    tomorrow = local + timedelta(days=1)
+    return tomorrow.replace(
+        hour=min(ISSUANCE_HOURS), minute=0, second=0, microsecond=0)
+
+
+class ForecastRefresher:
+    """
+    背景執行緒：依發布時間輪詢 CWA 並更新全台預報快照
+
+    - 使用 ETag / Last-Modified 條件式請求，伺服器回 304 即視為未變更
+    - 伺服器不支援條件式請求時，以回應內容的 SHA-256 判斷是否變更
+    - 快照提供 open_stream 時邊下載邊解析，不保留整份回應與解析後的 JSON
+    - 解析完成後才一次替換快照，查詢端永遠不會等待 CWA
+    - 設定 leader_lock 時，只有取得鎖的 worker 會呼叫 CWA 並寫入共用快照檔
+
+    Args:
+        snapshot: 要更新的快照（需有 load / mark_fresh / record_failure / locations，
+                  串流解析另需 open_stream / load_stream）
+        leader_lock: 多 worker 時只讓一個 worker 更新
+        fetch: 取得資料的函式（預設 F-C0032-001）
+        fetch_async: fetch 的 asyncio 版本
+        name: 執行緒 / task 名稱
+    """
+
+    def __init__(self, snapshot=forecast_snapshot, leader_lock=None,
+                 fetch=fetch_forecast_payload, fetch_async=fetch_forecast_payload_async,
+                 name: str = 'forecast-refresher'):
+        self.snapshot = snapshot
+        self.leader_lock = leader_lock
+        self.fetch = fetch
+        self.fetch_async = fetch_async
+        self.name = name
+        self.etag = None
+        self.last_modified = None
+        self.content_hash = None
+
+        self.last_attempt_at = None   # 最後一次輪詢時間
+        self.last_success_at = None   # 最後一次成功輪詢（含未變更）
+        self.last_change_at = None    # 最後一次資料變更並替換快照
+        self.last_error = None
+        self.consecutive_failures = 0
+
+        self._thread = None
+        self._task = None
+        self._pid = None
+        self._stop = threading.Event()
+
+    def conditional_headers(self) -> dict:
+        """條件式請求的 headers（上一次回應的 ETag / Last-Modified）"""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def open_stream(self):
+        """快照的 PayloadStream；快照不支援或已停用串流解析時為 None"""
+        open_stream = getattr(self.snapshot, 'open_stream', None)
+        return open_stream() if open_stream is not None else None
+
+    def apply_response(self, response, stream=None) -> str:
+        """
+        依 CWA 回應決定是否替換快照
+
+        Args:
+            response: requests.Response 或 weather_service.CWAResponse
+            stream: 已讀完回應的 PayloadStream（串流解析時，response.content 為空）
+
+        Returns:
+            'updated' 或 'unchanged'
+        """
+        if response.status_code == 304:
+            result = 'unchanged'
+        else:
+            if stream is not None:
+                content_hash = stream.hexdigest()
+            else:
+                content_hash = hashlib.sha256(response.content).hexdigest()
+            if content_hash == self.content_hash and self.snapshot.locations:
+                # 串流解析已建好的新索引直接丟棄
+                result = 'unchanged'
+            else:
+                if stream is not None:
+                    self.snapshot.load_stream(stream)
+                else:
+                    self.snapshot.load(response.json())
+                self.content_hash = content_hash
+                self.last_change_at = time.time()
+                result = 'updated'
+
+            self.etag = response.headers.get('ETag')
+            self.last_modified = response.headers.get('Last-Modified')
+
+        if result == 'unchanged':
+            self.snapshot.mark_fresh()
+
+        self.last_success_at = time.time()
+        self.last_error = None
+        self.consecutive_failures = 0
+        return result
+
+    def record_failure(self, error: Exception) -> str:
+        """記錄輪詢失敗，保留原本的快照"""
+        self.last_error = str(error)
+        self.consecutive_failures += 1
+        self.snapshot.record_failure(error)
+        print(f"Forecast refresher ({self.name}) failed: {error}")
+        return 'failed'
+
+    def run_once(self) -> str:
+        """
+        輪詢一次 CWA
+
+        Returns:
+            'updated'（已替換快照）、'unchanged'（資料未變更）或 'failed'
+        """
+        self.last_attempt_at = time.time()
+        try:
+            stream = self.open_stream()
+            response = self.fetch(headers=self.conditional_headers(), sink=stream)
+            return self.apply_response(response, stream)
+        except Exception as e:
+            return self.record_failure(e)
+
+    async def run_once_async(self, session) -> str:
+        """
+        run_once 的 asyncio 版本
+
+        Args:
+            session: aiohttp ClientSession
+
+        Returns:
+            'updated'、'unchanged' 或 'failed'
+        """
+        self.last_attempt_at = time.time()
+        try:
+            stream = self.open_stream()
+            response = await self.fetch_async(
+                session, headers=self.conditional_headers(), sink=stream)
+            # 替換快照會觸發 listener（gzip + fsync 寫入磁碟）與共用快照檔的 publish，
+            # 都是阻塞 I/O，放到執行緒池執行，不佔住 event loop
+            return await asyncio.get_running_loop().run_in_executor(
+                None, self.apply_response, response, stream)
+        except Exception as e:
+            return self.record_failure(e)
+
+    def next_delay(self, result: str, now: datetime = None) -> float:
+        """
+        計算距離下一次輪詢的秒數
+
+        Args:
+            result: 上一次 run_once 的結果
+            now: 目前時間（測試用，預設為現在）
+
+        Returns:
+            等待秒數
+        """
+        now = now or datetime.now(TAIPEI_TZ)
+
+        # 尚未有任何資料時持續重試
+        if not self.snapshot.locations:
+            return REFRESH_RETRY_INTERVAL
+
+        # 剛發布不久但資料還沒更新（或失敗）-> 繼續重試
+        since_issuance = (now - last_issuance(now)).total_seconds()
+        if result != 'updated' and since_issuance < REFRESH_RETRY_WINDOW:
+            return REFRESH_RETRY_INTERVAL
+
+        # 否則等到下一次發布後再輪詢
+        wait = (next_issuance(now) - now).total_seconds()
+        return wait + REFRESH_POLL_DELAY
+
+    def _run(self):
+        delay = 0
+        while not self._stop.wait(delay):
+            # 其他 worker 負責更新時，只定期確認 leader 是否還在
+            if self.leader_lock is not None and not self.leader_lock.acquire():
+                delay = LEADER_RETRY_INTERVAL
+                continue
+
+            result = self.run_once()
+            delay = self.next_delay(result)
+
+    async def run_async(self, session):
+        """
+        asyncio 版的輪詢迴圈（由 async_app 以 task 執行，取代背景執行緒）
+
+        Args:
+            session: aiohttp ClientSession
+        """
+        self.snapshot.background_refresh = True
+        delay = 0
+        while True:
+            await asyncio.sleep(delay)
+            if self.leader_lock is not None and not self.leader_lock.acquire():
+                delay = LEADER_RETRY_INTERVAL
+                continue
+
+            result = await self.run_once_async(session)
+            delay = self.next_delay(result)
+
+    def start_async(self, session) -> asyncio.Task:
+        """
+        在目前的 event loop 啟動輪詢 task
+
+        Args:
+            session: aiohttp ClientSession
+
+        Returns:
+            輪詢的 asyncio.Task（關閉時取消即可）
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(
+                self.run_async(session), name=self.name)
+        return self._task
+
+    def start(self):
+        """啟動背景執行緒（fork 之後的子行程會重新啟動自己的執行緒）"""
+        if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+            return
+
+        self._pid = os.getpid()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        self.snapshot.background_refresh = True
+
+    def stop(self):
+        """停止背景執行緒，查詢改回同步更新"""
+        self._stop.set()
+        self.snapshot.background_refresh = False
+
+    def status(self) -> dict:
+        """
+        取得更新器狀態，供 /health 顯示
+
+        Returns:
+            狀態字典（時間皆為 ISO 8601 臺灣時間）
+        """
+        def iso(ts):
+            if ts is None:
+                return None
+            return datetime.fromtimestamp(ts, TAIPEI_TZ).isoformat(timespec='seconds')
+
+        return {
+            'running': bool(self._thread and self._thread.is_alive())
+            or bool(self._task and not self._task.done()),
+            'leader': self.leader_lock is None or self.leader_lock.is_leader,
+            'last_attempt_at': iso(self.last_attempt_at),
+            'last_success_at': iso(self.last_success_at),
+            'last_change_at': iso(self.last_change_at),
+            'last_error': self.last_error,
+            'consecutive_failures': self.consecutive_failures,
+        }
+
+
+# 全域更新器
+forecast_refresher = ForecastRefresher()
+
+
+def attach_shared_store() -> bool:
+    """
+    讓全域快照改用跨 worker 共用的快照檔（可用 FORECAST_SHARED_STORE=0 停用）
+
+    Returns:
+        是否已啟用共用快照檔
+    """
+    if os.getenv('FORECAST_SHARED_STORE', '1') == '0':
+        return False
+    if forecast_snapshot.shared_store is not None:
+        return True
+
+    try:
+        leader_lock = LeaderLock()
+        forecast_snapshot.attach_store(
+            SharedForecastStore(decode=CityForecast.from_json))
+    except OSError as e:
+        print(f"Shared forecast store disabled: {e}")
+        return False
+
+    forecast_refresher.leader_lock = leader_lock
+    return True
+
+
+def start_forecast_refresher() -> bool:
+    """
+    啟動全域背景更新器（可用 FORECAST_REFRESHER=0 停用）
+
+    同一台機器的多個 worker 只會有一個實際呼叫 CWA，
+    其餘 worker 讀取它寫入的共用快照檔。
+
+    Returns:
+        是否已啟動
+    """
+    if os.getenv('FORECAST_REFRESHER', '1') == '0' or not CWA_API_KEY:
+        return False
+
+    attach_shared_store()
+    forecast_refresher.start()
+    return True
+
+
+def warm_start():
+    """
+    啟動時依序準備快照：共用快照檔 -> 磁碟上的快照 -> 背景向 CWA 更新
+
+    CWA 無法連線時，仍可立即以磁碟上最後一份資料回覆。
+    """
+    attach_shared_store()
+    enable_snapshot_persistence()
+    start_forecast_refresher()
+
+
+def _restart_after_fork():
+    """fork 之後在子行程重新啟動更新器（執行緒不會跟著 fork）"""
+    if forecast_refresher._pid is not None:
+        start_forecast_refresher()
+
+
+# gunicorn --preload 等在 fork 前就載入 app 的情況
+os.register_at_fork(after_in_child=_restart_after_fork)
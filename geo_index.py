@@ -0,0 +1,143 @@
+"""
+經緯度查詢：把使用者分享的位置對應到最近的鄉鎮或縣市
+
+專案沒有隨附行政區界的多邊形，改以 CWA 鄉鎮預報附帶的各鄉鎮代表點（Latitude / Longitude）
+近似行政區：位置歸屬於最近的代表點。代表點放進固定大小的經緯度網格，
+查詢只檢查所在格子與外圍幾圈，不必逐一計算 368 個點的距離。
+鄉鎮預報尚未載入時，退而以縣市政府所在地找最近的縣市。
+"""
+import math
+import os
+from array import array
+
+# 網格邊長（度），0.1 度約 11 公里，都會區一格約有數個鄉鎮
+GEO_GRID_CELL = float(os.getenv('GEO_GRID_CELL', 0.1))
+
+# 位置與最近鄉鎮代表點的距離上限（公里），超過視為不在支援範圍內（例如海上、國外）
+LOCATION_MAX_DISTANCE_KM = float(os.getenv('LOCATION_MAX_DISTANCE_KM', 30))
+
+# 以縣市政府所在地判斷縣市時的距離上限（公里）
+COUNTY_MAX_DISTANCE_KM = 80
+
+# 每度緯度的公里數
+KM_PER_DEGREE = 111.195
+
+# 各縣市政府所在地（緯度, 經度）
+COUNTY_SEATS = {
+    '臺北市': (25.0375, 121.5637), '新北市': (25.0120, 121.4657), '桃園市': (24.9936, 121.3010),
+    '臺中市': (24.1618, 120.6469), '臺南市': (22.9927, 120.1851), '高雄市': (22.6207, 120.3120),
+    '基隆市': (25.1316, 121.7445), '新竹市': (24.8066, 120.9686), '新竹縣': (24.8270, 121.0128),
+    '苗栗縣': (24.5602, 120.8214), '彰化縣': (24.0755, 120.5445), '南投縣': (23.9020, 120.6900),
+    '雲林縣': (23.6992, 120.5262), '嘉義市': (23.4815, 120.4534), '嘉義縣': (23.4587, 120.2934),
+    '屏東縣': (22.6830, 120.4880), '宜蘭縣': (24.7303, 121.7631), '花蓮縣': (23.9913, 121.6197),
+    '臺東縣': (22.7557, 121.1504), '澎湖縣': (23.5711, 119.5793), '金門縣': (24.4367, 118.3186),
+    '連江縣': (26.1580, 119.9510),
+}
+
+
+class GridIndex:
+    """
+    經緯度點的網格索引（建立後只讀）
+
+    Args:
+        latitudes: 各點緯度，索引即點的編號
+        longitudes: 各點經度
+        cell: 網格邊長（度）
+    """
+
+    def __init__(self, latitudes, longitudes, cell: float = GEO_GRID_CELL):
+        self.cell = cell
+        self.latitudes = array('d', latitudes)
+        self.longitudes = array('d', longitudes)
+        buckets = {}
+        for i, (lat, lon) in enumerate(zip(self.latitudes, self.longitudes)):
+            # 缺座標的點（0, 0）不放進網格
+            if lat or lon:
+                buckets.setdefault(self._cell(lat, lon), []).append(i)
+        self.buckets = {key: tuple(points) for key, points in buckets.items()}
+        rows = [i for i, _ in self.buckets] or [0]
+        cols = [j for _, j in self.buckets] or [0]
+        self._bounds = (min(rows), max(rows), min(cols), max(cols))
+
+    def _cell(self, lat: float, lon: float) -> tuple:
+        return math.floor(lat / self.cell), math.floor(lon / self.cell)
+
+    def _ring(self, ci: int, cj: int, r: int):
+        """以 (ci, cj) 為中心、第 r 圈的格子"""
+        if r == 0:
+            yield ci, cj
+            return
+        for dj in range(-r, r + 1):
+            yield ci - r, cj + dj
+            yield ci + r, cj + dj
+        for di in range(-r + 1, r):
+            yield ci + di, cj - r
+            yield ci + di, cj + r
+
+    def __len__(self):
+        return sum(len(points) for points in self.buckets.values())
+
+    def nearest(self, lat: float, lon: float, max_km: float = None):
+        """
+        找最近的點
+
+        Args:
+            lat: 緯度
+            lon: 經度
+            max_km: 距離上限（公里），None 表示不限制
+
+        Returns:
+            (點的編號, 距離公里)，沒有點或超過上限時為 None
+        """
+        if not self.buckets:
+            return None
+
+        ci, cj = self._cell(lat, lon)
+        scale = math.cos(math.radians(lat))
+        # 第 r 圈的格子與查詢點至少相隔 r - 1 格（經度方向的一格較短）
+        cell_km = self.cell * KM_PER_DEGREE * min(1.0, scale)
+        rmin, rmax, cmin, cmax = self._bounds
+        last_ring = max(abs(ci - rmin), abs(ci - rmax), abs(cj - cmin), abs(cj - cmax))
+
+        best, best_d2 = None, math.inf
+        latitudes, longitudes, buckets = self.latitudes, self.longitudes, self.buckets
+        for r in range(last_ring + 1):
+            reach = max(r - 1, 0) * cell_km
+            if reach >= math.sqrt(best_d2) * KM_PER_DEGREE:
+                break
+            if max_km is not None and reach > max_km:
+                break
+            for key in self._ring(ci, cj, r):
+                for i in buckets.get(key, ()):
+                    dy = latitudes[i] - lat
+                    dx = (longitudes[i] - lon) * scale
+                    d2 = dy * dy + dx * dx
+                    if d2 < best_d2:
+                        best, best_d2 = i, d2
+
+        if best is None:
+            return None
+        km = math.sqrt(best_d2) * KM_PER_DEGREE
+        if max_km is not None and km > max_km:
+            return None
+        return best, km
+
+
+_COUNTY_NAMES = tuple(COUNTY_SEATS)
+_county_index = GridIndex([lat for lat, _ in COUNTY_SEATS.values()],
+                          [lon for _, lon in COUNTY_SEATS.values()])
+
+
+def nearest_county(lat: float, lon: float):
+    """
+    以縣市政府所在地找最近的縣市（鄉鎮預報尚未載入時使用，縣市交界附近可能不準）
+
+    Args:
+        lat: 緯度
+        lon: 經度
+
+    Returns:
+        縣市名稱，超過 COUNTY_MAX_DISTANCE_KM 時為 None
+    """
+    match = _county_index.nearest(lat, lon, COUNTY_MAX_DISTANCE_KM)
+    return _COUNTY_NAMES[match[0]] if match else None
@@ -0,0 +1,32 @@
+"""
+gunicorn 設定（gunicorn 啟動時會自動讀取目前目錄下的 gunicorn.conf.py）
+命令列參數仍以 Dockerfile 的 CMD 為準，這裡只放 hook
+"""
+import os
+import shutil
+
+# 多 worker 的 Prometheus 指標目錄（每個 worker 寫入自己的檔案，/metrics 時彙總）
+PROMETHEUS_MULTIPROC_DIR = os.getenv(
+    'PROMETHEUS_MULTIPROC_DIR', '/tmp/line_weather_prometheus')
+
+
+def on_starting(server):
+    """master 啟動時清空上一次執行留下的指標，並讓 worker 繼承目錄設定"""
+    shutil.rmtree(PROMETHEUS_MULTIPROC_DIR, ignore_errors=True)
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = PROMETHEUS_MULTIPROC_DIR
+
+
+def child_exit(server, worker):
+    """worker 結束後移除它的 live gauge（counter / histogram 會保留累計值）"""
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def worker_exit(server, worker):
+    """worker 結束（SIGTERM / 重啟）前，把背景佇列中的 webhook 事件處理完"""
+    import app
+
+    if app.event_dispatcher is not None:
+        app.event_dispatcher.drain()
@@ -0,0 +1,97 @@
+"""
+共用 HTTP 連線池
+讓 CWA 與 LINE Messaging API 的請求重複使用 keep-alive 連線，
+避免每次都重新建立 TCP 連線與 TLS 握手
+"""
+import copy
+import os
+import threading
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+from linebot.v3.messaging import ApiClient
+
+from line_rate_limit import limit_api_client
+
+# requests Session 的連線池設定（每個 host 保留的連線數）
+HTTP_POOL_CONNECTIONS = int(os.getenv('HTTP_POOL_CONNECTIONS', 4))
+HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', 16))
+
+# LINE SDK (urllib3) 每個 host 保留的連線數
+LINE_POOL_MAXSIZE = int(os.getenv('LINE_POOL_MAXSIZE', 16))
+
+_lock = threading.Lock()
+_session = None
+_api_clients = {}
+_pid = None
+
+
+def _reset_if_forked():
+    """fork 之後不能沿用父行程的 socket，子行程重新建立連線池"""
+    global _session, _api_clients, _pid
+    if _pid != os.getpid():
+        _session = None
+        _api_clients = {}
+        _pid = os.getpid()
+
+
+def get_http_session() -> requests.Session:
+    """
+    取得行程共用的 requests Session
+
+    Returns:
+        已掛載連線池 adapter 的 Session（執行緒安全，可同時使用）
+    """
+    global _session
+    with _lock:
+        _reset_if_forked()
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=HTTP_POOL_CONNECTIONS,
+                pool_maxsize=HTTP_POOL_MAXSIZE
+            )
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+        return _session
+
+
+def get_api_client(configuration) -> ApiClient:
+    """
+    取得行程共用的 LINE ApiClient（每個 Configuration 一個）
+
+    ApiClient 內部的 urllib3 PoolManager 會保留 keep-alive 連線，
+    不應每次回覆都重新建立。
+
+    Args:
+        configuration: linebot.v3.messaging.Configuration（不會被修改）
+
+    Returns:
+        共用的 ApiClient
+    """
+    with _lock:
+        _reset_if_forked()
+        # 同時保留原本的 Configuration，避免它被回收後 id 被其他物件重複使用
+        _, api_client = _api_clients.get(id(configuration), (None, None))
+        if api_client is None:
+            # 連線池大小設定在複本上，呼叫端的 Configuration 維持原樣
+            pooled = copy.deepcopy(configuration)
+            pooled.connection_pool_maxsize = LINE_POOL_MAXSIZE
+            # SDK 的呼叫（Rich Menu 管理等）同樣經過送出端頻率限制
+            api_client = limit_api_client(ApiClient(pooled))
+            _api_clients[id(configuration)] = (configuration, api_client)
+        return api_client
+
+
+@contextmanager
+def pooled_api_client(configuration):
+    """
+    取代 `with ApiClient(configuration) as api_client:` 的寫法，
+    離開 with 區塊時不關閉共用的連線池
+
+    Args:
+        configuration: linebot.v3.messaging.Configuration
+    """
+    yield get_api_client(configuration)
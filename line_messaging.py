@@ -0,0 +1,210 @@
+"""
+LINE Messaging API 的輕量呼叫
+直接送出已序列化的 JSON，不經過 SDK 的 pydantic 模型驗證與序列化
+"""
+import asyncio
+import json
+import os
+
+import aiohttp
+import urllib3
+from linebot.v3.messaging import ApiException
+from linebot.v3.messaging import async_rest
+from linebot.v3.messaging.rest import RESTResponse
+
+from line_rate_limit import endpoint_for, outbound_limiter
+from metrics import UPSTREAM_REQUESTS, observe_stage
+
+LINE_API_HOST = os.getenv('LINE_API_HOST', 'https://api.line.me')
+
+# LINE API 的逾時秒數
+LINE_API_TIMEOUT = urllib3.Timeout(connect=3, read=10)
+LINE_API_ASYNC_TIMEOUT = aiohttp.ClientTimeout(sock_connect=3, sock_read=10)
+
+
+def post_raw(api_client, path: str, body: bytes, headers: dict = None) -> RESTResponse:
+    """
+    以共用 ApiClient 的連線池送出 POST（經過 line_rate_limit 的頻率限制，429 時自動重試）
+
+    Args:
+        api_client: linebot.v3.messaging.ApiClient（見 http_pool.get_api_client）
+        path: API 路徑，例如 /v2/bot/message/reply
+        body: 已序列化的 JSON bytes
+        headers: 額外的 headers
+
+    Returns:
+        RESTResponse
+
+    Raises:
+        ApiException: HTTP 狀態碼非 2xx
+    """
+    request_headers = dict(api_client.default_headers)
+    request_headers['Content-Type'] = 'application/json'
+    if headers:
+        request_headers.update(headers)
+
+    def send():
+        try:
+            with observe_stage('reply'):
+                r = api_client.rest_client.pool_manager.request(
+                    'POST',
+                    (api_client.configuration.host or LINE_API_HOST) + path,
+                    body=body,
+                    headers=request_headers,
+                    timeout=LINE_API_TIMEOUT
+                )
+        except urllib3.exceptions.TimeoutError:
+            UPSTREAM_REQUESTS.labels('line', 'timeout').inc()
+            raise
+        except urllib3.exceptions.HTTPError:
+            UPSTREAM_REQUESTS.labels('line', 'error').inc()
+            raise
+        return _check_response(RESTResponse(r))
+
+    return outbound_limiter.call(endpoint_for(path), send)
+
+
+def _check_response(response):
+    """記錄結果；非 2xx 時拋出 ApiException"""
+    if not 200 <= response.status <= 299:
+        UPSTREAM_REQUESTS.labels(
+            'line', 'rate_limited' if response.status == 429 else 'error').inc()
+        raise ApiException(http_resp=response)
+    UPSTREAM_REQUESTS.labels('line', 'ok').inc()
+    return response
+
+
+def _reply_body(reply_token: str, messages: list) -> bytes:
+    """組出 reply API 的 request body（訊息已是 JSON bytes，直接串接）"""
+    return b''.join([
+        b'{"replyToken":', json.dumps(reply_token).encode('utf-8'),
+        b',"messages":[', b','.join(messages), b']}'
+    ])
+
+
+def reply_raw_messages(api_client, reply_token: str, messages: list) -> RESTResponse:
+    """
+    以預先序列化的訊息回覆
+
+    Args:
+        api_client: linebot.v3.messaging.ApiClient
+        reply_token: 事件的 reply token
+        messages: 每則訊息的 JSON bytes（例如 FlexRenderCache 的輸出）
+
+    Returns:
+        RESTResponse
+    """
+    return post_raw(api_client, '/v2/bot/message/reply', _reply_body(reply_token, messages))
+
+
+async def post_raw_async(api_client, path: str, body: bytes,
+                         headers: dict = None) -> async_rest.RESTResponse:
+    """
+    post_raw 的 asyncio 版本，使用 AsyncApiClient 內部的 aiohttp 連線池
+
+    Args:
+        api_client: linebot.v3.messaging.AsyncApiClient
+        path: API 路徑，例如 /v2/bot/message/reply
+        body: 已序列化的 JSON bytes
+        headers: 額外的 headers
+
+    Returns:
+        linebot.v3.messaging.async_rest.RESTResponse
+
+    Raises:
+        ApiException: HTTP 狀態碼非 2xx
+    """
+    request_headers = dict(api_client.default_headers)
+    request_headers['Content-Type'] = 'application/json'
+    if headers:
+        request_headers.update(headers)
+
+    async def send():
+        try:
+            with observe_stage('reply'):
+                async with api_client.rest_client.pool_manager.post(
+                    (api_client.configuration.host or LINE_API_HOST) + path,
+                    data=body,
+                    headers=request_headers,
+                    timeout=LINE_API_ASYNC_TIMEOUT
+                ) as r:
+                    response = async_rest.RESTResponse(r, await r.read())
+        except asyncio.TimeoutError:
+            UPSTREAM_REQUESTS.labels('line', 'timeout').inc()
+            raise
+        except aiohttp.ClientError:
+            UPSTREAM_REQUESTS.labels('line', 'error').inc()
+            raise
+        return _check_response(response)
+
+    return await outbound_limiter.call_async(endpoint_for(path), send)
+
+
+async def reply_raw_messages_async(api_client, reply_token: str,
+                                   messages: list) -> async_rest.RESTResponse:
+    """
+    reply_raw_messages 的 asyncio 版本
+
+    Args:
+        api_client: linebot.v3.messaging.AsyncApiClient
+        reply_token: 事件的 reply token
+        messages: 每則訊息的 JSON bytes
+
+    Returns:
+        linebot.v3.messaging.async_rest.RESTResponse
+    """
+    return await post_raw_async(
+        api_client, '/v2/bot/message/reply', _reply_body(reply_token, messages))
+
+
+def _push_body(to: str, messages: list) -> bytes:
+    """組出 push API 的 request body"""
+    return b''.join([
+        b'{"to":', json.dumps(to).encode('utf-8'),
+        b',"messages":[', b','.join(messages), b']}'
+    ])
+
+
+def is_invalid_reply_token(error: Exception) -> bool:
+    """reply API 是否因 reply token 已過期 / 已使用而拒絕"""
+    if not isinstance(error, ApiException) or error.status != 400:
+        return False
+    body = error.body or b''
+    if isinstance(body, bytes):
+        body = body.decode('utf-8', errors='replace')
+    return 'Invalid reply token' in body
+
+
+def push_raw_messages(api_client, to: str, messages: list, retry_key: str) -> RESTResponse:
+    """
+    以預先序列化的訊息主動推播
+
+    Args:
+        api_client: linebot.v3.messaging.ApiClient
+        to: userId / groupId / roomId
+        messages: 每則訊息的 JSON bytes
+        retry_key: X-Line-Retry-Key（UUID），重試時沿用同一個值，LINE 只會送出一次
+
+    Returns:
+        RESTResponse
+    """
+    return post_raw(api_client, '/v2/bot/message/push', _push_body(to, messages),
+                    headers={'X-Line-Retry-Key': retry_key})
+
+
+async def push_raw_messages_async(api_client, to: str, messages: list,
+                                  retry_key: str) -> async_rest.RESTResponse:
+    """
+    push_raw_messages 的 asyncio 版本
+
+    Args:
+        api_client: linebot.v3.messaging.AsyncApiClient
+        to: userId / groupId / roomId
+        messages: 每則訊息的 JSON bytes
+        retry_key: X-Line-Retry-Key（UUID）
+
+    Returns:
+        linebot.v3.messaging.async_rest.RESTResponse
+    """
+    return await post_raw_async(api_client, '/v2/bot/message/push', _push_body(to, messages),
+                                headers={'X-Line-Retry-Key': retry_key})
@@ -0,0 +1,241 @@
+"""
+LINE Messaging API 的送出端頻率限制
+所有 Messaging API 呼叫（回覆、推播、Rich Menu 管理）送出前先取得 token，
+超過上限時等待而不是直接送出換來 429；仍收到 429 時依 Retry-After 暫停該 endpoint 並重試。
+
+- 每個 endpoint 一個 bucket，另有整個 channel 共用的 bucket
+- 回覆 / 推播（使用者正在等待）可用完整的 burst；批次工作（Rich Menu 管理、multicast 等）
+  只能用到 burst 的一部分，尖峰時批次工作先慢下來，保留額度給回覆
+- LINE 的上限以 channel 計算，預設同一台機器的所有 worker 共用計數（/dev/shm）
+"""
+import asyncio
+import os
+import time
+from urllib.parse import urlsplit
+
+from linebot.v3.messaging import ApiException
+
+from dedupe_index import default_index_path
+from metrics import OUTBOUND_THROTTLED, OUTBOUND_WAIT
+from rate_limiter import RateLimiter
+
+
+def _rate(name: str, default: float) -> float:
+    return float(os.getenv(f'LINE_RATE_LIMIT_{name.upper()}', default))
+
+
+# 各 endpoint 的 (每秒請求數, burst)；預設依 LINE 公告的上限，Rich Menu 管理採保守值
+LINE_RATE_LIMITS = {
+    'channel': (_rate('channel', 2000), 200),
+    'reply': (_rate('reply', 2000), 200),
+    'push': (_rate('push', 2000), 200),
+    'multicast': (_rate('multicast', 200), 20),
+    'broadcast': (_rate('broadcast', 60 / 3600), 1),
+    'narrowcast': (_rate('narrowcast', 60 / 3600), 1),
+    'richmenu': (_rate('richmenu', 10), 10),
+    'default': (_rate('default', 2000), 200),
+}
+
+# 使用者正在等待回應的 endpoint
+INTERACTIVE_ENDPOINTS = ('reply', 'push')
+
+# 批次工作可使用的 burst 比例（其餘保留給回覆 / 推播）
+LINE_RATE_LIMIT_BULK_SHARE = float(os.getenv('LINE_RATE_LIMIT_BULK_SHARE', 0.5))
+
+# 最多等待幾秒取得 token（超過後仍送出，由 LINE 判斷）
+LINE_RATE_LIMIT_MAX_WAIT = float(os.getenv('LINE_RATE_LIMIT_MAX_WAIT', 5))
+LINE_RATE_LIMIT_BULK_MAX_WAIT = float(os.getenv('LINE_RATE_LIMIT_BULK_MAX_WAIT', 300))
+
+# 收到 429 後最多重試幾次
+LINE_429_MAX_RETRIES = int(os.getenv('LINE_429_MAX_RETRIES', 3))
+
+LINE_RATE_LIMIT_SHARED = os.getenv('LINE_RATE_LIMIT_SHARED', '1') == '1'
+LINE_RATE_LIMIT_PATH = (os.getenv('LINE_RATE_LIMIT_PATH')
+                        or default_index_path('line_weather_outbound.bin'))
+
+
+def endpoint_for(path: str) -> str:
+    """
+    由 API 路徑判斷 endpoint 類別
+
+    Args:
+        path: 例如 /v2/bot/message/reply，或完整的 URL
+
+    Returns:
+        LINE_RATE_LIMITS 的 key
+    """
+    if '://' in path:
+        path = urlsplit(path).path
+    if path.startswith('/v2/bot/message/'):
+        kind = path[len('/v2/bot/message/'):].split('/', 1)[0]
+        if kind in LINE_RATE_LIMITS:
+            return kind
+    if '/richmenu' in path:
+        return 'richmenu'
+    return 'default'
+
+
+def retry_after_seconds(error: ApiException, attempt: int) -> float:
+    """
+    429 回應要等待的秒數
+
+    Args:
+        error: status 為 429 的 ApiException
+        attempt: 第幾次重試（從 0 開始），沒有 Retry-After 時指數退避
+
+    Returns:
+        秒數
+    """
+    headers = error.headers or {}
+    value = headers.get('Retry-After') or headers.get('retry-after')
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return min(2.0 ** attempt, 30.0)
+
+
+class OutboundLimiter:
+    """
+    LINE Messaging API 呼叫的頻率限制
+
+    Args:
+        limiter: 計數用的 RateLimiter（共用或本行程）
+        limits: {endpoint: (每秒請求數, burst)}
+    """
+
+    def __init__(self, limiter: RateLimiter, limits: dict = LINE_RATE_LIMITS):
+        self.limiter = limiter
+        self.limits = limits
+
+    def _bucket(self, endpoint: str, interactive: bool) -> tuple:
+        per_second, burst = self.limits.get(endpoint, self.limits['default'])
+        if not interactive:
+            burst = max(1, int(burst * LINE_RATE_LIMIT_BULK_SHARE))
+        return per_second * 60, burst
+
+    def delay(self, endpoint: str) -> float:
+        """
+        嘗試同時取得 endpoint 與 channel 的 token（不等待）
+
+        Returns:
+            0 表示可以送出；大於 0 為還要等待的秒數
+        """
+        interactive = endpoint in INTERACTIVE_ENDPOINTS
+        # 兩個 bucket 一起判斷：channel 拒絕時 endpoint 的 token 也不扣，重試不會越扣越多
+        return self.limiter.acquire_all(
+            [(f'line:{key}', *self._bucket(key, interactive)) for key in (endpoint, 'channel')])
+
+    def _max_wait(self, endpoint: str) -> float:
+        if endpoint in INTERACTIVE_ENDPOINTS:
+            return LINE_RATE_LIMIT_MAX_WAIT
+        return LINE_RATE_LIMIT_BULK_MAX_WAIT
+
+    def wait(self, endpoint: str) -> float:
+        """
+        等待到可以送出（最多 _max_wait 秒）
+
+        Returns:
+            實際等待的秒數
+        """
+        started = time.monotonic()
+        deadline = started + self._max_wait(endpoint)
+        while True:
+            delay = self.delay(endpoint)
+            now = time.monotonic()
+            if delay <= 0 or now >= deadline:
+                break
+            OUTBOUND_THROTTLED.labels(endpoint, 'local').inc()
+            time.sleep(min(delay, deadline - now))
+        waited = time.monotonic() - started
+        OUTBOUND_WAIT.labels(endpoint).observe(waited)
+        return waited
+
+    async def wait_async(self, endpoint: str) -> float:
+        """wait 的 asyncio 版本"""
+        started = time.monotonic()
+        deadline = started + self._max_wait(endpoint)
+        while True:
+            delay = self.delay(endpoint)
+            now = time.monotonic()
+            if delay <= 0 or now >= deadline:
+                break
+            OUTBOUND_THROTTLED.labels(endpoint, 'local').inc()
+            await asyncio.sleep(min(delay, deadline - now))
+        waited = time.monotonic() - started
+        OUTBOUND_WAIT.labels(endpoint).observe(waited)
+        return waited
+
+    def throttled(self, endpoint: str, seconds: float):
+        """收到 429：所有 worker 暫停該 endpoint seconds 秒"""
+        OUTBOUND_THROTTLED.labels(endpoint, '429').inc()
+        self.limiter.defer(f'line:{endpoint}', seconds,
+                           *self._bucket(endpoint, endpoint in INTERACTIVE_ENDPOINTS))
+
+    def call(self, endpoint: str, send):
+        """
+        在頻率限制下呼叫 send，429 時依 Retry-After 等待後重試
+
+        Args:
+            endpoint: endpoint 類別
+            send: 送出請求的函式，非 2xx 時須拋出 ApiException
+
+        Returns:
+            send 的回傳值
+        """
+        for attempt in range(LINE_429_MAX_RETRIES + 1):
+            self.wait(endpoint)
+            try:
+                return send()
+            except ApiException as e:
+                if e.status != 429 or attempt == LINE_429_MAX_RETRIES:
+                    raise
+                self.throttled(endpoint, retry_after_seconds(e, attempt))
+
+    async def call_async(self, endpoint: str, send):
+        """
+        call 的 asyncio 版本
+
+        Args:
+            endpoint: endpoint 類別
+            send: 送出請求的 coroutine function
+        """
+        for attempt in range(LINE_429_MAX_RETRIES + 1):
+            await self.wait_async(endpoint)
+            try:
+                return await send()
+            except ApiException as e:
+                if e.status != 429 or attempt == LINE_429_MAX_RETRIES:
+                    raise
+                self.throttled(endpoint, retry_after_seconds(e, attempt))
+
+    def stats(self) -> dict:
+        """統計，供 /health 顯示"""
+        return self.limiter.stats()
+
+
+def limit_api_client(api_client):
+    """
+    讓 SDK 的 ApiClient（MessagingApi、MessagingApiBlob 等）經過頻率限制
+
+    Args:
+        api_client: linebot.v3.messaging.ApiClient
+
+    Returns:
+        同一個 api_client（可直接用在 with 敘述）
+    """
+    rest_client = api_client.rest_client
+    if getattr(rest_client, '_rate_limited', False):
+        return api_client
+    request = rest_client.request
+
+    def limited_request(method, url, *args, **kwargs):
+        return outbound_limiter.call(endpoint_for(url), lambda: request(method, url, *args, **kwargs))
+
+    rest_client.request = limited_request
+    rest_client._rate_limited = True
+    return api_client
+
+
+# 全域限制器
+outbound_limiter = OutboundLimiter(
+    RateLimiter(LINE_RATE_LIMIT_PATH if LINE_RATE_LIMIT_SHARED else None, capacity=1024))
@@ -0,0 +1,288 @@
+"""
+文字訊息與位置訊息的回覆邏輯
+Flask (app.py) 與 asyncio (async_app.py) 兩種入口共用，回傳已序列化的訊息
+"""
+import json
+
+from flex_cache import flex_render_cache
+from geo_index import COUNTY_SEATS, nearest_county
+from metrics import LOCATION_RESOLVE
+from observations import observation_snapshot
+from township_forecast import township_snapshot
+from weather_service import (
+    WeatherForecast,
+    format_supported_cities_list,
+    normalize_city_name
+)
+
+
+def text_message(text: str) -> bytes:
+    """
+    將文字訊息序列化為 Messaging API 的 JSON
+
+    Args:
+        text: 訊息內容
+
+    Returns:
+        {"type": "text", "text": ...} 的 JSON bytes
+    """
+    return json.dumps(
+        {'type': 'text', 'text': text}, ensure_ascii=False, separators=(',', ':')
+    ).encode('utf-8')
+
+
+# 超過查詢頻率時的提示（固定內容，只序列化一次）
+RATE_LIMIT_NOTICE = text_message("查詢太頻繁了，請稍候一分鐘再試 🙏")
+
+
+def parse_command(user_message: str) -> tuple:
+    """
+    拆出指令與地名
+
+    Args:
+        user_message: 使用者輸入的文字
+
+    Returns:
+        (「天氣」或「現在」, 其後的地名)；不是這兩個指令開頭時指令為 None
+    """
+    user_message = user_message.strip()
+    for command in ("天氣", "現在"):
+        if user_message.startswith(command):
+            return command, user_message[len(command):].strip()
+    return None, user_message
+
+
+def build_usage_reply() -> list:
+    """不是查詢指令時的使用說明"""
+    cities_list = format_supported_cities_list()
+    return [text_message(f"請輸入「天氣 城市名稱」或「現在 城市名稱」\n\n{cities_list}")]
+
+
+def build_text_reply(user_message: str) -> list:
+    """
+    處理文字訊息 - 天氣查詢 (地區切換已由 RichMenuSwitchAction 處理)
+
+    Args:
+        user_message: 使用者輸入的文字
+
+    Returns:
+        回覆訊息列表（每則為 JSON bytes，可直接交給 reply_raw_messages）
+    """
+    command, city_input = parse_command(user_message)
+
+    # 「現在 高雄」：最近測站的即時觀測
+    if command == "現在":
+        return build_observation_reply(city_input)
+
+    # 不是「天氣」或「現在」開頭
+    if command is None:
+        return build_usage_reply()
+
+    if not city_input:
+        cities_list = format_supported_cities_list()
+        return [text_message(f"請輸入城市名稱\n\n{cities_list}")]
+
+    # 鄉鎮市區（鳳山、板橋區、高雄市鳳山區）優先於縣市
+    township_reply = build_township_reply(city_input)
+    if township_reply:
+        return township_reply
+
+    # 正規化城市名稱
+    return build_city_reply(normalize_city_name(city_input))
+
+
+def build_city_reply(city_name: str) -> list:
+    """
+    縣市的天氣卡片
+
+    Args:
+        city_name: 正規化後的縣市名稱
+
+    Returns:
+        回覆訊息列表
+    """
+    # 優先使用預先產生的 Flex Message（每版預報只組裝、序列化一次）
+    flex_payload = flex_render_cache.get(city_name)
+    if flex_payload:
+        return [flex_payload]
+
+    # 降級使用純文字回覆
+    forecast = WeatherForecast(location=city_name)
+    forecast.fetch()
+    return [text_message(forecast.result)]
+
+
+def build_township_reply(city_input: str) -> list:
+    """
+    鄉鎮市區的天氣卡片（只讀取記憶體中的鄉鎮預報索引，不會呼叫 CWA）
+
+    Args:
+        city_input: 「天氣」之後的地名
+
+    Returns:
+        回覆訊息列表；不是鄉鎮名稱或鄉鎮預報尚未載入時為空列表
+    """
+    rows = township_snapshot.lookup(city_input)
+    if len(rows) > 1:
+        # 「東區」「中正」等多個縣市都有的名稱：請使用者加上縣市
+        names = '、'.join(township_snapshot.name(row) for row in rows)
+        example = township_snapshot.name(rows[0])
+        return [text_message(f"有多個「{city_input}」：{names}\n\n請加上縣市，例如「天氣 {example}」")]
+    if rows:
+        payload = township_snapshot.render(rows[0])
+        if payload:
+            return [payload]
+    return []
+
+
+def resolve_place(place: str, rows: tuple = ()):
+    """
+    地名 -> 經緯度（只讀取記憶體中的資料）：鄉鎮取 CWA 的鄉鎮代表點，縣市取縣市政府所在地
+
+    Args:
+        place: 使用者輸入的地名
+        rows: township_snapshot.lookup(place) 的結果
+
+    Returns:
+        (緯度, 經度)，無法判斷時為 None
+    """
+    if rows:
+        index = township_snapshot.locations
+        lat, lon = index.latitudes[rows[0]], index.longitudes[rows[0]]
+        if lat or lon:
+            return lat, lon
+        # 缺代表點座標：退而使用所屬縣市
+        return COUNTY_SEATS.get(index.counties[rows[0]])
+    return COUNTY_SEATS.get(normalize_city_name(place))
+
+
+def build_observation_reply(place: str) -> list:
+    """
+    「現在 地名」：最近測站的即時觀測卡片（只讀取記憶體中的觀測索引，不會呼叫 CWA）
+
+    Args:
+        place: 「現在」之後的地名
+
+    Returns:
+        回覆訊息列表
+    """
+    cities_list = format_supported_cities_list()
+    if not place:
+        return [text_message(f"請輸入城市名稱，例如「現在 高雄」\n\n{cities_list}")]
+
+    rows = township_snapshot.lookup(place)
+    if len(rows) > 1:
+        names = '、'.join(township_snapshot.name(row) for row in rows)
+        example = township_snapshot.name(rows[0])
+        return [text_message(f"有多個「{place}」：{names}\n\n請加上縣市，例如「現在 {example}」")]
+
+    point = resolve_place(place, rows)
+    if point is None:
+        return [text_message(f"找不到「{place}」\n\n{cities_list}")]
+
+    payload = build_observation_card(*point)
+    if payload:
+        return [payload]
+    if not observation_snapshot.locations:
+        return [text_message("⏳ 即時觀測資料準備中，請稍後再試")]
+    return [text_message(f"「{place}」附近沒有提供即時觀測的測站")]
+
+
+def build_observation_card(latitude: float, longitude: float):
+    """
+    最近測站的即時觀測 Flex Message
+
+    Args:
+        latitude: 緯度
+        longitude: 經度
+
+    Returns:
+        JSON bytes；觀測資料尚未載入或附近沒有測站時為 None
+    """
+    row = observation_snapshot.nearest(latitude, longitude)
+    return observation_snapshot.render(row) if row is not None else None
+
+
+def build_location_reply(latitude: float, longitude: float) -> list:
+    """
+    位置訊息：回覆最近的鄉鎮天氣卡片，鄉鎮預報尚未載入時改回覆最近的縣市（以縣市政府所在地判斷）；
+    附近有測站時再附上即時觀測
+
+    Args:
+        latitude: 位置訊息的緯度
+        longitude: 位置訊息的經度
+
+    Returns:
+        回覆訊息列表
+    """
+    index = township_snapshot.locations
+    if index:
+        row = index.nearest(latitude, longitude)
+        city_name = None
+        if row is not None:
+            payload = township_snapshot.render(row)
+            if payload:
+                LOCATION_RESOLVE.labels('township').inc()
+                return _with_observation([payload], latitude, longitude)
+            city_name = index.counties[row]
+    else:
+        city_name = nearest_county(latitude, longitude)
+
+    if city_name is None:
+        LOCATION_RESOLVE.labels('out_of_range').inc()
+        cities_list = format_supported_cities_list()
+        return [text_message(f"這個位置不在支援的範圍內\n\n{cities_list}")]
+
+    LOCATION_RESOLVE.labels('county').inc()
+    return _with_observation(build_city_reply(city_name), latitude, longitude)
+
+
+def _with_observation(messages: list, latitude: float, longitude: float) -> list:
+    """在預報卡片之後附上最近測站的即時觀測（沒有時維持原樣）"""
+    payload = build_observation_card(latitude, longitude)
+    return messages + [payload] if payload else messages
+
+
+def build_location_fallback(latitude: float, longitude: float) -> list:
+    """
+    build_location_reply 來不及在期限內完成時先回覆的訊息（不會呼叫 CWA）
+
+    Args:
+        latitude: 位置訊息的緯度
+        longitude: 位置訊息的經度
+
+    Returns:
+        最近縣市上一次的天氣卡片，沒有時為「資料準備中」的文字訊息
+    """
+    city_name = nearest_county(latitude, longitude)
+    payload = flex_render_cache.peek(city_name) if city_name else None
+    if payload:
+        return [payload]
+    return [text_message("⏳ 正在取得這個位置的最新天氣資料，完成後會立即傳送給您")]
+
+
+def build_fallback_reply(user_message: str) -> list:
+    """
+    build_text_reply 來不及在期限內完成時先回覆的訊息（不會呼叫 CWA）
+
+    Args:
+        user_message: 使用者輸入的文字
+
+    Returns:
+        最近一次產生的天氣卡片，沒有時為「資料準備中」的文字訊息；
+        不是查詢指令或沒有地名時與 build_text_reply 相同
+    """
+    command, city_input = parse_command(user_message)
+    if command is None:
+        return build_usage_reply()
+    if not city_input:
+        return build_text_reply(user_message)
+    if command == "現在":
+        # 即時觀測本來就只讀記憶體，這裡只會在解析地名時逾時
+        return [text_message(f"⏳ 正在取得{city_input}的即時天氣資料，完成後會立即傳送給您")]
+    city_name = normalize_city_name(city_input)
+
+    payload = flex_render_cache.peek(city_name)
+    if payload:
+        return [payload]
+    return [text_message(f"⏳ 正在取得{city_input or city_name}的最新天氣資料，完成後會立即傳送給您")]
@@ -0,0 +1,162 @@
+"""
+Prometheus 指標
+各階段延遲、上游錯誤 / 逾時、快取命中與每個 webhook 的事件數，由 /metrics 輸出。
+
+gunicorn 多 worker 時由 gunicorn.conf.py 設定 PROMETHEUS_MULTIPROC_DIR，
+每個 worker 把數值寫入該目錄，/metrics 不論落在哪個 worker 都會彙總全部 worker。
+"""
+import functools
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess
+)
+
+# 各階段延遲的分桶（秒）：從 HMAC 驗證的數十微秒到 LINE / CWA 的數秒
+STAGE_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+STAGE_SECONDS = Histogram(
+    'line_weather_stage_seconds',
+    'Latency of each webhook processing stage',
+    ['stage'],
+    buckets=STAGE_BUCKETS
+)
+
+UPSTREAM_REQUESTS = Counter(
+    'line_weather_upstream_requests_total',
+    'Requests to upstream APIs by outcome (ok / error / timeout / circuit_open / rate_limited)',
+    ['upstream', 'outcome']
+)
+
+CACHE_REQUESTS = Counter(
+    'line_weather_cache_requests_total',
+    'Cache lookups by result (hit / miss)',
+    ['cache', 'result']
+)
+
+CITY_RESOLVE = Counter(
+    'line_weather_city_resolve_total',
+    'City name lookups by match method (exact / alias / fuzzy / miss)',
+    ['method']
+)
+
+LOCATION_RESOLVE = Counter(
+    'line_weather_location_resolve_total',
+    'Location messages by how they were resolved (township / county / out_of_range)',
+    ['method']
+)
+
+WEBHOOK_EVENTS = Histogram(
+    'line_weather_webhook_events_per_body',
+    'Number of events in each webhook request body',
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100)
+)
+
+WEBHOOK_REQUESTS = Counter(
+    'line_weather_webhook_requests_total',
+    'Webhook requests by result (ok / invalid_signature / error)',
+    ['result']
+)
+
+WEBHOOK_SKIPPED = Counter(
+    'line_weather_webhook_skipped_total',
+    'Webhook bodies skipped before JSON parsing / events skipped before model parsing (no handler)',
+    ['stage']
+)
+
+WEBHOOK_DUPLICATES = Counter(
+    'line_weather_webhook_duplicates_total',
+    'Webhook events dropped because their webhookEventId was already seen',
+    ['redelivery']
+)
+
+RATE_LIMITED = Counter(
+    'line_weather_rate_limited_total',
+    'Messages over the per-user / per-group rate limit (notified / dropped)',
+    ['scope', 'action']
+)
+
+OUTBOUND_WAIT = Histogram(
+    'line_weather_outbound_wait_seconds',
+    'Time LINE API calls waited for the outbound rate limiter',
+    ['endpoint'],
+    buckets=(0, 0.001, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0, 300.0)
+)
+
+OUTBOUND_THROTTLED = Counter(
+    'line_weather_outbound_throttled_total',
+    'LINE API calls delayed by the local limiter or answered with 429',
+    ['endpoint', 'reason']
+)
+
+REPLY_OUTCOMES = Counter(
+    'line_weather_reply_total',
+    'Reply outcomes (on_time / fallback / token_expired / push_ok / push_error / push_skipped)',
+    ['outcome']
+)
+
+REPLY_BUDGET = Histogram(
+    'line_weather_reply_budget_seconds',
+    'Time available for preparing a reply when handling starts',
+    buckets=(0, 0.5, 1.0, 2.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+)
+
+BREAKER_TRIPS = Counter(
+    'line_weather_circuit_breaker_trips_total',
+    'Circuit breaker transitions to open',
+    ['breaker']
+)
+
+
+@contextmanager
+def observe_stage(stage: str):
+    """
+    記錄區塊的執行時間（例外時也會記錄）
+
+    Example:
+        with observe_stage('reply'):
+            reply_raw_messages(...)
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - started)
+
+
+def timed_stage(stage: str):
+    """observe_stage 的 decorator 版本"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with observe_stage(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def render_metrics() -> tuple:
+    """
+    產生 Prometheus 文字格式的輸出
+
+    Returns:
+        (內容 bytes, Content-Type)
+    """
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        # 多 worker：彙總目錄中所有 worker 的數值
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
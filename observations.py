@@ -0,0 +1,489 @@
+"""
+即時觀測（CWA O-A0001-001 自動氣象站，全台數百個測站）
+每 10 分鐘整批更新，解析成欄式索引：每個觀測值一個 array（缺值為 NaN），
+測站座標放進 geo_index 的網格。「現在 高雄」或分享位置時直接找最近的測站，
+使用者的查詢都不會呼叫 CWA。
+"""
+import json
+import math
+import os
+import threading
+import time
+from array import array
+from datetime import datetime
+from typing import NamedTuple
+
+from linebot.v3.messaging import FlexMessage
+
+from cwa_stream import PayloadStream
+from forecast_refresher import TAIPEI_TZ, ForecastRefresher
+from geo_index import GridIndex
+from metrics import CACHE_REQUESTS, observe_stage
+from weather_service import (
+    CWA_API_KEY,
+    CWA_STREAM_PARSE,
+    fetch_observation_payload,
+    fetch_observation_payload_async,
+    format_data_age
+)
+
+# 觀測資料的更新間隔（秒）
+OBSERVATION_INTERVAL = int(os.getenv('OBSERVATION_INTERVAL', 600))
+
+# 每個整 10 分鐘後等待幾秒再輪詢（測站資料上架需要一點時間）
+OBSERVATION_POLL_DELAY = int(os.getenv('OBSERVATION_POLL_DELAY', 120))
+
+# 資料尚未變更或失敗時，每隔幾秒重試（只在每個間隔的前半段）
+OBSERVATION_RETRY_INTERVAL = int(os.getenv('OBSERVATION_RETRY_INTERVAL', 60))
+
+# 查詢位置與最近測站的距離上限（公里）
+OBSERVATION_MAX_DISTANCE_KM = float(os.getenv('OBSERVATION_MAX_DISTANCE_KM', 20))
+
+# 每個測站保存的觀測值（StationObservation 的數值欄位，順序即欄位順序）
+NUMERIC_FIELDS = ('temperature', 'humidity', 'precipitation',
+                  'wind_speed', 'wind_direction', 'high', 'low')
+
+
+def _float(value) -> float:
+    """CWA 的數值（數字或字串），缺值（-99、-999、空字串、X）為 NaN"""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return math.nan
+    return math.nan if number <= -99 else number
+
+
+def _dig(data, *keys):
+    for key in keys:
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+
+def _optional(value: float):
+    return None if math.isnan(value) else value
+
+
+class StationObservation(NamedTuple):
+    """單一測站最近一次的觀測（數值缺值為 None）"""
+    station_id: str
+    name: str
+    county: str
+    town: str
+    observed_at: str        # YYYY-MM-DD HH:MM
+    weather: str            # 天氣現象（自動站多半沒有，為空字串）
+    temperature: float      # 氣溫 °C
+    humidity: float         # 相對濕度 %
+    precipitation: float    # 本日累積雨量 mm
+    wind_speed: float       # 風速 m/s
+    wind_direction: float   # 風向（度，0 為北風）
+    high: float             # 本日最高溫
+    low: float              # 本日最低溫
+
+
+class ObservationIndex:
+    """
+    全部測站的欄式觀測資料（建立後只讀，更新時整個替換）
+
+    可以一次由解析後的 JSON 建立，也可以交給 PayloadStream 逐一 add 每個測站、最後 finish。
+
+    Args:
+        data: O-A0001-001 的 JSON 回應；None 表示之後以 add 逐一加入
+    """
+
+    def __init__(self, data: dict = None):
+        self.station_ids = []
+        self.names = []
+        self.counties = []
+        self.towns = []
+        self.latitudes = array('d')
+        self.longitudes = array('d')
+        self.times = array('H')     # 文字編號
+        self.weather = array('H')   # 文字編號
+        self.columns = {field: array('f') for field in NUMERIC_FIELDS}
+        self.texts = []
+        self.grid = None
+        self._text_ids = {}
+
+        if data is not None:
+            for station in data['records']['Station']:
+                self._add_row(station)
+            self.finish()
+
+    def add(self, context: dict, station: dict):
+        """
+        加入一個測站（串流解析的 records.Station[] 元素）
+
+        Args:
+            context: 外層的純量欄位（未使用）
+            station: 測站的 JSON
+        """
+        self._add_row(station)
+
+    def finish(self) -> 'ObservationIndex':
+        """全部加入後建立座標索引（沒有氣溫的測站不參與最近測站查詢）"""
+        temperatures = self.columns['temperature']
+        valid = [not math.isnan(value) for value in temperatures]
+        self.grid = GridIndex(
+            [lat if ok else 0.0 for lat, ok in zip(self.latitudes, valid)],
+            [lon if ok else 0.0 for lon, ok in zip(self.longitudes, valid)])
+        return self
+
+    def _text(self, value) -> int:
+        value = value or ''
+        text_id = self._text_ids.get(value)
+        if text_id is None:
+            text_id = self._text_ids[value] = len(self.texts)
+            self.texts.append(value)
+        return text_id
+
+    def _add_row(self, station: dict):
+        lat = lon = math.nan
+        for coordinate in _dig(station, 'GeoInfo', 'Coordinates') or ():
+            if coordinate.get('CoordinateName') == 'WGS84':
+                lat = _float(coordinate.get('StationLatitude'))
+                lon = _float(coordinate.get('StationLongitude'))
+
+        element = station.get('WeatherElement') or {}
+        values = (
+            element.get('AirTemperature'),
+            element.get('RelativeHumidity'),
+            _dig(element, 'Now', 'Precipitation'),
+            element.get('WindSpeed'),
+            element.get('WindDirection'),
+            _dig(element, 'DailyExtreme', 'DailyHigh', 'TemperatureInfo', 'AirTemperature'),
+            _dig(element, 'DailyExtreme', 'DailyLow', 'TemperatureInfo', 'AirTemperature'),
+        )
+        for column, value in zip(self.columns.values(), values):
+            column.append(_float(value))
+
+        weather = element.get('Weather')
+        observed = _dig(station, 'ObsTime', 'DateTime') or ''
+        self.weather.append(self._text('' if weather in (None, '-99', -99) else weather))
+        self.times.append(self._text(f"{observed[:10]} {observed[11:16]}" if observed else ''))
+
+        self.station_ids.append(station.get('StationId') or '')
+        self.names.append(station.get('StationName') or '')
+        self.counties.append(_dig(station, 'GeoInfo', 'CountyName') or '')
+        self.towns.append(_dig(station, 'GeoInfo', 'TownName') or '')
+        self.latitudes.append(0.0 if math.isnan(lat) else lat)
+        self.longitudes.append(0.0 if math.isnan(lon) else lon)
+
+    def __len__(self):
+        return len(self.station_ids)
+
+    def nearest(self, lat: float, lon: float, max_km: float = OBSERVATION_MAX_DISTANCE_KM):
+        """
+        找最近的測站
+
+        Args:
+            lat: 緯度
+            lon: 經度
+            max_km: 距離上限（公里）
+
+        Returns:
+            (列號, 距離公里)，超過距離上限時為 None
+        """
+        return self.grid.nearest(lat, lon, max_km)
+
+    def get(self, row: int) -> StationObservation:
+        """
+        取得一個測站的觀測（只讀取該列）
+
+        Args:
+            row: nearest 回傳的列號
+        """
+        return StationObservation(
+            self.station_ids[row], self.names[row], self.counties[row], self.towns[row],
+            self.texts[self.times[row]], self.texts[self.weather[row]],
+            *(_optional(column[row]) for column in self.columns.values()))
+
+    def nbytes(self) -> int:
+        """欄位與文字表佔用的位元組（不含名稱與網格）"""
+        columns = (self.latitudes, self.longitudes, self.times, self.weather,
+                   *self.columns.values())
+        size = sum(column.itemsize * len(column) for column in columns)
+        size += sum(len(text.encode('utf-8')) for text in self.texts)
+        return size
+
+
+def _format(value, unit: str, digits: int = 1) -> str:
+    return '--' if value is None else f"{value:.{digits}f}{unit}"
+
+
+def _wind_direction(degrees) -> str:
+    if degrees is None:
+        return ''
+    names = ('北', '東北', '東', '東南', '南', '西南', '西', '西北')
+    return names[int((degrees + 22.5) // 45) % 8] + '風'
+
+
+def create_observation_flex_message(observation: StationObservation, note: str = None) -> dict:
+    """
+    建立即時觀測的 Flex Message（與預報卡片相同的配色）
+
+    Args:
+        observation: StationObservation
+        note: 附加在副標題的提示（例如提供舊資料時的資料年齡）
+    """
+    station = f"{observation.county}{observation.town} {observation.name}測站"
+    subtitle = f"{observation.observed_at[5:]} 觀測・{station}"
+    if note:
+        subtitle += f"・{note}"
+
+    def row(icon, label, value, color="#34495E"):
+        return {
+            "type": "box",
+            "layout": "baseline",
+            "contents": [
+                {"type": "text", "text": icon, "size": "md", "flex": 0},
+                {"type": "text", "text": label, "size": "sm", "color": "#7F8C8D",
+                 "margin": "sm", "flex": 2},
+                {"type": "text", "text": value, "size": "md", "weight": "bold",
+                 "color": color, "flex": 3, "wrap": True}
+            ],
+            "margin": "md"
+        }
+
+    wind = _format(observation.wind_speed, ' m/s')
+    direction = _wind_direction(observation.wind_direction)
+    rows = [
+        row("🌡️", "氣溫", _format(observation.temperature, '°'), "#FF6B35"),
+        row("📈", "今日高低", f"{_format(observation.low, '°')} - {_format(observation.high, '°')}"),
+        row("💦", "濕度", _format(observation.humidity, '%', 0)),
+        row("☔", "今日雨量", _format(observation.precipitation, ' mm')),
+        row("🍃", "風", f"{direction} {wind}".strip()),
+    ]
+    if observation.weather:
+        rows.insert(0, row("🌤️", "天氣", observation.weather))
+
+    location = observation.town or observation.county or observation.name
+    return {
+        "type": "flex",
+        "altText": f"📡 {location} 即時天氣 {_format(observation.temperature, '°')}",
+        "contents": {
+            "type": "bubble",
+            "size": "mega",
+            "body": {
+                "type": "box",
+                "layout": "vertical",
+                "contents": [
+                    {
+                        "type": "box",
+                        "layout": "vertical",
+                        "contents": [
+                            {"type": "text", "text": f"📡 {location}現在",
+                             "weight": "bold", "size": "xl", "color": "#2C3E50"},
+                            {"type": "text", "text": subtitle, "size": "xs",
+                             "color": "#95A5A6", "margin": "xs", "wrap": True}
+                        ],
+                        "paddingBottom": "15px"
+                    },
+                    {"type": "separator"},
+                    {
+                        "type": "box",
+                        "layout": "vertical",
+                        "contents": rows,
+                        "backgroundColor": "#FAFAFA",
+                        "cornerRadius": "10px",
+                        "paddingAll": "15px",
+                        "margin": "md"
+                    }
+                ],
+                "paddingAll": "20px"
+            },
+            "styles": {"body": {"backgroundColor": "#FFFFFF"}}
+        }
+    }
+
+
+class ObservationSnapshot:
+    """
+    即時觀測快照（由 ObservationRefresher 整批更新，介面與 ForecastSnapshot 相同）
+    """
+
+    def __init__(self):
+        self.locations = ()         # ObservationIndex，尚未載入時為空
+        self.fetched_at = 0.0
+        self.version = 0
+        self.background_refresh = False
+        self.last_error = None
+        self.parse_seconds = None
+        self._rendered = {}         # 列號 -> Flex JSON（換版時清空）
+        self._lock = threading.Lock()
+
+    def open_stream(self):
+        """
+        邊下載邊解析用的 PayloadStream（每收到一個測站就寫入欄位）
+
+        Returns:
+            PayloadStream；CWA_STREAM_PARSE=0 時為 None
+        """
+        if not CWA_STREAM_PARSE:
+            return None
+        return PayloadStream(('records', 'Station', '*'), ObservationIndex,
+                             stage='observation_parse')
+
+    def load(self, data: dict):
+        """
+        解析觀測回應並一次替換整個索引
+
+        Args:
+            data: O-A0001-001 的 JSON 回應
+        """
+        started = time.perf_counter()
+        with observe_stage('observation_parse'):
+            index = ObservationIndex(data)
+        self._replace(index, time.perf_counter() - started)
+
+    def load_stream(self, stream: PayloadStream):
+        """
+        以串流解析完成的索引替換
+
+        Args:
+            stream: open_stream 建立、已讀完回應的 PayloadStream
+        """
+        self._replace(stream.result, stream.parse_seconds)
+
+    def _replace(self, index: ObservationIndex, parse_seconds: float):
+        self.parse_seconds = parse_seconds
+        with self._lock:
+            self.locations = index
+            self._rendered = {}
+        self.fetched_at = time.time()
+        self.last_error = None
+        self.version += 1
+
+    def mark_fresh(self):
+        """CWA 確認資料未變更"""
+        self.fetched_at = time.time()
+        self.last_error = None
+
+    def record_failure(self, error: Exception):
+        """記錄更新失敗，保留原本的資料繼續提供（之後的卡片標示資料年齡）"""
+        self.last_error = str(error)
+        with self._lock:
+            self._rendered = {}
+
+    def is_stale(self) -> bool:
+        """最近一次更新失敗、正在提供舊資料"""
+        return bool(self.locations) and self.last_error is not None
+
+    def nearest(self, lat: float, lon: float):
+        """最近測站的列號（尚未載入或超出範圍時為 None）"""
+        index = self.locations
+        match = index.nearest(lat, lon) if index else None
+        return match[0] if match else None
+
+    def render(self, row: int):
+        """
+        取得測站的即時觀測 Flex Message JSON bytes（每版每個測站只組裝一次）
+
+        Args:
+            row: nearest 回傳的列號
+
+        Returns:
+            JSON bytes；資料不完整時為 None
+        """
+        # 提供舊資料時每次重新組裝，卡片上的資料年齡才會跟著增加
+        index, stale = self.locations, self.is_stale()
+        with self._lock:
+            payload = self._rendered.get(row)
+        if payload is not None:
+            CACHE_REQUESTS.labels('observation_render', 'hit').inc()
+            return payload
+
+        CACHE_REQUESTS.labels('observation_render', 'miss').inc()
+        observation = index.get(row)
+        note = format_data_age(time.time() - self.fetched_at) if stale else None
+        flex_data = create_observation_flex_message(observation, note=note)
+        try:
+            FlexMessage.from_dict(flex_data)
+        except Exception as e:
+            print(f"Invalid flex message for station {observation.station_id}: {e}")
+            return None
+
+        payload = json.dumps(flex_data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        if not stale:
+            with self._lock:
+                if self.locations is index:
+                    self._rendered[row] = payload
+        return payload
+
+    def status(self) -> dict:
+        """快照狀態，供 /health 顯示"""
+        index = self.locations
+        return {
+            'version': self.version,
+            'stations': len(index),
+            'indexed_stations': len(index.grid) if index else 0,
+            'bytes': index.nbytes() if index else 0,
+            'parse_seconds': None if self.parse_seconds is None else round(self.parse_seconds, 3),
+            'age_seconds': round(time.time() - self.fetched_at) if index else None,
+            'stale': self.is_stale(),
+            'last_error': self.last_error,
+        }
+
+
+class ObservationRefresher(ForecastRefresher):
+    """
+    即時觀測的背景更新器：不依預報發布時間，而是每 OBSERVATION_INTERVAL 秒輪詢一次
+    （條件式請求、內容雜湊與串流解析都沿用 ForecastRefresher）
+    """
+
+    def next_delay(self, result: str, now: datetime = None) -> float:
+        """
+        計算距離下一次輪詢的秒數：對齊整 10 分鐘 + OBSERVATION_POLL_DELAY
+
+        Args:
+            result: 上一次 run_once 的結果
+            now: 目前時間（測試用，預設為現在）
+
+        Returns:
+            等待秒數
+        """
+        now = now or datetime.now(TAIPEI_TZ)
+        if not self.snapshot.locations:
+            return OBSERVATION_RETRY_INTERVAL
+
+        since = (now.timestamp() - OBSERVATION_POLL_DELAY) % OBSERVATION_INTERVAL
+        wait = OBSERVATION_INTERVAL - since
+        # 這一輪的資料還沒上架（或失敗）：前半段每分鐘重試，之後等下一輪
+        if result != 'updated' and since < OBSERVATION_INTERVAL / 2:
+            return min(OBSERVATION_RETRY_INTERVAL, wait)
+        return wait
+
+
+# 全域快照與更新器（各 worker 各自更新）
+observation_snapshot = ObservationSnapshot()
+observation_refresher = ObservationRefresher(
+    observation_snapshot, fetch=fetch_observation_payload,
+    fetch_async=fetch_observation_payload_async, name='observation-refresher')
+
+
+def observations_enabled() -> bool:
+    """OBSERVATIONS=0 時停用即時觀測"""
+    return os.getenv('OBSERVATIONS', '1') != '0' and bool(CWA_API_KEY)
+
+
+def start_observation_refresher() -> bool:
+    """
+    啟動即時觀測的背景更新
+
+    Returns:
+        是否已啟動
+    """
+    if not observations_enabled():
+        return False
+    observation_refresher.start()
+    return True
+
+
+def _restart_after_fork():
+    """fork 之後在子行程重新啟動更新器"""
+    if observation_refresher._pid is not None:
+        start_observation_refresher()
+
+
+os.register_at_fork(after_in_child=_restart_after_fork)
@@ -0,0 +1,419 @@
+"""
+線上 worker 的效能剖析（預設全部關閉）
+
+- 單一 request 的 cProfile：依 PROFILE_SAMPLE_RATE 抽樣，或帶有效 X-Profile-Signature 的 request
+- tracemalloc 快照差異：POST /debug/profile/tracemalloc（需簽章）
+- 週期性 wall-clock 堆疊取樣：PROFILE_WALL=1，定期寫入 PROFILE_DIR
+
+輸出皆為 collapsed stack 格式（`a;b;c 123`），可直接交給 flamegraph.pl、speedscope 等工具。
+cProfile 另外保留 .prof 檔，可用 snakeviz / pstats 查看。
+"""
+import cProfile
+import hashlib
+import hmac
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+from flask import Blueprint, Response, abort, g, request, send_from_directory
+
+# 剖析結果的輸出目錄
+PROFILE_DIR = os.getenv(
+    'PROFILE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'profiles')
+)
+
+# 驗證 X-Profile-Signature 的密鑰；未設定時無法以簽章觸發，也不開放 /debug/profile
+PROFILE_SECRET = os.getenv('PROFILE_SECRET', '')
+
+# 簽章的有效秒數（時間戳記與伺服器時間的容許差距）
+PROFILE_SIGNATURE_TTL = int(os.getenv('PROFILE_SIGNATURE_TTL', 300))
+
+# 每個 request 以 cProfile 剖析的機率，0 = 關閉
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+
+# wall-clock 取樣：是否啟用、取樣間隔與寫檔間隔（秒）
+PROFILE_WALL = os.getenv('PROFILE_WALL', '0') == '1'
+PROFILE_WALL_INTERVAL = float(os.getenv('PROFILE_WALL_INTERVAL', 0.01))
+PROFILE_WALL_FLUSH_INTERVAL = float(os.getenv('PROFILE_WALL_FLUSH_INTERVAL', 60))
+
+# tracemalloc 保留的堆疊深度與回傳的差異筆數
+TRACEMALLOC_FRAMES = int(os.getenv('PROFILE_TRACEMALLOC_FRAMES', 10))
+TRACEMALLOC_TOP = int(os.getenv('PROFILE_TRACEMALLOC_TOP', 30))
+
+# collapsed stack 的最大深度（避免遞迴呼叫圖展開過深）
+MAX_STACK_DEPTH = 64
+
+
+def sign_request(method: str, path: str, timestamp: int = None,
+                 secret: str = PROFILE_SECRET) -> str:
+    """
+    產生 X-Profile-Signature（供 curl / 維運腳本使用）
+
+    Args:
+        method: HTTP method，例如 POST
+        path: request 路徑，例如 /callback
+        timestamp: Unix 時間，預設為現在
+
+    Returns:
+        "<timestamp>.<hex HMAC-SHA256>"
+    """
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    message = f"{timestamp}.{method.upper()}.{path}".encode('utf-8')
+    digest = hmac.new(secret.encode('utf-8'), message, hashlib.sha256).hexdigest()
+    return f"{timestamp}.{digest}"
+
+
+def verify_signature(header: str, method: str, path: str) -> bool:
+    """
+    驗證 X-Profile-Signature
+
+    Args:
+        header: X-Profile-Signature 的值
+        method: HTTP method
+        path: request 路徑
+
+    Returns:
+        簽章正確且未過期
+    """
+    if not PROFILE_SECRET or not header or '.' not in header:
+        return False
+    timestamp, _ = header.split('.', 1)
+    if not timestamp.isdigit() or abs(time.time() - int(timestamp)) > PROFILE_SIGNATURE_TTL:
+        return False
+    expected = sign_request(method, path, int(timestamp))
+    return hmac.compare_digest(expected, header)
+
+
+def _frame_name(code_info) -> str:
+    """pstats 的 (檔名, 行號, 函式) 轉成 collapsed stack 的節點名稱"""
+    filename, line, name = code_info
+    if filename == '~':
+        return name  # 內建函式，例如 <built-in method time.sleep>
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def pstats_to_collapsed(stats: pstats.Stats) -> Counter:
+    """
+    把 cProfile 的呼叫圖展開為 collapsed stacks（單位：微秒）
+
+    cProfile 只記錄「呼叫者 -> 被呼叫者」的累計時間，這裡依每條邊佔被呼叫者
+    總時間的比例往下分配，與 flameprof 等工具的作法相同。
+
+    Args:
+        stats: pstats.Stats
+
+    Returns:
+        Counter{'root;child;leaf': 微秒}
+    """
+    raw = stats.stats
+    callees = {}
+    for func, (_, _, _, _, callers) in raw.items():
+        for caller, (_, _, _, edge_ct) in callers.items():
+            callees.setdefault(caller, []).append((func, edge_ct))
+
+    collapsed = Counter()
+
+    def walk(func, stack, scale, depth):
+        _, _, tt, ct, _ = raw[func]
+        if tt * scale > 0:
+            collapsed[stack] += tt * scale * 1e6
+        if depth >= MAX_STACK_DEPTH:
+            return
+        for callee, edge_ct in callees.get(func, ()):
+            callee_ct = raw[callee][3]
+            if callee_ct <= 0 or edge_ct <= 0:
+                continue
+            name = _frame_name(callee)
+            if f";{name};" in f";{stack};":
+                continue  # 遞迴：已計入目前的 stack
+            walk(callee, f"{stack};{name}", scale * edge_ct / callee_ct, depth + 1)
+
+    for func, (_, _, _, _, callers) in raw.items():
+        if not callers:
+            walk(func, _frame_name(func), 1.0, 0)
+
+    return collapsed
+
+
+def write_collapsed(stacks: Counter, path: str):
+    """
+    寫出 collapsed stack 檔（每行 "frame;frame;frame count"）
+
+    Args:
+        stacks: Counter{stack: 數值}
+        path: 輸出檔案路徑
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for stack, value in sorted(stacks.items()):
+            if int(value) > 0:
+                f.write(f"{stack} {int(value)}\n")
+    os.replace(tmp_path, path)
+
+
+def _output_path(kind: str, suffix: str) -> str:
+    timestamp = time.strftime('%Y%m%d-%H%M%S')
+    return os.path.join(
+        PROFILE_DIR, f"{kind}-{timestamp}-{os.getpid()}-{random.randrange(1 << 16):04x}{suffix}")
+
+
+# 同一時間只剖析一個 request：Python 3.12 起 cProfile 以 sys.monitoring 實作，
+# 整個行程只能有一個啟用中的 profiler，同時 enable 會拋出 ValueError
+_request_profile_lock = threading.Lock()
+
+
+class RequestProfiler:
+    """以 cProfile 剖析單一 request，結束後寫出 .prof 與 .collapsed"""
+
+    def __init__(self, label: str):
+        self.label = label
+        self.profile = cProfile.Profile()
+        self.started = time.perf_counter()
+
+    def start(self) -> bool:
+        """
+        開始剖析
+
+        Returns:
+            是否已開始；其他 request 正在剖析（或行程中已有其他 profiler）時略過這次抽樣
+        """
+        if not _request_profile_lock.acquire(blocking=False):
+            return False
+        try:
+            self.profile.enable()
+        except ValueError:
+            _request_profile_lock.release()
+            return False
+        return True
+
+    def stop(self) -> str:
+        """
+        停止剖析並寫檔
+
+        Returns:
+            .collapsed 檔案路徑
+        """
+        self.profile.disable()
+        _request_profile_lock.release()
+        elapsed_ms = (time.perf_counter() - self.started) * 1000
+
+        base = _output_path(f"request-{self.label}-{elapsed_ms:.0f}ms", '')
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        self.profile.dump_stats(base + '.prof')
+        write_collapsed(pstats_to_collapsed(pstats.Stats(self.profile)), base + '.collapsed')
+        return base + '.collapsed'
+
+
+class WallClockSampler:
+    """
+    背景執行緒定期擷取所有執行緒的 Python 堆疊（wall-clock，含等待 I/O 的時間）
+
+    每隔 flush_interval 秒把累積的樣本寫成一個 .collapsed 檔。
+    """
+
+    def __init__(self, interval: float = PROFILE_WALL_INTERVAL,
+                 flush_interval: float = PROFILE_WALL_FLUSH_INTERVAL):
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self.samples = Counter()
+        self.files_written = 0
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+
+    def _sample(self):
+        own = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stack.append(names.get(ident, f"thread-{ident}"))
+            self.samples[';'.join(reversed(stack))] += 1
+
+    def flush(self):
+        """把目前累積的樣本寫出並清空"""
+        samples, self.samples = self.samples, Counter()
+        if samples:
+            write_collapsed(samples, _output_path('wall', '.collapsed'))
+            self.files_written += 1
+
+    def _run(self):
+        next_flush = time.monotonic() + self.flush_interval
+        while not self._stop.wait(self.interval):
+            self._sample()
+            if time.monotonic() >= next_flush:
+                self.flush()
+                next_flush = time.monotonic() + self.flush_interval
+        self.flush()
+
+    def start(self):
+        """啟動取樣執行緒（fork 之後的子行程會重新啟動）"""
+        if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name='profile-wall-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+class TracemallocDiff:
+    """保留上一次的 tracemalloc 快照，每次呼叫回傳與上一次的差異"""
+
+    def __init__(self):
+        self._previous = None
+        self._lock = threading.Lock()
+
+    def diff(self, top: int = TRACEMALLOC_TOP) -> str:
+        """
+        取得新快照並與上一次比較
+
+        第一次呼叫只會啟動 tracemalloc 並建立基準（啟動前的配置不會被追蹤）。
+
+        Returns:
+            純文字報表
+        """
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+                self._previous = tracemalloc.take_snapshot()
+                return "tracemalloc started; call again to get a diff\n"
+
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            ))
+            previous, self._previous = self._previous, snapshot
+
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"pid={os.getpid()} traced={current / 1024:.1f} KiB peak={peak / 1024:.1f} KiB"]
+        for stat in snapshot.compare_to(previous, 'traceback')[:top]:
+            lines.append("")
+            lines.append(f"{stat.size_diff / 1024:+.1f} KiB ({stat.count_diff:+d} blocks), "
+                         f"total {stat.size / 1024:.1f} KiB")
+            lines.extend(f"    {line}" for line in stat.traceback.format(most_recent_first=True))
+        return "\n".join(lines) + "\n"
+
+    def stop(self):
+        """停止追蹤並釋放快照"""
+        with self._lock:
+            self._previous = None
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+
+
+wall_sampler = WallClockSampler()
+tracemalloc_diff = TracemallocDiff()
+
+debug_profile = Blueprint('debug_profile', __name__, url_prefix='/debug/profile')
+
+
+@debug_profile.before_request
+def _require_signature():
+    """/debug/profile 只接受帶有效簽章的 request；未設定密鑰時當作不存在"""
+    if not PROFILE_SECRET:
+        abort(404)
+    if not verify_signature(request.headers.get('X-Profile-Signature', ''),
+                            request.method, request.path):
+        abort(403)
+
+
+@debug_profile.route('/tracemalloc', methods=['POST', 'DELETE'])
+def tracemalloc_endpoint():
+    """POST：取得與上一次快照的記憶體差異；DELETE：停止 tracemalloc"""
+    if request.method == 'DELETE':
+        tracemalloc_diff.stop()
+        return Response("tracemalloc stopped\n", mimetype='text/plain')
+    return Response(tracemalloc_diff.diff(), mimetype='text/plain')
+
+
+@debug_profile.route('/files', methods=['GET'])
+def list_files():
+    """列出 PROFILE_DIR 中的剖析結果"""
+    if not os.path.isdir(PROFILE_DIR):
+        return Response("", mimetype='text/plain')
+    names = sorted(os.listdir(PROFILE_DIR), reverse=True)
+    return Response("\n".join(names) + "\n", mimetype='text/plain')
+
+
+@debug_profile.route('/files/<path:name>', methods=['GET'])
+def get_file(name):
+    """下載單一剖析結果"""
+    return send_from_directory(PROFILE_DIR, name, as_attachment=True)
+
+
+def _start_request_profile():
+    # 未啟用時只有兩個判斷，不影響一般 request
+    if not (PROFILE_SAMPLE_RATE or PROFILE_SECRET):
+        return
+    if request.blueprint == debug_profile.name:
+        return
+
+    header = request.headers.get('X-Profile-Signature')
+    sampled = PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE
+    if sampled or (header and verify_signature(header, request.method, request.path)):
+        profiler = RequestProfiler(request.endpoint or 'unknown')
+        if profiler.start():
+            g._request_profiler = profiler
+
+
+def _stop_request_profile(response):
+    profiler = g.pop('_request_profiler', None)
+    if profiler is not None:
+        path = profiler.stop()
+        response.headers['X-Profile-File'] = os.path.basename(path)
+    return response
+
+
+def _discard_request_profile(exc):
+    # 未處理的例外不會經過 after_request，在這裡確保 profiler 被關閉
+    profiler = g.pop('_request_profiler', None)
+    if profiler is not None:
+        profiler.stop()
+
+
+def install_profiling(app):
+    """
+    在 Flask app 上啟用剖析功能（全部由環境變數決定是否生效）
+
+    Args:
+        app: Flask 應用程式
+    """
+    app.register_blueprint(debug_profile)
+    app.before_request(_start_request_profile)
+    app.after_request(_stop_request_profile)
+    app.teardown_request(_discard_request_profile)
+    if PROFILE_WALL:
+        wall_sampler.start()
+
+
+def _restart_after_fork():
+    """fork 之後在子行程重新啟動 wall-clock 取樣（執行緒不會跟著 fork）"""
+    if wall_sampler._pid is not None:
+        wall_sampler.start()
+
+
+os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+if __name__ == '__main__':
+    # 產生簽章：python profiling.py POST /debug/profile/tracemalloc
+    if len(sys.argv) != 3 or not PROFILE_SECRET:
+        sys.exit("usage: PROFILE_SECRET=... python profiling.py <METHOD> <PATH>")
+    print(sign_request(sys.argv[1], sys.argv[2]))
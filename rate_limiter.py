@@ -0,0 +1,177 @@
+"""
+使用者 / 群組的訊息頻率限制
+以 GCRA（等同 token bucket）實作：每個 key 只記錄一個「理論到達時間」(TAT)，
+存在 dedupe_index.SlotTable 的 16 bytes 槽位中。TAT 早於現在代表 bucket 已滿，
+該槽直接視為空槽重用（不需要另外清理），數十萬個使用者也只佔固定的記憶體。
+
+預設每個 worker 各自計數；RATE_LIMIT_SHARED=1 時改用 /dev/shm 下的共用表，
+同一台機器的所有 worker 共用同一份額度。
+"""
+import os
+import time
+
+from dedupe_index import SlotTable, default_index_path, key_hash
+from metrics import RATE_LIMITED
+
+# 每位使用者每分鐘可查詢次數與可連續查詢的次數
+RATE_LIMIT_USER_PER_MINUTE = float(os.getenv('RATE_LIMIT_USER_PER_MINUTE', 10))
+RATE_LIMIT_USER_BURST = int(os.getenv('RATE_LIMIT_USER_BURST', 5))
+
+# 每個群組 / 聊天室每分鐘可查詢次數與可連續查詢的次數
+RATE_LIMIT_GROUP_PER_MINUTE = float(os.getenv('RATE_LIMIT_GROUP_PER_MINUTE', 20))
+RATE_LIMIT_GROUP_BURST = int(os.getenv('RATE_LIMIT_GROUP_BURST', 10))
+
+# 被限制時最多每幾秒回覆一次提示，其餘訊息直接略過
+RATE_LIMIT_NOTICE_INTERVAL = float(os.getenv('RATE_LIMIT_NOTICE_INTERVAL', 60))
+
+# 槽位數（每槽 16 bytes，預設 256K 槽 = 4 MiB）
+RATE_LIMIT_CAPACITY = int(os.getenv('RATE_LIMIT_CAPACITY', 262144))
+
+# 1 = 同一台機器的所有 worker 共用額度
+RATE_LIMIT_SHARED = os.getenv('RATE_LIMIT_SHARED', '0') == '1'
+RATE_LIMIT_PATH = os.getenv('RATE_LIMIT_PATH') or default_index_path('line_weather_ratelimit.bin')
+
+
+class RateLimiter(SlotTable):
+    """
+    以 key 區分的 token bucket
+
+    Args:
+        path: 共用表格檔路徑，None 表示只在本行程計數
+        capacity: 槽位數
+    """
+
+    def __init__(self, path=None, capacity: int = RATE_LIMIT_CAPACITY):
+        self.allowed = 0
+        self.limited = 0
+        super().__init__(path, capacity, b'LWRL')
+
+    def acquire(self, key: str, per_minute: float, burst: int, now: float = None) -> float:
+        """
+        嘗試取用一個 token
+
+        Args:
+            key: 例如 'user:U123'
+            per_minute: 每分鐘補充的 token 數
+            burst: bucket 容量（可連續取用的次數）
+            now: 目前時間（time.time()）
+
+        Returns:
+            0 表示允許；大於 0 為還要等待的秒數
+        """
+        return self.acquire_all([(key, per_minute, burst)], now)
+
+    def acquire_all(self, buckets: list, now: float = None) -> float:
+        """
+        同時向多個 bucket 各取用一個 token：全部都有 token 才一起扣除，
+        任一個不足時都不扣（不會出現先扣了一個、另一個拒絕而白白消耗的 token）
+
+        Args:
+            buckets: [(key, 每分鐘補充的 token 數, burst)]
+            now: 目前時間（time.time()）
+
+        Returns:
+            0 表示允許；大於 0 為還要等待的秒數（各 bucket 中最長者）
+        """
+        now = time.time() if now is None else now
+        buckets = [(key_hash(key), 60.0 / per_minute, burst) for key, per_minute, burst in buckets]
+
+        with self.locked():
+            slots = []
+            wait = 0.0
+            for key, interval, burst in buckets:
+                index, tat = self.lookup(key, now)
+                tat = now if tat is None else tat
+                wait = max(wait, tat - interval * (burst - 1) - now)
+                slots.append((index, key, tat + interval))
+            if wait > 0:
+                self.limited += 1
+                return wait
+
+            written = set()
+            for index, key, tat in slots:
+                if index in written:
+                    # 兩個 key 探測到同一個空槽：重新找位置
+                    index, _ = self.lookup(key, now)
+                self.write(index, key, tat)
+                written.add(index)
+            self.allowed += 1
+            return 0.0
+
+    def defer(self, key: str, seconds: float, per_minute: float, burst: int, now: float = None):
+        """
+        讓 key 在 seconds 秒內不再取得 token（例如上游回應 429 時）
+
+        Args:
+            key: 與 acquire 相同的 key
+            seconds: 暫停秒數
+            per_minute: 與 acquire 相同
+            burst: 與 acquire 相同
+        """
+        now = time.time() if now is None else now
+        tolerance = 60.0 / per_minute * (burst - 1)
+        key = key_hash(key)
+
+        with self.locked():
+            index, tat = self.lookup(key, now)
+            self.write(index, key, max(tat or now, now + seconds + tolerance))
+
+    def stats(self) -> dict:
+        """統計，供 /health 顯示"""
+        return {
+            'shared': self.path is not None,
+            'capacity': self.capacity,
+            'allowed': self.allowed,
+            'limited': self.limited,
+            'evicted': self.evicted,
+        }
+
+
+class InboundLimiter:
+    """
+    webhook 訊息的頻率限制：先檢查使用者，再檢查所在的群組 / 聊天室
+
+    Args:
+        limiter: 計數用的 RateLimiter
+    """
+
+    def __init__(self, limiter: RateLimiter):
+        self.limiter = limiter
+
+    def check(self, event) -> str:
+        """
+        判斷事件是否應處理
+
+        Args:
+            event: SDK 的事件物件
+
+        Returns:
+            'allow'：正常處理；'notify'：超過頻率，回覆一次提示；'drop'：超過頻率且已提示過
+        """
+        source = event.source
+        checks = []
+        user_id = getattr(source, 'user_id', None)
+        if user_id:
+            checks.append(('user', user_id, RATE_LIMIT_USER_PER_MINUTE, RATE_LIMIT_USER_BURST))
+        group_id = getattr(source, 'group_id', None) or getattr(source, 'room_id', None)
+        if group_id:
+            checks.append(('group', group_id, RATE_LIMIT_GROUP_PER_MINUTE, RATE_LIMIT_GROUP_BURST))
+
+        for scope, key, per_minute, burst in checks:
+            if self.limiter.acquire(f'{scope}:{key}', per_minute, burst) == 0:
+                continue
+            # 每個被限制的對象在 RATE_LIMIT_NOTICE_INTERVAL 內只提示一次
+            if self.limiter.acquire(f'notice:{scope}:{key}', 60.0 / RATE_LIMIT_NOTICE_INTERVAL, 1) == 0:
+                RATE_LIMITED.labels(scope, 'notified').inc()
+                return 'notify'
+            RATE_LIMITED.labels(scope, 'dropped').inc()
+            return 'drop'
+        return 'allow'
+
+    def stats(self) -> dict:
+        """統計，供 /health 顯示"""
+        return self.limiter.stats()
+
+
+# 全域限制器
+inbound_limiter = InboundLimiter(RateLimiter(RATE_LIMIT_PATH if RATE_LIMIT_SHARED else None))
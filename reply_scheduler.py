@@ -0,0 +1,291 @@
+"""
+有期限的回覆流程
+reply token 只在短時間內有效，天氣資料來不及在期限內準備好時，
+先以快取的卡片（或「資料準備中」訊息）回覆，資料完成後再以 push 送出最新結果。
+push 帶 X-Line-Retry-Key，網路錯誤重試時 LINE 只會送出一次。
+"""
+import asyncio
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import aiohttp
+import urllib3
+from linebot.v3.messaging import ApiException
+
+from line_messaging import (
+    is_invalid_reply_token,
+    push_raw_messages,
+    push_raw_messages_async,
+    reply_raw_messages,
+    reply_raw_messages_async
+)
+from metrics import REPLY_BUDGET, REPLY_OUTCOMES
+from weather_service import backoff_delay
+
+# 從開始處理事件起，最多等待幾秒準備回覆內容
+REPLY_DEADLINE = float(os.getenv('REPLY_DEADLINE', 2.5))
+
+# reply token 的有效秒數（由事件的 timestamp 起算，保留一些餘裕）
+REPLY_TOKEN_TTL = float(os.getenv('REPLY_TOKEN_TTL', 50))
+
+# push 失敗（網路錯誤、5xx）時最多嘗試幾次
+PUSH_MAX_ATTEMPTS = int(os.getenv('PUSH_MAX_ATTEMPTS', 3))
+
+# 期限過後繼續準備回覆內容的執行緒數
+REPLY_WORKERS = int(os.getenv('REPLY_WORKERS', 8))
+
+
+def event_target(event):
+    """
+    push 的對象：群組 / 聊天室內的訊息推播到群組 / 聊天室，否則推播給使用者
+
+    Args:
+        event: SDK 的事件物件
+
+    Returns:
+        groupId / roomId / userId，無法判斷時回傳 None
+    """
+    source = event.source
+    return (getattr(source, 'group_id', None) or getattr(source, 'room_id', None)
+            or getattr(source, 'user_id', None))
+
+
+def reply_budget(event, now: float = None) -> float:
+    """
+    本次回覆可用的秒數
+
+    Args:
+        event: SDK 的事件物件（timestamp 為毫秒）
+        now: 目前時間（time.time()）
+
+    Returns:
+        REPLY_DEADLINE 與 reply token 剩餘有效時間中較小者，可能為負數（token 已過期）
+    """
+    now = time.time() if now is None else now
+    token_left = REPLY_TOKEN_TTL
+    if getattr(event, 'timestamp', None):
+        # 事件在佇列中等待過（耐久佇列 / 背景處理）時，token 剩餘時間較短
+        token_left = event.timestamp / 1000 + REPLY_TOKEN_TTL - now
+    return min(REPLY_DEADLINE, token_left)
+
+
+class ReplyScheduler:
+    """
+    在期限內回覆，來不及時改為「先回覆、後推播」
+
+    Args:
+        deadline: 準備回覆內容的期限（秒）
+        workers: 準備回覆內容的執行緒數
+    """
+
+    def __init__(self, deadline: float = REPLY_DEADLINE, workers: int = REPLY_WORKERS):
+        self.deadline = deadline
+        self.workers = workers
+        self._executor = None
+        self._pid = None
+
+        self.outcomes = {}
+        self._stats_lock = threading.Lock()  # 統計由 reply / push 執行緒同時更新
+
+    def _record(self, outcome: str):
+        with self._stats_lock:
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        REPLY_OUTCOMES.labels(outcome).inc()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # fork 之後不能沿用父行程的執行緒
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='reply')
+            self._pid = os.getpid()
+        return self._executor
+
+    def respond(self, api_client, event, build, fallback):
+        """
+        準備並送出回覆
+
+        Args:
+            api_client: linebot.v3.messaging.ApiClient
+            event: SDK 的事件物件（需有 reply_token）
+            build: 產生回覆訊息的函式（可能呼叫 CWA）
+            fallback: 期限內來不及時先回覆的訊息函式（不可呼叫上游）
+        """
+        budget = min(self.deadline, reply_budget(event))
+        REPLY_BUDGET.observe(max(budget, 0))
+
+        if budget <= 0:
+            # token 已過期：不再嘗試 reply，直接推播
+            self._record('token_expired')
+            self.push(api_client, event, build())
+            return
+
+        future = self._get_executor().submit(build)
+        try:
+            messages = future.result(timeout=budget)
+        except FutureTimeoutError:
+            early = fallback()
+            self._reply_or_push(api_client, event, early)
+            self._record('fallback')
+            # 最新資料完成後再推播（與先前回覆的內容相同時不重複送出）
+            future.add_done_callback(
+                lambda f: self._push_result(api_client, event, f, early))
+            return
+
+        self._record('on_time')
+        self._reply_or_push(api_client, event, messages)
+
+    def _reply_or_push(self, api_client, event, messages: list):
+        """reply；token 已失效時改為推播"""
+        try:
+            reply_raw_messages(api_client, event.reply_token, messages)
+        except ApiException as e:
+            if not is_invalid_reply_token(e):
+                raise
+            self._record('token_expired')
+            self.push(api_client, event, messages)
+
+    def _push_result(self, api_client, event, future, early: list):
+        try:
+            messages = future.result()
+        except Exception as e:
+            print(f"Failed to prepare delayed reply: {e}")
+            self._record('push_error')
+            return
+        if messages == early:
+            self._record('push_skipped')
+            return
+        self.push(api_client, event, messages)
+
+    def push(self, api_client, event, messages: list) -> bool:
+        """
+        推播訊息，失敗時以同一個 X-Line-Retry-Key 重試
+
+        Args:
+            api_client: linebot.v3.messaging.ApiClient
+            event: SDK 的事件物件
+            messages: 每則訊息的 JSON bytes
+
+        Returns:
+            是否送出成功
+        """
+        to = event_target(event)
+        if not to:
+            self._record('push_error')
+            return False
+
+        retry_key = str(uuid.uuid4())
+        for attempt in range(PUSH_MAX_ATTEMPTS):
+            try:
+                push_raw_messages(api_client, to, messages, retry_key)
+                self._record('push_ok')
+                return True
+            except ApiException as e:
+                if e.status == 409:
+                    # 同一個 retry key 已被接受（先前的嘗試其實已送達）
+                    self._record('push_ok')
+                    return True
+                # 429 已由 line_rate_limit 依 Retry-After 重試過
+                if e.status < 500:
+                    print(f"Push rejected: {e.status} {e.body}")
+                    break
+            except urllib3.exceptions.HTTPError as e:
+                print(f"Push failed (attempt {attempt + 1}): {e}")
+            if attempt + 1 < PUSH_MAX_ATTEMPTS:
+                time.sleep(backoff_delay(attempt))
+
+        self._record('push_error')
+        return False
+
+    async def respond_async(self, api_client, event, build, fallback):
+        """
+        respond 的 asyncio 版本
+
+        Args:
+            api_client: linebot.v3.messaging.AsyncApiClient
+            event: SDK 的事件物件
+            build: 產生回覆訊息的 coroutine function
+            fallback: 期限內來不及時先回覆的訊息函式（一般函式，不可呼叫上游）
+        """
+        budget = min(self.deadline, reply_budget(event))
+        REPLY_BUDGET.observe(max(budget, 0))
+
+        if budget <= 0:
+            self._record('token_expired')
+            await self.push_async(api_client, event, await build())
+            return
+
+        task = asyncio.ensure_future(build())
+        done, _ = await asyncio.wait({task}, timeout=budget)
+        if not done:
+            early = fallback()
+            await self._reply_or_push_async(api_client, event, early)
+            self._record('fallback')
+            try:
+                messages = await task
+            except Exception as e:
+                print(f"Failed to prepare delayed reply: {e}")
+                self._record('push_error')
+                return
+            if messages == early:
+                self._record('push_skipped')
+                return
+            await self.push_async(api_client, event, messages)
+            return
+
+        self._record('on_time')
+        await self._reply_or_push_async(api_client, event, task.result())
+
+    async def _reply_or_push_async(self, api_client, event, messages: list):
+        try:
+            await reply_raw_messages_async(api_client, event.reply_token, messages)
+        except ApiException as e:
+            if not is_invalid_reply_token(e):
+                raise
+            self._record('token_expired')
+            await self.push_async(api_client, event, messages)
+
+    async def push_async(self, api_client, event, messages: list) -> bool:
+        """push 的 asyncio 版本"""
+        to = event_target(event)
+        if not to:
+            self._record('push_error')
+            return False
+
+        retry_key = str(uuid.uuid4())
+        for attempt in range(PUSH_MAX_ATTEMPTS):
+            try:
+                await push_raw_messages_async(api_client, to, messages, retry_key)
+                self._record('push_ok')
+                return True
+            except ApiException as e:
+                if e.status == 409:
+                    self._record('push_ok')
+                    return True
+                # 429 已由 line_rate_limit 依 Retry-After 重試過
+                if e.status < 500:
+                    print(f"Push rejected: {e.status} {e.body}")
+                    break
+            except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+                print(f"Push failed (attempt {attempt + 1}): {e}")
+            if attempt + 1 < PUSH_MAX_ATTEMPTS:
+                await asyncio.sleep(backoff_delay(attempt))
+
+        self._record('push_error')
+        return False
+
+    def stats(self) -> dict:
+        """回覆統計，供 /health 顯示"""
+        with self._stats_lock:
+            outcomes = dict(self.outcomes)
+        return {
+            'deadline_seconds': self.deadline,
+            'token_ttl_seconds': REPLY_TOKEN_TTL,
+            'outcomes': outcomes,
+        }
+
+
+# 全域排程器
+reply_scheduler = ReplyScheduler()
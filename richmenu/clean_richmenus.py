@@ -5,6 +5,14 @@
 from linebot.v3.messaging import Configuration, ApiClient, MessagingApi
 from dotenv import load_dotenv
 import os
+import sys
+
+# 直接執行（cd richmenu && python clean_richmenus.py）時也能匯入專案根目錄的模組
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _ROOT not in sys.path:
+    sys.path.insert(0, _ROOT)
+
+from line_rate_limit import limit_api_client  # noqa: E402
 
 load_dotenv()
 
@@ -22,7 +30,7 @@ KEEP_MENUS = {
 def clean_duplicate_menus():
     """清理重複的 Rich Menu"""
     
-    with ApiClient(configuration) as api_client:
+    with limit_api_client(ApiClient(configuration)) as api_client:
         line_bot_api = MessagingApi(api_client)
         
         # 取得所有 Rich Menu
@@ -17,6 +17,14 @@ from linebot.v3.messaging import (
 from dotenv import load_dotenv
 import os
 import requests
+import sys
+
+# 直接執行（cd richmenu && python create_rich_menu.py）時也能匯入專案根目錄的模組
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _ROOT not in sys.path:
+    sys.path.insert(0, _ROOT)
+
+from line_rate_limit import limit_api_client, outbound_limiter  # noqa: E402
 
 load_dotenv()
 
@@ -133,7 +141,7 @@ def create_all_region_menus():
 
     menu_ids = {}
 
-    with ApiClient(configuration) as api_client:
+    with limit_api_client(ApiClient(configuration)) as api_client:
         line_bot_api = MessagingApi(api_client)
 
         for idx, (region_name, cities) in enumerate(regions):
@@ -161,7 +169,7 @@ def create_weather_rich_menu():
         0
     )
 
-    with ApiClient(configuration) as api_client:
+    with limit_api_client(ApiClient(configuration)) as api_client:
         line_bot_api = MessagingApi(api_client)
 
         try:
@@ -189,6 +197,7 @@ def upload_rich_menu_image(rich_menu_id, image_path):
 
     try:
         with open(image_path, 'rb') as f:
+            outbound_limiter.wait('richmenu')
             response = requests.post(url, headers=headers, data=f)
             response.raise_for_status()
             print(f"✅ 圖片上傳成功！")
@@ -201,7 +210,7 @@ def upload_rich_menu_image(rich_menu_id, image_path):
 def set_default_rich_menu(rich_menu_id):
     """設定為預設 Rich Menu"""
 
-    with ApiClient(configuration) as api_client:
+    with limit_api_client(ApiClient(configuration)) as api_client:
         line_bot_api = MessagingApi(api_client)
 
         try:
@@ -216,7 +225,7 @@ def set_default_rich_menu(rich_menu_id):
 def list_rich_menus():
     """列出所有 Rich Menu"""
 
-    with ApiClient(configuration) as api_client:
+    with limit_api_client(ApiClient(configuration)) as api_client:
         line_bot_api = MessagingApi(api_client)
 
         try:
@@ -236,7 +245,7 @@ def list_rich_menus():
 def delete_rich_menu(rich_menu_id):
     """刪除 Rich Menu"""
 
-    with ApiClient(configuration) as api_client:
+    with limit_api_client(ApiClient(configuration)) as api_client:
         line_bot_api = MessagingApi(api_client)
 
         try:
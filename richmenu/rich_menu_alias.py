@@ -10,6 +10,14 @@ from linebot.v3.messaging import (
 )
 from dotenv import load_dotenv
 import os
+import sys
+
+# 直接執行（cd richmenu && python rich_menu_alias.py）時也能匯入專案根目錄的模組
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _ROOT not in sys.path:
+    sys.path.insert(0, _ROOT)
+
+from line_rate_limit import limit_api_client  # noqa: E402
 
 load_dotenv()
 
@@ -38,7 +46,7 @@ def create_aliases():
         "離島": "islands"
     }
 
-    with ApiClient(configuration) as api_client:
+    with limit_api_client(ApiClient(configuration)) as api_client:
         line_bot_api = MessagingApi(api_client)
 
         print("🏷️  開始創建 Rich Menu Alias...")
@@ -77,7 +85,7 @@ def create_aliases():
 def list_aliases():
     """列出所有 Rich Menu Alias"""
 
-    with ApiClient(configuration) as api_client:
+    with limit_api_client(ApiClient(configuration)) as api_client:
         line_bot_api = MessagingApi(api_client)
 
         try:
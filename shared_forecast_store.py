@@ -0,0 +1,272 @@
+"""
+跨 worker 共用的預報快照檔
+由一個 worker 的更新器寫入，同一台機器上的所有 worker 以 mmap 讀取
+
+檔案格式（little-endian）：
+    header  : magic(4s) 版本(H) 保留(H) generation(Q) fetched_at(d)
+              index 長度(I) data 長度(I) crc32(I)
+    index   : JSON {"cities": {城市: [offset, length]}, "last_error": ...}
+    data    : 各城市預報的 JSON，依 index 的 offset 串接
+
+寫入時先寫暫存檔再 os.replace，讀取端永遠看到完整的一個版本。
+"""
+import fcntl
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from collections.abc import Mapping
+
+MAGIC = b'LWFS'
+FORMAT_VERSION = 2
+HEADER = struct.Struct('<4sHHQdIII')
+
+
+def default_store_path() -> str:
+    """預設放在 /dev/shm（tmpfs），沒有時放系統暫存目錄"""
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base, 'line_weather_forecast.bin')
+
+
+FORECAST_SHARED_PATH = os.getenv('FORECAST_SHARED_PATH') or default_store_path()
+
+# 讀取端檢查檔案是否換版的最短間隔（秒）
+FORECAST_SHARED_CHECK_INTERVAL = float(
+    os.getenv('FORECAST_SHARED_CHECK_INTERVAL', 1))
+
+
+class SharedForecastView(Mapping):
+    """
+    單一版本快照檔的唯讀檢視
+
+    行為與 {城市: 預報} 相同，但只在查詢某個城市時才解碼該城市的資料，
+    原始內容留在 mmap（作業系統的 page cache，由所有 worker 共用）。
+    """
+
+    def __init__(self, buffer, index: dict, data_offset: int, decode=None):
+        self._buffer = buffer
+        self._cities = index['cities']
+        self._data_offset = data_offset
+        self._decode = decode
+        self._decoded = {}
+
+    def __getitem__(self, city_name):
+        forecast = self._decoded.get(city_name)
+        if forecast is None:
+            offset, length = self._cities[city_name]
+            start = self._data_offset + offset
+            forecast = json.loads(bytes(self._buffer[start:start + length]))
+            if self._decode is not None:
+                forecast = self._decode(forecast)
+            self._decoded[city_name] = forecast
+        return forecast
+
+    def __iter__(self):
+        return iter(self._cities)
+
+    def __len__(self):
+        return len(self._cities)
+
+
+class SharedForecastStore:
+    """
+    讀寫共用快照檔
+
+    Args:
+        path: 快照檔路徑
+        decode: 將城市 JSON 還原為物件的函式（例如 CityForecast.from_json）
+    """
+
+    def __init__(self, path: str = FORECAST_SHARED_PATH, decode=None):
+        self.path = path
+        self.decode = decode
+        self.generation = 0
+        self.fetched_at = 0.0
+        self.last_error = None
+        self.view = None
+
+        self._blobs = None       # 寫入端保留最後一次的資料，更新狀態時重寫
+        self._file_id = None     # (st_ino, st_mtime_ns)，判斷檔案是否被替換
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    # ---------- 寫入端 ----------
+
+    def publish(self, locations: dict, fetched_at: float):
+        """
+        寫入新一版的預報資料（generation + 1）
+
+        Args:
+            locations: {城市: 可 JSON 序列化的預報（NamedTuple 會序列化為 list）}
+            fetched_at: 資料取得時間
+        """
+        blobs = {
+            city: json.dumps(forecast, ensure_ascii=False,
+                             separators=(',', ':')).encode('utf-8')
+            for city, forecast in locations.items()
+        }
+        # 以檔案內的 generation 為準，更新器換手時版本號仍然遞增
+        self.refresh()
+        self._blobs = blobs
+        self._write(self.generation + 1, fetched_at, None)
+
+    def touch(self, fetched_at: float):
+        """資料未變更：只更新取得時間並清除錯誤"""
+        if self._blobs is not None:
+            self._write(self.generation, fetched_at, None)
+
+    def record_failure(self, error: str):
+        """記錄更新失敗，讓其他 worker 也知道目前提供的是舊資料"""
+        if self._blobs is not None:
+            self._write(self.generation, self.fetched_at, error)
+
+    def _write(self, generation: int, fetched_at: float, last_error):
+        cities = {}
+        offset = 0
+        for city, blob in self._blobs.items():
+            cities[city] = [offset, len(blob)]
+            offset += len(blob)
+
+        index = json.dumps(
+            {'cities': cities, 'last_error': last_error},
+            ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        data = b''.join(self._blobs.values())
+        header = HEADER.pack(
+            MAGIC, FORMAT_VERSION, 0, generation, fetched_at,
+            len(index), len(data), zlib.crc32(data, zlib.crc32(index)))
+
+        directory = os.path.dirname(self.path) or '.'
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.forecast-')
+        try:
+            os.fchmod(fd, 0o644)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(header)
+                f.write(index)
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        # 寫入端直接切換到新版本
+        self._checked_at = 0.0
+        self.refresh()
+
+    # ---------- 讀取端 ----------
+
+    def refresh(self, force: bool = True) -> bool:
+        """
+        檔案被替換時重新 mmap
+
+        Args:
+            force: False 時最多每 FORECAST_SHARED_CHECK_INTERVAL 秒檢查一次
+
+        Returns:
+            是否載入了新的檔案
+        """
+        now = time.time()
+        if not force and now - self._checked_at < FORECAST_SHARED_CHECK_INTERVAL:
+            return False
+
+        with self._lock:
+            self._checked_at = now
+            try:
+                st = os.stat(self.path)
+            except FileNotFoundError:
+                return False
+
+            file_id = (st.st_ino, st.st_mtime_ns)
+            if file_id == self._file_id:
+                return False
+
+            try:
+                with open(self.path, 'rb') as f:
+                    buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError) as e:
+                print(f"Failed to map shared forecast store: {e}")
+                return False
+
+            try:
+                (magic, version, _, generation, fetched_at,
+                 index_len, data_len, crc) = HEADER.unpack_from(buffer, 0)
+            except struct.error:
+                # 比 header 還短（寫到一半或被截斷的檔案）
+                print("Ignoring truncated shared forecast store")
+                return False
+            index_start = HEADER.size
+            data_start = index_start + index_len
+            if (magic != MAGIC or version != FORMAT_VERSION
+                    or len(buffer) != data_start + data_len):
+                print("Ignoring shared forecast store with unknown format")
+                return False
+            index_bytes = buffer[index_start:data_start]
+            if zlib.crc32(buffer[data_start:], zlib.crc32(index_bytes)) != crc:
+                print("Ignoring corrupted shared forecast store")
+                return False
+
+            index = json.loads(index_bytes)
+            if generation != self.generation or self.view is None:
+                self.view = SharedForecastView(
+                    buffer, index, data_start, decode=self.decode)
+            self.generation = generation
+            self.fetched_at = fetched_at
+            self.last_error = index.get('last_error')
+            self._file_id = file_id
+            return True
+
+    def status(self) -> dict:
+        """共用快照狀態，供 /health 顯示"""
+        return {
+            'path': self.path,
+            'generation': self.generation,
+            'cities': len(self.view) if self.view is not None else 0,
+        }
+
+
+class LeaderLock:
+    """
+    以 flock 選出唯一負責更新快照的 worker
+
+    取得鎖的行程持有到結束為止；行程結束後作業系統自動釋放，
+    其他 worker 下一次嘗試時就會接手。
+    """
+
+    def __init__(self, path: str = FORECAST_SHARED_PATH + '.lock'):
+        self.path = path
+        self._fd = None
+        self._pid = None
+
+    def acquire(self) -> bool:
+        """
+        嘗試取得鎖（不阻塞）
+
+        Returns:
+            目前行程是否為 leader
+        """
+        if self._fd is not None and self._pid == os.getpid():
+            return True
+
+        # fork 來的 fd 與父行程共用同一把鎖，不能算數
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+
+        self._fd = fd
+        self._pid = os.getpid()
+        return True
+
+    @property
+    def is_leader(self) -> bool:
+        return self._fd is not None and self._pid == os.getpid()
@@ -0,0 +1,145 @@
+"""
+Single-flight 請求合併
+同一個 key 同時有多個呼叫時，只執行一次，其他呼叫等待並取得同一份結果
+"""
+import asyncio
+import threading
+
+
+class _Call:
+    """進行中的呼叫"""
+
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    執行緒版 single-flight（適用 gunicorn gthread / sync worker）
+
+    Example:
+        flight = SingleFlight('forecast')
+        data = flight.do(('F-C0032-001', '高雄市'), fetch, '高雄市')
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0        # 總呼叫次數
+        self.executions = 0   # 實際執行次數
+        self.coalesced = 0    # 被合併（等待別人結果）的次數
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        執行 fn，若相同 key 已在執行中則等待其結果
+
+        Args:
+            key: 合併用的 key（例如 (資料集, 城市)）
+            fn: 要執行的函式
+
+        Returns:
+            fn 的回傳值（所有等待者取得同一個物件）
+
+        Raises:
+            fn 拋出的例外會傳給所有等待者
+        """
+        with self._lock:
+            self.calls += 1
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._inflight[key] = call
+                self.executions += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            call.event.set()
+
+    def stats(self) -> dict:
+        """合併統計，供 /health 顯示"""
+        return {
+            'calls': self.calls,
+            'executions': self.executions,
+            'coalesced': self.coalesced,
+            'inflight': len(self._inflight),
+        }
+
+
+class AsyncSingleFlight:
+    """
+    asyncio 版 single-flight（同一個 event loop 內使用）
+
+    Example:
+        flight = AsyncSingleFlight('forecast')
+        data = await flight.do(('F-C0032-001', '高雄市'), fetch_async, '高雄市')
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        self._inflight = {}
+
+    async def do(self, key, coro_fn, *args, **kwargs):
+        """
+        執行 coroutine function，若相同 key 已在執行中則等待其結果
+
+        Args:
+            key: 合併用的 key
+            coro_fn: 回傳 coroutine 的函式
+
+        Returns:
+            coro_fn 的結果（所有等待者取得同一個物件）
+        """
+        self.calls += 1
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            # shield：單一等待者被取消時不影響其他等待者
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        self.executions += 1
+        try:
+            result = await coro_fn(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            # 沒有其他等待者時避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def stats(self) -> dict:
+        """合併統計"""
+        return {
+            'calls': self.calls,
+            'executions': self.executions,
+            'coalesced': self.coalesced,
+            'inflight': len(self._inflight),
+        }
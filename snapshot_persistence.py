@@ -0,0 +1,114 @@
+"""
+預報快照的本機持久化
+每次更新後把解析好的快照寫到磁碟，重新啟動時先載入，不必等待 CWA 就能回覆
+"""
+import gzip
+import json
+import os
+import tempfile
+
+from weather_service import FORECAST_DATASET, CityForecast, forecast_snapshot
+
+# 檔案格式版本，結構變更時遞增（舊版檔案會被忽略）
+PERSIST_FORMAT_VERSION = 1
+
+FORECAST_PERSIST_PATH = os.getenv(
+    'FORECAST_PERSIST_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 'data', 'forecast_snapshot.json.gz')
+)
+
+
+def save_snapshot(snapshot, path: str = FORECAST_PERSIST_PATH):
+    """
+    將快照寫入 gzip 壓縮的 JSON（先寫暫存檔再替換）
+
+    Args:
+        snapshot: weather_service.ForecastSnapshot
+        path: 輸出檔案路徑
+    """
+    document = {
+        'format': PERSIST_FORMAT_VERSION,
+        'dataset': FORECAST_DATASET,
+        'fetched_at': snapshot.fetched_at,
+        'cities': dict(snapshot.locations),
+    }
+    data = gzip.compress(
+        json.dumps(document, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.snapshot-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_snapshot(path: str = FORECAST_PERSIST_PATH):
+    """
+    讀取磁碟上的快照
+
+    Args:
+        path: 快照檔路徑
+
+    Returns:
+        ({縣市名稱: CityForecast}, fetched_at)；檔案不存在或格式不符時回傳 None
+    """
+    try:
+        with open(path, 'rb') as f:
+            document = json.loads(gzip.decompress(f.read()))
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable forecast snapshot {path}: {e}")
+        return None
+
+    if (document.get('format') != PERSIST_FORMAT_VERSION
+            or document.get('dataset') != FORECAST_DATASET):
+        print(f"Ignoring forecast snapshot with unknown format: {path}")
+        return None
+
+    locations = {
+        city: CityForecast.from_json(forecast)
+        for city, forecast in document['cities'].items()
+    }
+    return locations, document['fetched_at']
+
+
+def _save_after_load(snapshot):
+    try:
+        save_snapshot(snapshot)
+    except OSError as e:
+        print(f"Failed to persist forecast snapshot: {e}")
+
+
+def enable_snapshot_persistence(snapshot=forecast_snapshot) -> bool:
+    """
+    啟動時從磁碟載入快照，並在每次更新後寫回磁碟
+    （可用 FORECAST_PERSIST=0 停用）
+
+    已有資料（例如其他 worker 寫好的共用快照）時不會覆蓋。
+
+    Returns:
+        是否從磁碟載入了快照
+    """
+    if os.getenv('FORECAST_PERSIST', '1') == '0':
+        return False
+
+    snapshot.add_listener(_save_after_load)
+
+    if snapshot.locations:
+        return False
+
+    restored = load_snapshot()
+    if restored is None:
+        return False
+
+    locations, fetched_at = restored
+    snapshot.restore(locations, fetched_at, source='disk')
+    print(f"Forecast snapshot restored from disk ({len(locations)} cities)")
+    return True
@@ -0,0 +1,193 @@
+"""
+結構化日誌
+單行 JSON、遮蔽敏感欄位，寫入先進記憶體佇列再由背景執行緒輸出，
+request 執行緒不會因為 stdout 變慢而被卡住
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+# json（單行 JSON）或 text（原本的文字格式）
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+
+# 背景輸出佇列的上限，滿了就丟棄並計數（不阻塞 request）
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+
+# 會被遮蔽的欄位 / header 名稱（不分大小寫，- 與 _ 視為相同）
+LOG_REDACT_KEYS = frozenset(
+    key.strip().lower().replace('-', '_')
+    for key in os.getenv(
+        'LOG_REDACT_KEYS', 'x_line_signature,authorization,cookie,set_cookie'
+    ).split(',')
+    if key.strip()
+)
+
+REDACTED = '[REDACTED]'
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s [%(name)s] %(message)s"
+
+_listeners = []
+
+
+def redact(value):
+    """
+    遞迴遮蔽 dict 中的敏感欄位
+
+    Args:
+        value: 任意 JSON 可序列化的值
+
+    Returns:
+        遮蔽後的新值（不修改原本的物件）
+    """
+    if isinstance(value, dict):
+        return {
+            key: REDACTED if str(key).lower().replace('-', '_') in LOG_REDACT_KEYS
+            else redact(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [redact(item) for item in value]
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    """把 LogRecord 轉成單行 JSON（extra={'fields': {...}} 的欄位會合併進去）"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(redact(fields))
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """文字格式（TEXT_FORMAT），extra={'fields': {...}} 的欄位遮蔽後以 JSON 接在訊息之後"""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        message = super().formatMessage(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            message += ' ' + json.dumps(redact(fields), ensure_ascii=False,
+                                        separators=(',', ':'), default=str)
+        return message
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    佇列已滿時丟棄紀錄而不是阻塞或拋出例外
+
+    只在呼叫端凍結訊息與例外文字，JSON 序列化留給背景執行緒。
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 參數可能在之後被修改，先組好訊息；traceback 物件不跨執行緒傳遞
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def make_formatter() -> logging.Formatter:
+    """依 LOG_FORMAT 建立 formatter"""
+    if LOG_FORMAT == 'text':
+        return TextFormatter()
+    return JsonFormatter()
+
+
+def setup_logging(logger: logging.Logger, stream=None) -> NonBlockingQueueHandler:
+    """
+    讓 logger 改為經由佇列與背景執行緒輸出
+
+    Args:
+        logger: 要設定的 logger（例如 app.logger）
+        stream: 輸出目標，預設為 stdout
+
+    Returns:
+        掛在 logger 上的 NonBlockingQueueHandler
+    """
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(make_formatter())
+
+    queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    listener = QueueListener(queue_handler.queue, output, respect_handler_level=True)
+    listener.start()
+    _listeners.append(listener)
+
+    logger.handlers.clear()
+    logger.addHandler(queue_handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+    return queue_handler
+
+
+def log_fields(logger: logging.Logger, level: int, message: str, build,
+               sample_rate: float = 1.0) -> bool:
+    """
+    只在等級啟用且抽樣命中時才建立欄位並寫入
+
+    Args:
+        logger: logger
+        level: logging.INFO 等
+        message: 訊息
+        build: 回傳欄位 dict 的函式（未寫入時不會被呼叫）
+        sample_rate: 寫入比例，0 ~ 1
+
+    Returns:
+        是否有寫入
+    """
+    if not logger.isEnabledFor(level):
+        return False
+    if sample_rate < 1.0 and random.random() >= sample_rate:
+        return False
+    logger.log(level, message, extra={'fields': build()})
+    return True
+
+
+def _flush_listeners():
+    """行程結束前把佇列中的紀錄寫完"""
+    for listener in _listeners:
+        if listener._thread is not None:
+            listener.stop()
+
+
+def _restart_after_fork():
+    """fork 之後背景執行緒不會跟著複製，在子行程重新啟動"""
+    for listener in _listeners:
+        listener._thread = None
+        listener.start()
+
+
+atexit.register(_flush_listeners)
+os.register_at_fork(after_in_child=_restart_after_fork)
@@ -0,0 +1,491 @@
+"""
+鄉鎮市區預報（F-D0047，全台 22 縣市 368 個鄉鎮市區）
+整批下載後解析成欄式（columnar）索引：每個天氣因子一個 array，
+鄉鎮 r 的第 t 個時段位於 r * 時段數 + t；文字（天氣現象、舒適度）只存一次，欄位內存編號。
+查詢「鳳山」「板橋區」「高雄市鳳山區」時以名稱雜湊表 O(1) 找到列號，
+只為該鄉鎮組出預報，不會為了一則訊息走訪整份資料。
+"""
+import bisect
+import json
+import os
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta
+from typing import NamedTuple
+
+from linebot.v3.messaging import FlexMessage
+
+from city_resolver import normalize_key
+from cwa_stream import PayloadStream
+from forecast_refresher import ForecastRefresher
+from geo_index import LOCATION_MAX_DISTANCE_KM, GridIndex
+from metrics import CACHE_REQUESTS, observe_stage
+from weather_service import (
+    CWA_API_KEY,
+    CWA_STREAM_PARSE,
+    TOWNSHIP_MAX_PAYLOAD_MB,
+    ForecastPeriod,
+    city_resolver,
+    create_weather_flex_message,
+    fetch_township_payload,
+    fetch_township_payload_async,
+    format_data_age,
+    get_period_name
+)
+
+# 每個鄉鎮保留幾個 3 小時時段（預設 12 = 36 小時，決定欄位大小的上限）
+TOWNSHIP_FORECAST_PERIODS = int(os.getenv('TOWNSHIP_FORECAST_PERIODS', 12))
+
+# 溫度 / 降雨機率缺值
+MISSING = -128
+
+# 鄉鎮名稱的行政區後綴（「鳳山區」也可以只輸入「鳳山」）
+TOWNSHIP_SUFFIXES = ('區', '鎮', '鄉', '市')
+
+
+def _time(value: str) -> str:
+    """2026-10-18T18:00:00+08:00 -> 2026-10-18 18:00:00（與 F-C0032-001 相同格式）"""
+    return f"{value[:10]} {value[11:19]}"
+
+
+def _int(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return MISSING
+
+
+def _value_at(times: list, values: list, start: str, end: str):
+    """DataTime 型的因子（溫度、舒適度）：取時段內的第一筆"""
+    i = bisect.bisect_left(times, start)
+    if i < len(times) and times[i] < end:
+        return values[i]
+    return None
+
+
+class TownshipSlot(NamedTuple):
+    """單一鄉鎮的一個 3 小時時段"""
+    start: str
+    end: str
+    weather: str
+    rain: int       # 降雨機率，缺值為 None
+    temp: int       # 溫度，缺值為 None
+    comfort: str
+
+
+class TownshipForecast(NamedTuple):
+    """單一鄉鎮的預報"""
+    county: str
+    township: str
+    slots: tuple    # TownshipSlot
+
+
+class TownshipIndex:
+    """
+    全台鄉鎮預報的欄式索引（建立後只讀，更新時整個替換）
+
+    可以一次由解析後的 JSON 建立，也可以交給 PayloadStream 逐一 add 每個鄉鎮、最後 finish。
+
+    Args:
+        data: F-D0047-093 的 JSON 回應；None 表示之後以 add 逐一加入
+        periods: 每個鄉鎮保留的時段數
+    """
+
+    def __init__(self, data: dict = None, periods: int = TOWNSHIP_FORECAST_PERIODS):
+        self.periods = periods
+        self.counties = []          # 列號 -> 縣市
+        self.townships = []         # 列號 -> 鄉鎮市區
+        self.geocodes = array('L')
+        self.latitudes = array('f')
+        self.longitudes = array('f')
+        self.row_axis = array('H')  # 列號 -> 時間軸編號（同一縣市的鄉鎮共用時間軸）
+        self.axes = []              # 時間軸編號 -> ((start, end), ...)
+        self.weather = array('H')   # 文字編號
+        self.rain = array('b')
+        self.temp = array('b')
+        self.comfort = array('H')
+        self.texts = []
+        self.names = {}             # 名稱 key -> (列號, ...)
+        self.grid = None            # 代表點的網格索引（列號即點的編號）
+        self._text_ids = {}
+        self._axis_ids = {}
+
+        if data is not None:
+            for locations in data['records']['Locations']:
+                county = locations['LocationsName']
+                for location in locations['Location']:
+                    self._add_row(county, location)
+            self.finish()
+
+    def add(self, context: dict, location: dict):
+        """
+        加入一個鄉鎮（串流解析的 records.Locations[].Location[] 元素）
+
+        Args:
+            context: 外層的純量欄位，LocationsName 為縣市名稱
+            location: 鄉鎮的 JSON
+        """
+        self._add_row(context.get('LocationsName', ''), location)
+
+    def finish(self) -> 'TownshipIndex':
+        """全部加入後建立名稱索引與座標索引"""
+        self._build_names()
+        self.grid = GridIndex(self.latitudes, self.longitudes)
+        return self
+
+    def _text(self, value) -> int:
+        value = value or ''
+        text_id = self._text_ids.get(value)
+        if text_id is None:
+            text_id = self._text_ids[value] = len(self.texts)
+            self.texts.append(value)
+        return text_id
+
+    def _add_row(self, county: str, location: dict):
+        elements = {element['ElementName']: element['Time']
+                    for element in location['WeatherElement']}
+        slots = elements['天氣現象'][:self.periods]
+        axis = tuple((_time(slot['StartTime']), _time(slot['EndTime'])) for slot in slots)
+        axis_id = self._axis_ids.get(axis)
+        if axis_id is None:
+            axis_id = self._axis_ids[axis] = len(self.axes)
+            self.axes.append(axis)
+
+        rain = {slot['StartTime']: slot['ElementValue'][0].get('ProbabilityOfPrecipitation')
+                for slot in elements.get('3小時降雨機率', ())}
+        temp_slots = elements.get('溫度', ())
+        temp_times = [slot['DataTime'] for slot in temp_slots]
+        temps = [slot['ElementValue'][0].get('Temperature') for slot in temp_slots]
+        comfort_slots = elements.get('舒適度指數', ())
+        comfort_times = [slot['DataTime'] for slot in comfort_slots]
+        comforts = [slot['ElementValue'][0].get('ComfortIndexDescription') for slot in comfort_slots]
+
+        for slot in slots:
+            start, end = slot['StartTime'], slot['EndTime']
+            self.weather.append(self._text(slot['ElementValue'][0].get('Weather')))
+            self.rain.append(_int(rain.get(start)))
+            self.temp.append(_int(_value_at(temp_times, temps, start, end)))
+            self.comfort.append(self._text(_value_at(comfort_times, comforts, start, end)))
+        # 時段不足的鄉鎮補齊欄寬，列號與位置的對應維持固定
+        empty = self._text('')
+        for _ in range(self.periods - len(slots)):
+            self.weather.append(empty)
+            self.rain.append(MISSING)
+            self.temp.append(MISSING)
+            self.comfort.append(empty)
+
+        self.counties.append(county)
+        self.townships.append(location['LocationName'])
+        self.geocodes.append(max(_int(location.get('Geocode')), 0))
+        self.latitudes.append(float(location.get('Latitude') or 0))
+        self.longitudes.append(float(location.get('Longitude') or 0))
+        self.row_axis.append(axis_id)
+
+    def _build_names(self):
+        names = {}
+        for row, (county, township) in enumerate(zip(self.counties, self.townships)):
+            township_names = {township}
+            base = township[:-1]
+            # 「苗栗」「彰化」是縣名，不當成苗栗市、彰化市的簡稱
+            if (len(township) > 2 and township.endswith(TOWNSHIP_SUFFIXES)
+                    and not city_resolver.is_county_name(base)):
+                township_names.add(base)
+            keys = set()
+            for name in township_names:
+                keys.add(name)
+                keys.add(county + name)
+                keys.add(county[:-1] + name)
+            for key in keys:
+                names.setdefault(normalize_key(key), set()).add(row)
+        self.names = {key: tuple(sorted(rows)) for key, rows in names.items()}
+
+    def __len__(self):
+        return len(self.townships)
+
+    def lookup(self, text: str) -> tuple:
+        """
+        以名稱查詢列號
+
+        Args:
+            text: 例如「鳳山」「板橋區」「高雄市鳳山區」「台南東區」
+
+        Returns:
+            符合的列號，多個表示名稱重複（例如「東區」）
+        """
+        return self.names.get(normalize_key(text), ())
+
+    def nearest(self, lat: float, lon: float, max_km: float = LOCATION_MAX_DISTANCE_KM):
+        """
+        以經緯度查詢最近的鄉鎮（代表點最近者）
+
+        Args:
+            lat: 緯度
+            lon: 經度
+            max_km: 距離上限（公里）
+
+        Returns:
+            列號，超過距離上限時為 None
+        """
+        match = self.grid.nearest(lat, lon, max_km)
+        return match[0] if match else None
+
+    def name(self, row: int) -> str:
+        """縣市 + 鄉鎮名稱，例如「高雄市鳳山區」"""
+        return self.counties[row] + self.townships[row]
+
+    def get(self, row: int) -> TownshipForecast:
+        """
+        取得一個鄉鎮的預報（只讀取該列的欄位）
+
+        Args:
+            row: lookup 回傳的列號
+        """
+        axis = self.axes[self.row_axis[row]]
+        base = row * self.periods
+        slots = []
+        for t, (start, end) in enumerate(axis):
+            i = base + t
+            rain, temp = self.rain[i], self.temp[i]
+            slots.append(TownshipSlot(
+                start, end, self.texts[self.weather[i]],
+                None if rain == MISSING else rain,
+                None if temp == MISSING else temp,
+                self.texts[self.comfort[i]]))
+        return TownshipForecast(self.counties[row], self.townships[row], tuple(slots))
+
+    def nbytes(self) -> int:
+        """欄位、時間軸與文字表佔用的位元組（不含名稱索引）"""
+        columns = (self.geocodes, self.latitudes, self.longitudes, self.row_axis,
+                   self.weather, self.rain, self.temp, self.comfort)
+        size = sum(column.itemsize * len(column) for column in columns)
+        size += sum(len(start) + len(end) for axis in self.axes for start, end in axis)
+        size += sum(len(text.encode('utf-8')) for text in self.texts)
+        return size
+
+
+def _half_day(start: str) -> str:
+    """時段所屬的 12 小時區間（06:00～18:00、18:00～隔日 06:00）的開始時間"""
+    moment = datetime.strptime(start, '%Y-%m-%d %H:%M:%S')
+    if moment.hour < 6:
+        moment -= timedelta(days=1)
+        hour = 18
+    else:
+        hour = 6 if moment.hour < 18 else 18
+    return moment.strftime('%Y-%m-%d') + f' {hour:02d}'
+
+
+def summarize_periods(slots: tuple, count: int = 3) -> list:
+    """
+    把 3 小時時段合併成與縣市預報相同的 12 小時時段（供 Flex Message 使用）
+
+    - 溫度取最低 / 最高，降雨機率取最高
+    - 天氣現象取降雨機率最高的時段，舒適度取第一個時段
+
+    Args:
+        slots: TownshipSlot
+        count: 最多幾個 12 小時時段
+
+    Returns:
+        ForecastPeriod 列表
+    """
+    groups = []
+    for slot in slots:
+        key = _half_day(slot.start)
+        if not groups or groups[-1][0] != key:
+            if len(groups) == count:
+                break
+            groups.append((key, []))
+        groups[-1][1].append(slot)
+
+    periods = []
+    for i, (_, group) in enumerate(groups):
+        start, end = group[0].start, group[-1].end
+        label = get_period_name(start)
+        emoji, period = label.split(' ', 1)
+        # 與縣市預報相同：第 3 個時段如果是早上，加上「明天」
+        if i == 2 and period == "早上":
+            period = "明天" + period
+
+        temps = [slot.temp for slot in group if slot.temp is not None]
+        rains = [slot.rain for slot in group if slot.rain is not None]
+        wettest = max(group, key=lambda slot: -1 if slot.rain is None else slot.rain)
+        periods.append(ForecastPeriod(
+            start, end, label, emoji, period, wettest.weather, group[0].comfort,
+            str(min(temps)) if temps else '--', str(max(temps)) if temps else '--',
+            str(max(rains)) if rains else '0'))
+    return periods
+
+
+class TownshipSnapshot:
+    """
+    鄉鎮預報快照（由 ForecastRefresher 整批更新，介面與 ForecastSnapshot 相同）
+    """
+
+    def __init__(self):
+        self.locations = ()         # TownshipIndex，尚未載入時為空
+        self.fetched_at = 0.0
+        self.version = 0
+        self.background_refresh = False
+        self.last_error = None
+        self.parse_seconds = None
+        self._rendered = {}         # 列號 -> Flex JSON（換版時清空）
+        self._lock = threading.Lock()
+
+    def open_stream(self):
+        """
+        邊下載邊解析用的 PayloadStream：每收到一個鄉鎮就寫入欄位，不保留 JSON
+
+        Returns:
+            PayloadStream；CWA_STREAM_PARSE=0 時為 None
+        """
+        if not CWA_STREAM_PARSE:
+            return None
+        return PayloadStream(('records', 'Locations', '*', 'Location', '*'), TownshipIndex,
+                             max_bytes=int(TOWNSHIP_MAX_PAYLOAD_MB * 1024 * 1024),
+                             stage='township_parse')
+
+    def load(self, data: dict):
+        """
+        解析 F-D0047-093 回應並一次替換整個索引
+
+        Args:
+            data: F-D0047-093 的 JSON 回應
+        """
+        started = time.perf_counter()
+        with observe_stage('township_parse'):
+            index = TownshipIndex(data)
+        self._replace(index, time.perf_counter() - started)
+
+    def load_stream(self, stream: PayloadStream):
+        """
+        以串流解析完成的索引替換
+
+        Args:
+            stream: open_stream 建立、已讀完回應的 PayloadStream
+        """
+        self._replace(stream.result, stream.parse_seconds)
+
+    def _replace(self, index: TownshipIndex, parse_seconds: float):
+        self.parse_seconds = parse_seconds
+        with self._lock:
+            self.locations = index
+            self._rendered = {}
+        self.fetched_at = time.time()
+        self.last_error = None
+        self.version += 1
+
+    def mark_fresh(self):
+        """CWA 確認資料未變更"""
+        self.fetched_at = time.time()
+        self.last_error = None
+
+    def record_failure(self, error: Exception):
+        """記錄更新失敗，保留原本的資料繼續提供（之後的卡片標示資料年齡）"""
+        self.last_error = str(error)
+        with self._lock:
+            self._rendered = {}
+
+    def is_stale(self) -> bool:
+        """最近一次更新失敗、正在提供舊資料"""
+        return bool(self.locations) and self.last_error is not None
+
+    def lookup(self, text: str) -> tuple:
+        """以名稱查詢列號（尚未載入時一律找不到）"""
+        index = self.locations
+        return index.lookup(text) if index else ()
+
+    def nearest(self, lat: float, lon: float):
+        """以經緯度查詢最近的鄉鎮列號（尚未載入或超出範圍時為 None）"""
+        index = self.locations
+        return index.nearest(lat, lon) if index else None
+
+    def name(self, row: int) -> str:
+        """縣市 + 鄉鎮名稱"""
+        return self.locations.name(row)
+
+    def render(self, row: int):
+        """
+        取得鄉鎮的 Flex Message JSON bytes（每版每個鄉鎮只組裝一次）
+
+        Args:
+            row: lookup 回傳的列號
+
+        Returns:
+            JSON bytes；資料不完整時為 None
+        """
+        # 提供舊資料時每次重新組裝，卡片上的資料年齡才會跟著增加
+        index, stale = self.locations, self.is_stale()
+        with self._lock:
+            payload = self._rendered.get(row)
+        if payload is not None:
+            CACHE_REQUESTS.labels('township_render', 'hit').inc()
+            return payload
+
+        CACHE_REQUESTS.labels('township_render', 'miss').inc()
+        forecast = index.get(row)
+        periods = summarize_periods(forecast.slots)
+        if not periods:
+            return None
+        note = format_data_age(time.time() - self.fetched_at) if stale else None
+        flex_data = create_weather_flex_message(index.name(row), periods, note=note)
+        try:
+            FlexMessage.from_dict(flex_data)
+        except Exception as e:
+            print(f"Invalid flex message for {index.name(row)}: {e}")
+            return None
+
+        payload = json.dumps(flex_data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        if not stale:
+            with self._lock:
+                if self.locations is index:
+                    self._rendered[row] = payload
+        return payload
+
+    def status(self) -> dict:
+        """快照狀態，供 /health 顯示"""
+        index = self.locations
+        return {
+            'version': self.version,
+            'townships': len(index),
+            'periods': index.periods if index else None,
+            'bytes': index.nbytes() if index else 0,
+            'parse_seconds': None if self.parse_seconds is None else round(self.parse_seconds, 3),
+            'age_seconds': round(time.time() - self.fetched_at) if index else None,
+            'stale': self.is_stale(),
+            'last_error': self.last_error,
+        }
+
+
+# 全域快照與更新器（各 worker 各自更新；資料只在每次發布後下載一次）
+township_snapshot = TownshipSnapshot()
+township_refresher = ForecastRefresher(
+    township_snapshot, fetch=fetch_township_payload,
+    fetch_async=fetch_township_payload_async, name='township-refresher')
+
+
+def township_enabled() -> bool:
+    """TOWNSHIP_FORECAST=0 時停用鄉鎮預報"""
+    return os.getenv('TOWNSHIP_FORECAST', '1') != '0' and bool(CWA_API_KEY)
+
+
+def start_township_refresher() -> bool:
+    """
+    啟動鄉鎮預報的背景更新
+
+    Returns:
+        是否已啟動
+    """
+    if not township_enabled():
+        return False
+    township_refresher.start()
+    return True
+
+
+def _restart_after_fork():
+    """fork 之後在子行程重新啟動更新器"""
+    if township_refresher._pid is not None:
+        start_township_refresher()
+
+
+os.register_at_fork(after_in_child=_restart_after_fork)
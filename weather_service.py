@@ -1,13 +1,33 @@
 import requests
+import asyncio
+import json
 import os
-from datetime import datetime
+import random
+import threading
+import time
+from typing import NamedTuple
+import aiohttp
 from dotenv import load_dotenv
+from http_pool import get_http_session
+from singleflight import SingleFlight
+from city_resolver import CityResolver
+from cwa_stream import STREAM_CHUNK_SIZE, PayloadStream
+from metrics import (
+    BREAKER_TRIPS,
+    CACHE_REQUESTS,
+    CITY_RESOLVE,
+    UPSTREAM_REQUESTS,
+    observe_stage,
+    timed_stage
+)
 
 load_dotenv()
 
 CWA_API_KEY = os.getenv('CWA_API_KEY')
 cwa_api_key = CWA_API_KEY  # 別名，供類別使用
-CWA_API_URL = "https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-C0032-001"
+FORECAST_DATASET = 'F-C0032-001'
+CWA_API_BASE = os.getenv('CWA_API_BASE', 'https://opendata.cwa.gov.tw/api/v1/rest/datastore')
+CWA_API_URL = f"{CWA_API_BASE}/{FORECAST_DATASET}"
 
 # 支援的縣市列表
 SUPPORTED_CITIES = [
@@ -17,6 +37,50 @@ SUPPORTED_CITIES = [
     '臺東縣', '澎湖縣', '金門縣', '連江縣'
 ]
 
+# 縣市名稱解析索引（別名雜湊表 + 編輯距離的 symmetric deletion 索引），import 時建立
+city_resolver = CityResolver(SUPPORTED_CITIES)
+
+# 鄉鎮市區預報：F-D0047-093 一次取得多個縣市的 F-D0047 資料集（各縣市 3 天逐 3 小時預報）
+TOWNSHIP_DATASET = 'F-D0047-093'
+TOWNSHIP_DATASETS = {
+    '宜蘭縣': 'F-D0047-001', '桃園市': 'F-D0047-005', '新竹縣': 'F-D0047-009',
+    '苗栗縣': 'F-D0047-013', '彰化縣': 'F-D0047-017', '南投縣': 'F-D0047-021',
+    '雲林縣': 'F-D0047-025', '嘉義縣': 'F-D0047-029', '屏東縣': 'F-D0047-033',
+    '臺東縣': 'F-D0047-037', '花蓮縣': 'F-D0047-041', '澎湖縣': 'F-D0047-045',
+    '基隆市': 'F-D0047-049', '新竹市': 'F-D0047-053', '嘉義市': 'F-D0047-057',
+    '臺北市': 'F-D0047-061', '高雄市': 'F-D0047-065', '新北市': 'F-D0047-069',
+    '臺中市': 'F-D0047-073', '臺南市': 'F-D0047-077', '連江縣': 'F-D0047-081',
+    '金門縣': 'F-D0047-085',
+}
+
+# 只要求用得到的天氣因子（整份資料集有十多個因子，全部下載大上數倍）
+TOWNSHIP_ELEMENTS = ('天氣現象', '3小時降雨機率', '溫度', '舒適度指數')
+
+# 鄉鎮預報回應的大小上限（MB），超過視為異常不解析
+TOWNSHIP_MAX_PAYLOAD_MB = float(os.getenv('TOWNSHIP_MAX_PAYLOAD_MB', 64))
+
+# 即時觀測：O-A0001-001 自動氣象站（數百個測站，每 10 分鐘更新）；O-A0003-001 為局屬測站
+OBSERVATION_DATASET = os.getenv('OBSERVATION_DATASET', 'O-A0001-001')
+
+# 背景更新時邊下載邊解析（0 = 下載完整回應後再 json.loads）
+CWA_STREAM_PARSE = os.getenv('CWA_STREAM_PARSE', '1') != '0'
+
+# 全台預報快照的有效秒數（逾時才重新向 CWA 取得）
+FORECAST_SNAPSHOT_TTL = int(os.getenv('FORECAST_SNAPSHOT_TTL', 600))
+
+# CWA 請求逾時（連線, 讀取）秒數
+CWA_TIMEOUT = (
+    float(os.getenv('CWA_CONNECT_TIMEOUT', 3)),
+    float(os.getenv('CWA_READ_TIMEOUT', 10))
+)
+
+# CWA 請求失敗時的最多重試次數（不含第一次）
+CWA_MAX_RETRIES = int(os.getenv('CWA_MAX_RETRIES', 2))
+
+# 斷路器：連續失敗幾次後跳脫、跳脫後幾秒再試探
+CWA_BREAKER_THRESHOLD = int(os.getenv('CWA_BREAKER_THRESHOLD', 5))
+CWA_BREAKER_RESET_TIMEOUT = int(os.getenv('CWA_BREAKER_RESET_TIMEOUT', 60))
+
 
 def format_supported_cities_list() -> str:
     """
@@ -46,27 +110,35 @@ def format_supported_cities_list() -> str:
 
 def normalize_city_name(city_input: str) -> str:
     """
-    正規化城市名稱（處理台/臺的差異）
+    正規化城市名稱（台/臺、簡稱、英文 / 拼音、舊縣名與打錯字）
 
     Args:
         city_input: 使用者輸入的城市名稱
 
     Returns:
-        正規化後的城市名稱
+        支援的縣市全名；無法判斷時為（台 → 臺）後的原輸入
     """
-    # 將「台」統一替換成「臺」
-    normalized = city_input.replace('台', '臺')
+    match = city_resolver.resolve(city_input)
+    if match is None:
+        CITY_RESOLVE.labels('miss').inc()
+        return city_input.strip().replace('台', '臺')
+    CITY_RESOLVE.labels(match.method).inc()
+    return match.city
 
-    # 如果沒有「市」或「縣」後綴，嘗試加上
-    if not (normalized.endswith('市') or normalized.endswith('縣')):
-        # 先嘗試加「市」
-        if f"{normalized}市" in SUPPORTED_CITIES:
-            return f"{normalized}市"
-        # 再嘗試加「縣」
-        elif f"{normalized}縣" in SUPPORTED_CITIES:
-            return f"{normalized}縣"
 
-    return normalized
+def _period_name_for_hour(hour: int) -> str:
+    if 5 <= hour < 12:
+        return "🌅 早上"
+    elif 12 <= hour < 18:
+        return "☀️ 白天"
+    elif 18 <= hour < 24:
+        return "🌃 晚上"
+    else:
+        return "🌙 凌晨"
+
+
+# 0~23 時對應的時段名稱，import 時算好，解析時直接查表
+PERIOD_NAMES_BY_HOUR = tuple(_period_name_for_hour(hour) for hour in range(24))
 
 
 def get_period_name(start_time: str) -> str:
@@ -79,15 +151,713 @@ def get_period_name(start_time: str) -> str:
     Returns:
         帶有 emoji 的時段名稱
     """
-    hour = datetime.strptime(start_time, "%Y-%m-%d %H:%M:%S").hour
-    if 5 <= hour < 12:
-        return "🌅 早上"
-    elif 12 <= hour < 18:
-        return "☀️ 白天"
-    elif 18 <= hour < 24:
-        return "🌃 晚上"
-    else:
-        return "🌙 凌晨"
+    # 格式固定，直接取小時欄位，不需要 strptime
+    return PERIOD_NAMES_BY_HOUR[int(start_time[11:13])]
+
+
+# 36 小時預報的時段數
+FORECAST_PERIOD_COUNT = 3
+
+
+class ForecastPeriod(NamedTuple):
+    """單一預報時段（所有輸出格式共用的解析結果）"""
+    start: str        # 開始時間 YYYY-MM-DD HH:MM:SS
+    end: str          # 結束時間
+    label: str        # 帶 emoji 的時段名稱，例如「🌅 早上」
+    emoji: str        # 時段 emoji
+    period: str       # 不含 emoji 的時段文字，例如「明天早上」
+    weather: str      # 天氣現象 (Wx)
+    comfort: str      # 舒適度 (CI)
+    min_temp: str     # 最低溫 (MinT)
+    max_temp: str     # 最高溫 (MaxT)
+    rain: str         # 降雨機率 (PoP)
+
+
+class CityForecast(NamedTuple):
+    """單一縣市的 36 小時預報"""
+    name: str
+    periods: tuple    # ForecastPeriod
+
+    @classmethod
+    def from_json(cls, data: list) -> 'CityForecast':
+        """
+        由 JSON 還原（NamedTuple 經 json.dumps 後為巢狀 list）
+
+        Args:
+            data: [name, [[start, end, ...], ...]]
+        """
+        name, periods = data
+        return cls(name, tuple(ForecastPeriod(*period) for period in periods))
+
+
+def parse_location(location: dict) -> CityForecast:
+    """
+    將 CWA 單一 location 解析為 CityForecast（每個元素只走訪一次）
+
+    Args:
+        location: records.location 中的一筆資料
+
+    Returns:
+        CityForecast
+    """
+    times = None
+    values = {}
+    for element in location['weatherElement']:
+        slots = element['time'][:FORECAST_PERIOD_COUNT]
+        if element['elementName'] == 'Wx':
+            times = [(slot['startTime'], slot['endTime']) for slot in slots]
+        values[element['elementName']] = [
+            slot['parameter']['parameterName'] for slot in slots]
+
+    periods = []
+    rows = zip(times, values['Wx'], values['CI'],
+               values['MinT'], values['MaxT'], values['PoP'])
+    for i, ((start, end), wx, ci, min_t, max_t, pop) in enumerate(rows):
+        label = get_period_name(start)
+        emoji, period = label.split(' ', 1)
+
+        # 第 3 個時段(索引 2)如果是"早上",加上"明天"前綴
+        if i == 2 and period == "早上":
+            period = "明天" + period
+
+        periods.append(ForecastPeriod(
+            start, end, label, emoji, period, wx, ci, min_t, max_t, pop))
+
+    return CityForecast(location['locationName'], tuple(periods))
+
+
+class CityForecastCollector(dict):
+    """串流解析 F-C0032-001：每收到一個 location 就轉成 CityForecast（供 PayloadStream 使用）"""
+
+    def add(self, context: dict, location: dict):
+        self[location['locationName']] = parse_location(location)
+
+    def finish(self) -> dict:
+        return self
+
+
+def parse_forecast_payload(data: dict) -> dict:
+    """
+    解析 F-C0032-001 回應
+
+    Args:
+        data: F-C0032-001 的 JSON 回應
+
+    Returns:
+        {縣市名稱: CityForecast}
+    """
+    return {
+        location['locationName']: parse_location(location)
+        for location in data['records']['location']
+    }
+
+
+def format_data_age(seconds: float) -> str:
+    """
+    將資料年齡格式化為提示文字
+
+    Args:
+        seconds: 距離資料取得的秒數
+
+    Returns:
+        例如「資料更新於 25 分鐘前」
+    """
+    minutes = int(seconds // 60)
+    if minutes < 60:
+        return f"資料更新於 {max(minutes, 1)} 分鐘前"
+    return f"資料更新於 {minutes // 60} 小時前"
+
+
+class CircuitOpenError(Exception):
+    """斷路器跳脫中，暫停呼叫上游"""
+
+
+class CircuitBreaker:
+    """
+    簡易斷路器
+
+    - closed: 正常呼叫，連續失敗達門檻後轉為 open
+    - open: 直接拒絕呼叫，不必等待逾時；經過 reset_timeout 後轉為 half_open
+    - half_open: 只放行一個試探請求，成功則回到 closed，失敗則再次 open
+    """
+
+    def __init__(self, name: str, threshold: int = CWA_BREAKER_THRESHOLD,
+                 reset_timeout: int = CWA_BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self.trips = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """是否允許送出請求"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+
+            if self.state == 'open':
+                if time.time() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = 'half_open'
+
+            # half_open：同一時間只放行一個試探請求
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        """請求成功"""
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def release(self):
+        """
+        請求結束（於 finally 呼叫）：試探請求因其他例外（例如解析錯誤）沒有記錄成功或失敗時，
+        釋放試探名額，避免斷路器一直停在 half_open
+        """
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        """請求失敗"""
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == 'half_open' or self.failures >= self.threshold:
+                if self.state != 'open':
+                    self.trips += 1
+                    BREAKER_TRIPS.labels(self.name).inc()
+                self.state = 'open'
+                self.opened_at = time.time()
+
+    def status(self) -> dict:
+        """斷路器狀態，供 /health 顯示"""
+        retry_in = None
+        if self.state == 'open':
+            retry_in = max(
+                0, round(self.reset_timeout - (time.time() - self.opened_at)))
+        return {
+            'state': self.state,
+            'consecutive_failures': self.failures,
+            'trips': self.trips,
+            'retry_in_seconds': retry_in,
+        }
+
+
+# CWA API 的斷路器：每個資料集各一個，鄉鎮預報或觀測的大檔案逾時不會擋住縣市預報
+cwa_breaker = CircuitBreaker('cwa')
+township_breaker = CircuitBreaker('cwa_township')
+observation_breaker = CircuitBreaker('cwa_observation')
+
+# 合併同時發生的相同查詢，key 為 (資料集, 城市)
+forecast_flight = SingleFlight('forecast')
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 4.0) -> float:
+    """
+    指數退避加上 full jitter，避免多個 worker 同時重試
+
+    Args:
+        attempt: 第幾次重試（從 0 開始）
+
+    Returns:
+        等待秒數
+    """
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def _read_stream(response: requests.Response, sink: PayloadStream):
+    """把回應內容分段交給 sink（304 沒有內容），讀完後釋放連線"""
+    try:
+        response.raise_for_status()
+        if response.status_code != 304:
+            sink.reset()
+            for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+                sink.feed(chunk)
+            sink.close()
+    finally:
+        response.close()
+
+
+def fetch_forecast_payload(headers: dict = None, dataset: str = FORECAST_DATASET,
+                           params: dict = None, sink: PayloadStream = None,
+                           breaker: CircuitBreaker = None) -> requests.Response:
+    """
+    呼叫 F-C0032-001 取得全台 22 縣市的預報（不帶 locationName）
+
+    經過斷路器保護，逾時或 5xx 時以 jitter 退避重試，最多 CWA_MAX_RETRIES 次。
+
+    Args:
+        headers: 額外的 HTTP headers（例如條件式請求的 If-None-Match）
+        dataset: 資料集代碼（預設 F-C0032-001）
+        params: 額外的查詢參數（例如 locationId、ElementName）
+        sink: 指定時邊下載邊解析（回應內容交給 sink，不保留在 response.content）
+        breaker: 這個資料集的斷路器（預設 cwa_breaker）
+
+    Returns:
+        requests.Response，狀態碼為 2xx 或 304
+
+    Raises:
+        CircuitOpenError: 斷路器跳脫中
+        requests.exceptions.RequestException: 重試後仍失敗
+        ValueError: 串流解析時回應格式錯誤或超過大小上限
+    """
+    breaker = breaker or cwa_breaker
+    for attempt in range(CWA_MAX_RETRIES + 1):
+        if not breaker.allow():
+            UPSTREAM_REQUESTS.labels('cwa', 'circuit_open').inc()
+            raise CircuitOpenError(f"{breaker.name} circuit breaker is open")
+
+        try:
+            # 禁用 SSL 驗證以避免 GitHub Actions 環境的憑證問題
+            with observe_stage('cwa_request'):
+                response = get_http_session().get(
+                    f"{CWA_API_BASE}/{dataset}",
+                    params={'Authorization': CWA_API_KEY, **(params or {})},
+                    headers=headers,
+                    timeout=CWA_TIMEOUT,
+                    verify=False,
+                    stream=sink is not None
+                )
+            if sink is None:
+                response.raise_for_status()
+            else:
+                # 讀取途中斷線（ChunkedEncodingError 等）與連線失敗一樣重試
+                with observe_stage('cwa_stream'):
+                    _read_stream(response, sink)
+        except requests.exceptions.RequestException as e:
+            breaker.record_failure()
+            UPSTREAM_REQUESTS.labels(
+                'cwa', 'timeout' if isinstance(e, requests.exceptions.Timeout) else 'error').inc()
+
+            # 4xx（例如授權碼錯誤）重試也不會成功
+            status = getattr(e.response, 'status_code', None)
+            retryable = status is None or status >= 500
+            if not retryable or attempt == CWA_MAX_RETRIES:
+                raise
+            time.sleep(backoff_delay(attempt))
+            continue
+        except ValueError:
+            # 串流解析發現內容有誤（格式錯誤、超過大小上限）：上游有回應，重試也不會變
+            breaker.record_success()
+            UPSTREAM_REQUESTS.labels('cwa', 'ok').inc()
+            raise
+        else:
+            breaker.record_success()
+            UPSTREAM_REQUESTS.labels('cwa', 'ok').inc()
+            return response
+        finally:
+            # 其他例外（KeyError 等）不會經過上面的紀錄，試探名額在這裡釋放
+            breaker.release()
+
+
+class CWAResponse(NamedTuple):
+    """aiohttp 回應的最小封裝，欄位名稱與 requests.Response 相同"""
+    status_code: int
+    content: bytes
+    headers: dict
+
+    def json(self):
+        return json.loads(self.content)
+
+
+async def fetch_forecast_payload_async(session: aiohttp.ClientSession, headers: dict = None,
+                                       dataset: str = FORECAST_DATASET,
+                                       params: dict = None,
+                                       sink: PayloadStream = None,
+                                       breaker: CircuitBreaker = None) -> CWAResponse:
+    """
+    fetch_forecast_payload 的 asyncio 版本（與同步版本共用斷路器與重試策略）
+
+    Args:
+        session: aiohttp ClientSession
+        headers: 額外的 HTTP headers（例如條件式請求的 If-None-Match）
+        dataset: 資料集代碼（預設 F-C0032-001）
+        params: 額外的查詢參數
+        sink: 指定時邊下載邊解析（CWAResponse.content 為空）
+        breaker: 這個資料集的斷路器（預設 cwa_breaker）
+
+    Returns:
+        CWAResponse，狀態碼為 2xx 或 304
+
+    Raises:
+        CircuitOpenError: 斷路器跳脫中
+        aiohttp.ClientError / asyncio.TimeoutError: 重試後仍失敗
+        ValueError: 串流解析時回應格式錯誤或超過大小上限
+    """
+    timeout = aiohttp.ClientTimeout(sock_connect=CWA_TIMEOUT[0], sock_read=CWA_TIMEOUT[1])
+
+    breaker = breaker or cwa_breaker
+    for attempt in range(CWA_MAX_RETRIES + 1):
+        if not breaker.allow():
+            UPSTREAM_REQUESTS.labels('cwa', 'circuit_open').inc()
+            raise CircuitOpenError(f"{breaker.name} circuit breaker is open")
+
+        try:
+            # 與同步版本相同，不驗證 SSL 憑證
+            with observe_stage('cwa_request'):
+                async with session.get(
+                    f"{CWA_API_BASE}/{dataset}",
+                    params={'Authorization': CWA_API_KEY, **(params or {})},
+                    headers=headers,
+                    timeout=timeout,
+                    ssl=False
+                ) as r:
+                    r.raise_for_status()
+                    if sink is None:
+                        content = await r.read()
+                    else:
+                        # 每段只解析一次，不會像 json.loads 整份回應那樣長時間佔住 event loop
+                        content = b''
+                        if r.status != 304:
+                            sink.reset()
+                            async for chunk in r.content.iter_chunked(STREAM_CHUNK_SIZE):
+                                sink.feed(chunk)
+                            sink.close()
+                    response = CWAResponse(r.status, content, dict(r.headers))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            breaker.record_failure()
+            UPSTREAM_REQUESTS.labels(
+                'cwa', 'timeout' if isinstance(e, asyncio.TimeoutError) else 'error').inc()
+
+            # 4xx（例如授權碼錯誤）重試也不會成功
+            status = getattr(e, 'status', None)
+            retryable = status is None or status >= 500
+            if not retryable or attempt == CWA_MAX_RETRIES:
+                raise
+            await asyncio.sleep(backoff_delay(attempt))
+            continue
+        except ValueError:
+            breaker.record_success()
+            UPSTREAM_REQUESTS.labels('cwa', 'ok').inc()
+            raise
+        else:
+            breaker.record_success()
+            UPSTREAM_REQUESTS.labels('cwa', 'ok').inc()
+            return response
+        finally:
+            # 其他例外（KeyError 等）不會經過上面的紀錄，試探名額在這裡釋放
+            breaker.release()
+
+
+def _township_params() -> dict:
+    return {
+        'locationId': ','.join(TOWNSHIP_DATASETS.values()),
+        'ElementName': ','.join(TOWNSHIP_ELEMENTS),
+    }
+
+
+def _check_payload_size(content: bytes):
+    if len(content) > TOWNSHIP_MAX_PAYLOAD_MB * 1024 * 1024:
+        raise ValueError(f"township payload too large: {len(content)} bytes")
+
+
+def fetch_township_payload(headers: dict = None, sink: PayloadStream = None) -> requests.Response:
+    """
+    一次取得全台 22 縣市、368 個鄉鎮市區的預報（F-D0047-093，只帶需要的天氣因子）
+
+    Args:
+        headers: 條件式請求的 headers
+        sink: 指定時邊下載邊解析（大小上限由 sink 的 max_bytes 檢查）
+
+    Returns:
+        requests.Response，狀態碼為 2xx 或 304
+
+    Raises:
+        ValueError: 回應超過 TOWNSHIP_MAX_PAYLOAD_MB
+    """
+    response = fetch_forecast_payload(
+        headers, TOWNSHIP_DATASET, _township_params(), sink, township_breaker)
+    if sink is None:
+        _check_payload_size(response.content)
+    return response
+
+
+async def fetch_township_payload_async(session: aiohttp.ClientSession, headers: dict = None,
+                                       sink: PayloadStream = None) -> CWAResponse:
+    """fetch_township_payload 的 asyncio 版本"""
+    response = await fetch_forecast_payload_async(
+        session, headers, TOWNSHIP_DATASET, _township_params(), sink, township_breaker)
+    if sink is None:
+        _check_payload_size(response.content)
+    return response
+
+
+def fetch_observation_payload(headers: dict = None, sink: PayloadStream = None) -> requests.Response:
+    """
+    一次取得全部測站的即時觀測（OBSERVATION_DATASET）
+
+    Args:
+        headers: 條件式請求的 headers
+        sink: 指定時邊下載邊解析
+
+    Returns:
+        requests.Response，狀態碼為 2xx 或 304
+    """
+    return fetch_forecast_payload(headers, OBSERVATION_DATASET, None, sink, observation_breaker)
+
+
+async def fetch_observation_payload_async(session: aiohttp.ClientSession, headers: dict = None,
+                                          sink: PayloadStream = None) -> CWAResponse:
+    """fetch_observation_payload 的 asyncio 版本"""
+    return await fetch_forecast_payload_async(
+        session, headers, OBSERVATION_DATASET, None, sink, observation_breaker)
+
+
+class ForecastSnapshot:
+    """
+    全台 36 小時預報快照
+
+    一次呼叫 F-C0032-001（不帶 locationName）取得全部 22 個縣市，
+    解析後建立「縣市名稱 -> CityForecast」索引，之後的查詢都直接讀取索引，
+    不再為每則訊息呼叫 CWA 或重新解析 JSON。
+    """
+
+    def __init__(self, ttl: int = FORECAST_SNAPSHOT_TTL):
+        self.ttl = ttl
+        self.locations = {}     # 縣市名稱 -> CityForecast
+        self.fetched_at = 0.0   # 最後一次成功取得的時間 (time.time())
+        self.version = 0        # 資料變更時遞增（不論來源為 CWA、磁碟或共用快照檔，只增不減）
+        self.generation = None  # 目前資料在共用快照檔中的 generation（不是來自共用快照檔時為 None）
+        self.background_refresh = False  # 由背景更新器負責時，查詢不再同步呼叫 CWA
+        self.last_error = None  # 最近一次更新失敗的原因（成功後清除）
+        self.shared_store = None  # 跨 worker 共用的快照檔（見 shared_forecast_store）
+        self.source = None  # 資料來源：'cwa'（向 CWA 取得）或 'disk'（啟動時從磁碟載入）
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._revalidating = False
+
+    def is_expired(self) -> bool:
+        """快照是否已過期（或尚未載入）"""
+        return not self.locations or time.time() - self.fetched_at > self.ttl
+
+    def age(self):
+        """
+        目前資料距離最後一次成功取得的秒數
+
+        Returns:
+            秒數，尚未載入時回傳 None
+        """
+        if not self.locations:
+            return None
+        return time.time() - self.fetched_at
+
+    def is_stale(self) -> bool:
+        """最近一次更新失敗、正在提供舊資料"""
+        return bool(self.locations) and self.last_error is not None
+
+    def record_failure(self, error: Exception):
+        """記錄更新失敗，保留原本的資料繼續提供"""
+        self.last_error = str(error)
+        if self.shared_store is not None:
+            self.shared_store.record_failure(self.last_error)
+
+    def attach_store(self, store):
+        """
+        改由跨 worker 共用的快照檔提供資料
+
+        Args:
+            store: shared_forecast_store.SharedForecastStore
+        """
+        self.shared_store = store
+        self.sync_from_store(force=True)
+
+    def sync_from_store(self, force: bool = False):
+        """共用快照檔換版時，切換到新版本（只換參照，不複製資料）"""
+        store = self.shared_store
+        if store is not None and store.refresh(force=force) and store.view is not None:
+            # 只更新取得時間或錯誤時 generation 不變，不必換版
+            # （version 不直接沿用 generation：磁碟載入的版本可能與共用快照檔的 generation 重複）
+            if store.generation != self.generation:
+                self.locations = store.view
+                self.source = 'cwa'
+                self.generation = store.generation
+                self.version += 1
+            self.fetched_at = store.fetched_at
+            self.last_error = store.last_error
+
+    def status(self) -> dict:
+        """快照狀態，供 /health 顯示"""
+        age = self.age()
+        status = {
+            'source': self.source,
+            'version': self.version,
+            'generation': self.generation,
+            'cities': len(self.locations),
+            'age_seconds': None if age is None else round(age),
+            'stale': self.is_stale(),
+            'last_error': self.last_error,
+        }
+        if self.shared_store is not None:
+            status['shared_store'] = self.shared_store.status()
+        return status
+
+    def open_stream(self):
+        """
+        邊下載邊解析用的 PayloadStream（交給 fetch_forecast_payload 的 sink）
+
+        Returns:
+            PayloadStream；CWA_STREAM_PARSE=0 時為 None（改為整份 json.loads）
+        """
+        if not CWA_STREAM_PARSE:
+            return None
+        return PayloadStream(('records', 'location', '*'), CityForecastCollector,
+                             stage='forecast_parse')
+
+    def load(self, data: dict):
+        """
+        解析 CWA 回應並一次替換整個索引
+
+        Args:
+            data: F-C0032-001 的 JSON 回應
+        """
+        # 每個縣市只在更新時解析一次
+        with observe_stage('forecast_parse'):
+            locations = parse_forecast_payload(data)
+        self._replace(locations)
+
+    def load_stream(self, stream: PayloadStream):
+        """
+        以串流解析完成的結果替換整個索引
+
+        Args:
+            stream: open_stream 建立、已讀完回應的 PayloadStream
+        """
+        self._replace(stream.result)
+
+    def _replace(self, locations: dict):
+        # 一次替換整個索引，讀取端不會看到更新到一半的資料
+        self.locations = locations
+        self.source = 'cwa'
+        self.fetched_at = time.time()
+        self.last_error = None
+
+        if self.shared_store is not None:
+            self.shared_store.publish(locations, self.fetched_at)
+            self.generation = self.shared_store.generation
+        self.version += 1
+
+        for listener in self._listeners:
+            listener(self)
+
+    def restore(self, locations: dict, fetched_at: float, source: str):
+        """
+        載入先前保存的快照（不通知 listener、不寫入共用快照檔）
+
+        Args:
+            locations: {縣市名稱: CityForecast}
+            fetched_at: 原本的取得時間（用來計算資料年齡）
+            source: 資料來源，例如 'disk'
+        """
+        self.locations = locations
+        self.fetched_at = fetched_at
+        self.source = source
+        self.generation = None
+        self.version += 1
+
+    def add_listener(self, listener):
+        """
+        註冊快照更新後的回呼
+
+        Args:
+            listener: 接收 ForecastSnapshot 的函式（例如寫入磁碟）
+        """
+        self._listeners.append(listener)
+
+    def mark_fresh(self):
+        """CWA 確認資料未變更時，更新快照的取得時間"""
+        self.fetched_at = time.time()
+        self.last_error = None
+
+        if self.shared_store is not None:
+            self.shared_store.touch(self.fetched_at)
+
+    def refresh(self) -> bool:
+        """
+        向 CWA 取得全台預報並重建索引
+
+        Returns:
+            是否成功更新快照
+        """
+        if not CWA_API_KEY:
+            print("Warning: CWA_API_KEY not set")
+            return False
+
+        try:
+            stream = self.open_stream()
+            response = fetch_forecast_payload(sink=stream)
+            if stream is None:
+                self.load(response.json())
+            else:
+                self.load_stream(stream)
+        except Exception as e:
+            print(f"Failed to refresh forecast snapshot: {e}")
+            self.record_failure(e)
+            return False
+
+        return True
+
+    def _revalidate(self):
+        try:
+            self.refresh()
+        finally:
+            self._revalidating = False
+
+    def revalidate_in_background(self):
+        """在背景執行緒更新快照（同一時間只會有一個）"""
+        with self._lock:
+            if self._revalidating:
+                return
+            self._revalidating = True
+
+        threading.Thread(
+            target=self._revalidate, name='forecast-revalidate', daemon=True
+        ).start()
+
+    def get(self, city_name: str):
+        """
+        取得指定縣市的預報資料
+
+        未啟用背景更新器時採 stale-while-revalidate：
+        完全沒有資料才同步等待 CWA，已有資料但過期時先回傳舊資料，
+        同時在背景更新。啟用背景更新器後一律直接讀取目前的索引
+        （使用共用快照檔時，先確認是否有其他 worker 寫入的新版本）。
+
+        Args:
+            city_name: 正規化後的縣市名稱
+
+        Returns:
+            CityForecast，找不到時回傳 None
+        """
+        if self.shared_store is not None:
+            self.sync_from_store()
+
+        if not self.background_refresh:
+            if not self.locations:
+                # 同時冷啟動的查詢共用同一次全台請求
+                forecast_flight.do((FORECAST_DATASET, '*'), self.refresh)
+            elif self.is_expired():
+                self.revalidate_in_background()
+
+        forecast = self.locations.get(city_name)
+        if forecast is None:
+            CACHE_REQUESTS.labels('forecast_snapshot', 'miss').inc()
+        else:
+            CACHE_REQUESTS.labels(
+                'forecast_snapshot', 'stale' if self.is_stale() else 'hit').inc()
+        return forecast
+
+
+# 全域快照，供 get_weather 與 WeatherForecast 共用
+forecast_snapshot = ForecastSnapshot()
 
 
 def get_weather(city_name: str) -> str:
@@ -113,58 +883,28 @@ def get_weather(city_name: str) -> str:
         return f"❌ 找不到「{city_name}」的天氣資料\n\n{cities_formatted}"
 
     try:
-        # 呼叫中央氣象署 API
-        params = {
-            'Authorization': CWA_API_KEY,
-            'locationName': location
-        }
-
-        response = requests.get(CWA_API_URL, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-
-        # 解析資料
-        location_data = data['records']['location'][0]
-        location_name = location_data['locationName']
-        elements = location_data['weatherElement']
-
-        # 建立元素對照表
-        element_map = {el['elementName']: el['time'] for el in elements}
+        # 從全台預報快照取得解析好的預報
+        forecast = forecast_snapshot.get(location)
+        if forecast is None:
+            return "⚠️ 暫時無法取得天氣資料，請稍後再試"
 
         # 格式化訊息
-        lines = [f"📍 {location_name} 36 小時天氣預報"]
-
-        # 取得三個時段的預報
-        for i in range(3):
-            start = element_map['Wx'][i]['startTime']
-            end = element_map['Wx'][i]['endTime']
-            period = get_period_name(start)
-
-            # 天氣現象
-            wx = element_map['Wx'][i]['parameter']['parameterName']
-            # 舒適度
-            ci = element_map['CI'][i]['parameter']['parameterName']
-            # 最低溫
-            minT = element_map['MinT'][i]['parameter']['parameterName']
-            # 最高溫
-            maxT = element_map['MaxT'][i]['parameter']['parameterName']
-            # 降雨機率
-            pop = element_map['PoP'][i]['parameter']['parameterName']
+        lines = [f"📍 {forecast.name} 36 小時天氣預報"]
+
+        for period in forecast.periods:
+            lines.append("")
+            lines.append(f"{period.label}（{period.start[5:16]} ~ {period.end[11:16]}）")
+            lines.append(f"☁️ {period.weather}，{period.comfort}")
+            lines.append(f"🌡️ 溫度：{period.min_temp}°C ~ {period.max_temp}°C")
+            lines.append(f"💧 降雨機率：{period.rain}%")
 
+        # CWA 暫時無法連線、提供的是舊資料時標示資料年齡
+        if forecast_snapshot.is_stale():
             lines.append("")
-            lines.append(f"{period}（{start[5:16]} ~ {end[11:16]}）")
-            lines.append(f"☁️ {wx}，{ci}")
-            lines.append(f"🌡️ 溫度：{minT}°C ~ {maxT}°C")
-            lines.append(f"💧 降雨機率：{pop}%")
+            lines.append(f"⚠️ {format_data_age(forecast_snapshot.age())}")
 
         return "\n".join(lines)
 
-    except requests.exceptions.HTTPError as e:
-        return f"⚠️ API 請求失敗 (HTTP {response.status_code})"
-    except requests.exceptions.Timeout:
-        return "⏱️ 查詢逾時，請稍後再試"
-    except requests.exceptions.RequestException as e:
-        return f"❌ 網路錯誤: {str(e)}"
     except KeyError as e:
         return f"❌ 資料解析錯誤，請確認 API 回應格式"
     except Exception as e:
@@ -178,22 +918,21 @@ class WeatherForecast:
         self.location = location
         self.api_url = 'https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-C0032-001'
         self.result = ''
-        self.weather_data = []  # 儲存結構化資料用於 Flex Message
+        self.weather_data = []  # ForecastPeriod 列表，用於 Flex Message
+        self.data_age_note = None  # 提供舊資料時的年齡提示
 
     def get_period_name(self, start_time):
         """根據時間判斷時段並加上 emoji"""
-        hour = datetime.strptime(start_time, "%Y-%m-%d %H:%M:%S").hour
-        if 5 <= hour < 12:
-            return "🌅 早上"
-        elif 12 <= hour < 18:
-            return "☀️ 白天"
-        elif 18 <= hour < 24:
-            return "🌃 晚上"
-        else:
-            return "🌙 凌晨"
+        return get_period_name(start_time)
 
+    @timed_stage('fetch')
     def fetch(self):
-        """取得天氣預報資料"""
+        """
+        取得天氣預報資料
+
+        同一城市同時間的多個查詢經由 single-flight 合併，
+        只組裝一次，所有等待者共用同一份結果。
+        """
         if not cwa_api_key:
             print("Warning: CWA_API_KEY not set")
             self.result = "無法取得天氣資料：API Key 未設定"
@@ -205,72 +944,49 @@ class WeatherForecast:
             self.result = f"❌ 找不到「{self.location}」的天氣資料\n\n{cities_formatted}"
             return self.result
 
-        params = {
-            'Authorization': cwa_api_key,
-            'locationName': self.location
-        }
-        try:
-            # 禁用 SSL 驗證以避免 GitHub Actions 環境的憑證問題
-            response = requests.get(self.api_url, params=params, verify=False)
-            response.raise_for_status()
-            data = response.json()
+        self.result, self.weather_data, self.data_age_note = forecast_flight.do(
+            (FORECAST_DATASET, self.location), self._build)
+        return self.result
 
-            location_data = data['records']['location'][0]
-            location_name = location_data['locationName']
-            elements = location_data['weatherElement']
+    def _build(self):
+        """
+        從全台預報快照組出文字與 Flex 資料
 
-            # 建立元素對照表
-            element_map = {el['elementName']: el['time'] for el in elements}
+        Returns:
+            (文字結果, Flex 結構化資料, 資料年齡提示)
+        """
+        try:
+            # 從全台預報快照取得解析好的預報，不再每次呼叫 CWA
+            forecast = forecast_snapshot.get(self.location)
+            if forecast is None:
+                raise LookupError(f"{self.location} not in forecast snapshot")
 
             # 格式化訊息
-            lines = [f"*{location_name} 36 小時天氣預報*"]
-            self.weather_data = []  # 清空並重新填充
+            lines = [f"*{forecast.name} 36 小時天氣預報*"]
 
-            for i in range(3):
-                start = element_map['Wx'][i]['startTime']
-                end = element_map['Wx'][i]['endTime']
-                period = self.get_period_name(start)
+            for period in forecast.periods:
+                lines.append("")
+                lines.append(f"{period.label}({period.start[0:16]} ~ {period.end[11:16]})")
+                lines.append(f"{period.weather},{period.comfort}")
+                lines.append(f"溫度:{period.min_temp}°C ~ {period.max_temp}°C")
+                lines.append(f"降雨:{period.rain}%")
 
-                wx = element_map['Wx'][i]['parameter']['parameterName']
-                ci = element_map['CI'][i]['parameter']['parameterName']
-                minT = element_map['MinT'][i]['parameter']['parameterName']
-                maxT = element_map['MaxT'][i]['parameter']['parameterName']
-                pop = element_map['PoP'][i]['parameter']['parameterName']
+            # Flex Message 直接使用同一份時段資料
+            self.weather_data = list(forecast.periods)
 
+            # CWA 暫時無法連線、提供的是舊資料時標示資料年齡
+            if forecast_snapshot.is_stale():
+                self.data_age_note = format_data_age(forecast_snapshot.age())
                 lines.append("")
-                lines.append(f"{period}({start[0:16]} ~ {end[11:16]})")
-                lines.append(f"{wx},{ci}")
-                lines.append(f"溫度:{minT}°C ~ {maxT}°C")
-                lines.append(f"降雨:{pop}%")
-
-                # 儲存結構化資料用於 Flex Message
-                emoji_map = {"🌅 早上": "🌅", "☀️ 白天": "☀️",
-                             "🌃 晚上": "🌃", "🌙 凌晨": "🌙"}
-                period_text = period.replace(
-                    emoji_map.get(period, ""), "").strip()
-
-                # 第 3 個時段(索引 2)如果是"早上",加上"明天"前綴
-                if i == 2 and "早上" in period_text:
-                    period_text = "明天" + period_text
-
-                self.weather_data.append({
-                    "period": period_text,
-                    "emoji": emoji_map.get(period, "🌤️"),
-                    "time": f"{start[5:16]} - {end[5:16]}",
-                    "weather": wx,
-                    "comfort": ci,
-                    "minTemp": minT,
-                    "maxTemp": maxT,
-                    "rain": pop
-                })
+                lines.append(f"({self.data_age_note})")
 
             self.result = "\n".join(lines)
-            return self.result
 
         except Exception as e:
             print(f"Failed to fetch weather data: {e}")
             self.result = f"無法取得{self.location}天氣資料"
-            return self.result
+
+        return self.result, self.weather_data, self.data_age_note
 
     def get_flex_message(self):
         """取得 Flex Message 格式的天氣預報"""
@@ -280,24 +996,20 @@ class WeatherForecast:
         if "無法取得" in self.result or "未設定" in self.result:
             return None
 
-        return create_weather_flex_message(self.location, self.weather_data)
+        return create_weather_flex_message(
+            self.location, self.weather_data, note=self.data_age_note)
 
 
-def create_weather_flex_message(location_name, weather_data):
+@timed_stage('flex_build')
+def create_weather_flex_message(location_name, weather_data, note=None):
     """
     建立天氣預報的 Flex Message - V3 緊湊卡片風格
 
     Args:
         location_name: 地點名稱
-        weather_data: list of dict, 每個 dict 包含:
-            - period: 時段名稱
-            - emoji: emoji 圖示
-            - time: 時間範圍
-            - weather: 天氣狀況
-            - comfort: 舒適度
-            - minTemp: 最低溫度
-            - maxTemp: 最高溫度
-            - rain: 降雨機率
+        weather_data: ForecastPeriod 列表（使用 period、emoji、start、end、
+            weather、comfort、min_temp、max_temp、rain 欄位）
+        note: 附加在副標題的提示（例如提供舊資料時的資料年齡）
     """
     # 建立天氣項目
     contents = [
@@ -314,7 +1026,7 @@ def create_weather_flex_message(location_name, weather_data):
                 },
                 {
                     "type": "text",
-                    "text": "36 小時預報",
+                    "text": f"36 小時預報・{note}" if note else "36 小時預報",
                     "size": "xs",
                     "color": "#95A5A6",
                     "margin": "xs"
@@ -329,7 +1041,7 @@ def create_weather_flex_message(location_name, weather_data):
 
     for i, weather in enumerate(weather_data):
         # 降雨機率顏色
-        rain_percent = int(weather["rain"])
+        rain_percent = int(weather.rain)
         if rain_percent >= 70:
             rain_color = "#E53935"
         elif rain_percent >= 30:
@@ -349,7 +1061,7 @@ def create_weather_flex_message(location_name, weather_data):
                     "contents": [
                         {
                             "type": "text",
-                            "text": weather["emoji"],
+                            "text": weather.emoji,
                             "size": "lg",
                             "flex": 0,
                             "margin": "none"
@@ -360,14 +1072,14 @@ def create_weather_flex_message(location_name, weather_data):
                             "contents": [
                                 {
                                     "type": "text",
-                                    "text": weather["period"],
+                                    "text": weather.period,
                                     "weight": "bold",
                                     "size": "md",
                                     "color": "#2C3E50"
                                 },
                                 {
                                     "type": "text",
-                                    "text": weather["time"],
+                                    "text": f"{weather.start[5:16]} - {weather.end[5:16]}",
                                     "size": "xxs",
                                     "color": "#95A5A6"
                                 }
@@ -387,7 +1099,7 @@ def create_weather_flex_message(location_name, weather_data):
                     "contents": [
                         {
                             "type": "text",
-                            "text": weather["weather"],
+                            "text": weather.weather,
                             "size": "md",
                             "color": "#34495E",
                             "weight": "bold",
@@ -395,7 +1107,7 @@ def create_weather_flex_message(location_name, weather_data):
                         },
                         {
                             "type": "text",
-                            "text": weather["comfort"],
+                            "text": weather.comfort,
                             "size": "sm",
                             "color": "#7F8C8D",
                             "margin": "xs",
@@ -421,7 +1133,7 @@ def create_weather_flex_message(location_name, weather_data):
                                 },
                                 {
                                     "type": "text",
-                                    "text": f"{weather['minTemp']}° - {weather['maxTemp']}°",
+                                    "text": f"{weather.min_temp}° - {weather.max_temp}°",
                                     "size": "md",
                                     "weight": "bold",
                                     "color": "#FF6B35",
@@ -443,7 +1155,7 @@ def create_weather_flex_message(location_name, weather_data):
                                 },
                                 {
                                     "type": "text",
-                                    "text": f"{weather['rain']}%",
+                                    "text": f"{weather.rain}%",
                                     "size": "md",
                                     "weight": "bold",
                                     "color": rain_color,
@@ -0,0 +1,159 @@
+"""
+耐久佇列的事件消費者（獨立於 web 行程執行）
+從 durable_queue 取出 /callback 寫入的事件，以 app.py 註冊的處理函式處理
+
+    python webhook_consumer.py
+
+web 端需設定 WEBHOOK_DURABLE_QUEUE=1。可同時啟動多個 consumer（或設定
+WEBHOOK_CONSUMER_PROCESSES），以租約分配事件，處理量可獨立於 web 行程擴充到多核心。
+"""
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+from durable_queue import WEBHOOK_QUEUE_LEASE, DurableEventQueue
+from event_dispatcher import dispatch_event, parse_event
+
+# 載入環境變數
+load_dotenv()
+
+# consumer 行程數（每個行程各自有執行緒池）
+WEBHOOK_CONSUMER_PROCESSES = int(os.getenv('WEBHOOK_CONSUMER_PROCESSES', 1))
+
+# 每個行程同時處理的事件數
+WEBHOOK_CONSUMER_THREADS = int(os.getenv('WEBHOOK_CONSUMER_THREADS', 8))
+
+# 每次從佇列取出的事件數
+WEBHOOK_CONSUMER_BATCH = int(os.getenv('WEBHOOK_CONSUMER_BATCH', 32))
+
+# 佇列空的時候每隔幾秒檢查一次
+WEBHOOK_CONSUMER_POLL_INTERVAL = float(os.getenv('WEBHOOK_CONSUMER_POLL_INTERVAL', 0.2))
+
+# 每隔幾秒清除超過保留時間的已處理事件
+WEBHOOK_CONSUMER_PRUNE_INTERVAL = float(os.getenv('WEBHOOK_CONSUMER_PRUNE_INTERVAL', 600))
+
+
+class WebhookConsumer:
+    """
+    批次取出事件並以執行緒池平行處理，全部處理完才一次 ack
+
+    Args:
+        queue: DurableEventQueue
+        handler: linebot.v3.WebhookHandler（沿用 @handler.add 註冊的函式）
+        logger: 記錄處理失敗用的 logger
+    """
+
+    def __init__(self, queue, handler, logger, threads: int = WEBHOOK_CONSUMER_THREADS,
+                 batch_size: int = WEBHOOK_CONSUMER_BATCH):
+        self.queue = queue
+        self.handler = handler
+        self.logger = logger
+        self.batch_size = batch_size
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='webhook-consumer')
+
+        self.processed = 0
+        self.failed = 0
+        self._stop = threading.Event()
+
+    def _handle(self, item) -> str:
+        """處理一筆事件，回傳錯誤訊息（成功時為 None）"""
+        try:
+            event = parse_event(json.loads(item.event))
+            dispatch_event(self.handler, event, item.destination)
+        except Exception as e:
+            self.logger.exception(
+                "Webhook event failed. event_id=%s attempts=%d", item.event_id, item.attempts)
+            return str(e) or type(e).__name__
+        return None
+
+    def run_once(self) -> int:
+        """
+        取出並處理一批事件
+
+        Returns:
+            這一批的事件數
+        """
+        batch = self.queue.claim(self.batch_size)
+        if not batch:
+            return 0
+
+        done = []
+        for item, error in zip(batch, self.executor.map(self._handle, batch)):
+            if error is None:
+                done.append(item.id)
+                continue
+            self.failed += 1
+            # 退避後重試：1, 2, 4... 秒，最多一個租約長度
+            self.queue.fail(item, error, retry_in=min(2 ** (item.attempts - 1),
+                                                      WEBHOOK_QUEUE_LEASE))
+
+        self.queue.ack(done)
+        self.processed += len(done)
+        return len(batch)
+
+    def run(self):
+        """持續處理直到 stop()；處理中的批次會完成後才結束"""
+        next_prune = 0.0
+        while not self._stop.is_set():
+            if time.monotonic() >= next_prune:
+                self.queue.prune()
+                next_prune = time.monotonic() + WEBHOOK_CONSUMER_PRUNE_INTERVAL
+
+            if not self.run_once():
+                self._stop.wait(WEBHOOK_CONSUMER_POLL_INTERVAL)
+
+        self.executor.shutdown(wait=True)
+
+    def stop(self, *_):
+        """停止取出新的事件（可直接作為 signal handler）"""
+        self._stop.set()
+
+
+def run_consumer():
+    """單一 consumer 行程的進入點"""
+    # 匯入 app 以取得 @handler.add 註冊的處理函式，並啟動預報快照的 warm start
+    from app import app, handler
+
+    consumer = WebhookConsumer(DurableEventQueue(), handler, app.logger)
+    signal.signal(signal.SIGTERM, consumer.stop)
+    signal.signal(signal.SIGINT, consumer.stop)
+    app.logger.info("Webhook consumer started. pid=%d", os.getpid())
+    consumer.run()
+    app.logger.info(
+        "Webhook consumer stopped. pid=%d processed=%d failed=%d",
+        os.getpid(), consumer.processed, consumer.failed)
+
+
+def main():
+    if WEBHOOK_CONSUMER_PROCESSES <= 1:
+        run_consumer()
+        return
+
+    processes = [
+        multiprocessing.Process(target=run_consumer, name=f'webhook-consumer-{i}')
+        for i in range(WEBHOOK_CONSUMER_PROCESSES)
+    ]
+    for process in processes:
+        process.start()
+
+    def stop(*_):
+        for process in processes:
+            process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+    main()